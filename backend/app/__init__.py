@@ -1,24 +1,40 @@
-from flask import Flask
+from flask import Flask, jsonify
+from sqlalchemy.exc import SQLAlchemyError
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_migrate import Migrate
 from config import Config
 from flask_login import LoginManager
 from flask_cors import CORS
+from app.bloom import UsernameFilter
+from app.hashing import PasswordHasher
+from app.metrics import Metrics
+from app.ratelimit import RateLimiter
+from app.routing import ReplicaRouter, RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 bcrypt = Bcrypt()
+hasher = PasswordHasher()
 migrate = Migrate()
+replicas = ReplicaRouter()
+metrics = Metrics()
+limiter = RateLimiter()
 
 
 def create_app(config_class=Config):  # Allow passing a config class
     app = Flask(__name__)
-    CORS(app)  # Put CORS in the setup for flask app
+    # Put CORS in the setup for flask app; expose the pagination cursor and
+    # ETag headers
+    CORS(app, expose_headers=["X-Next-Cursor", "ETag"])
     app.config.from_object(config_class)
 
+    replicas.init_app(app)  # Adds replica binds, so before db
     db.init_app(app)
+    hasher.init_app(app)  # Calibrates BCRYPT_LOG_ROUNDS, so before bcrypt
     bcrypt.init_app(app)
     migrate.init_app(app, db)
+    metrics.init_app(app, db, hasher)
+    limiter.init_app(app)
     login_manager = LoginManager(app)
     login_manager.login_view = "auth.signin"
 
@@ -28,8 +44,103 @@ def create_app(config_class=Config):  # Allow passing a config class
     def load_user(user_id):
         return User.query.get(int(user_id))
 
+    from app.tokens import bearer_token, tokens
+
+    tokens.configure(app.config)
+
+    @login_manager.request_loader
+    def load_user_from_request(request):
+        # Only consulted without a session user: a valid bearer token
+        # authenticates with an HMAC check and, normally, no query
+        token = bearer_token(request)
+        return tokens.authenticate(token) if token else None
+
+    @login_manager.unauthorized_handler
+    def unauthorized():
+        # A JSON API: answer 401 rather than redirect to the POST-only signin
+        response = jsonify({"error": "Authentication required"})
+        response.headers["WWW-Authenticate"] = "Bearer"
+        return response, 401
+
     from app.auth import auth as auth_blueprint
 
     app.register_blueprint(auth_blueprint, url_prefix="/auth")
 
+    app.extensions["username_filter"] = UsernameFilter(
+        app.config["USERNAME_FILTER_CAPACITY"],
+        app.config["USERNAME_FILTER_ERROR_RATE"],
+    )
+    if app.config["USERNAME_FILTER_WARM_ON_STARTUP"]:
+        from app.auth import warm_username_filter
+
+        with app.app_context():
+            try:
+                warm_username_filter(app.extensions["username_filter"])
+            except SQLAlchemyError:
+                # e.g. migrations not applied yet; warmed on first use instead
+                app.logger.warning("Could not warm the username filter")
+            db.session.remove()
+
+    from app.expenses import expenses as expenses_blueprint
+
+    app.register_blueprint(expenses_blueprint, url_prefix="/expenses")
+
+    from app.dashboard import dashboard as dashboard_blueprint
+
+    app.register_blueprint(dashboard_blueprint, url_prefix="/dashboard")
+
+    from app.series import series_cache
+
+    series_cache.configure(app.config)
+
+    from app.budgets import budgets as budgets_blueprint, budgets_cli
+
+    app.register_blueprint(budgets_blueprint, url_prefix="/budgets")
+    app.cli.add_command(budgets_cli)
+
+    from app.recurring import recurring as recurring_blueprint, recurring_cli, \
+        start_scheduler
+
+    app.register_blueprint(recurring_blueprint, url_prefix="/recurring")
+    app.cli.add_command(recurring_cli)
+    app.extensions["recurring_scheduler"] = start_scheduler(app)
+
+    from app.events import broker, events as events_blueprint
+
+    broker.configure(app.config)
+    app.register_blueprint(events_blueprint, url_prefix="/events")
+
+    from app.rollups import rollups_cli
+
+    app.cli.add_command(rollups_cli)
+
+    from app.archive import archive_cli
+
+    app.cli.add_command(archive_cli)
+
+    from app.sync import sync as sync_blueprint, sync_cli
+
+    app.register_blueprint(sync_blueprint, url_prefix="/sync")
+    app.cli.add_command(sync_cli)
+
+    from app.attachments import attachments as attachments_blueprint, \
+        attachments_cli
+
+    app.register_blueprint(attachments_blueprint, url_prefix="/expenses")
+    app.cli.add_command(attachments_cli)
+
+    from app.fx import fx_cli, rates
+
+    rates.configure(app.config)
+    app.cli.add_command(fx_cli)
+
+    from app.jobs import jobs_cli
+
+    app.cli.add_command(jobs_cli)
+
+    from app.reset_tokens import reset_tokens_cli, start_sweeper
+
+    app.cli.add_command(reset_tokens_cli)
+    app.extensions["reset_token_sweeper"] = start_sweeper(app)
+
     return app
@@ -0,0 +1,309 @@
+import json
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from app import db
+from app.jobs import enqueue, job
+from app.models import Expense, ExpenseArchive
+from app.rollups import month_expr, month_key
+from app.util import utcnow
+
+# Every expense column, so an archived expense can be restored as it was.
+# Blobs name their columns, so adding one later leaves old blobs readable
+ARCHIVE_COLUMNS = ("id", "spent_at", "amount", "currency", "description",
+                   "category", "recurring_id", "created_at")
+COMPRESSION_LEVEL = 9  # Written once, read rarely
+_DECODERS = {
+    "spent_at": datetime.fromisoformat,
+    "created_at": datetime.fromisoformat,
+    "amount": Decimal,
+}
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_rows(rows):
+    """Compress ARCHIVE_COLUMNS row tuples into an archive blob."""
+    payload = {
+        "columns": ARCHIVE_COLUMNS,
+        "rows": [[_encode_value(value) for value in row] for row in rows],
+    }
+    return zlib.compress(
+        json.dumps(payload, separators=(",", ":")).encode("utf-8"), COMPRESSION_LEVEL
+    )
+
+
+def decode_rows(data, columns=ARCHIVE_COLUMNS):
+    """Row tuples of the given columns from an archive blob, oldest first."""
+    payload = json.loads(zlib.decompress(data))
+    indexes = [payload["columns"].index(name) for name in columns]
+    decoders = [_DECODERS.get(name) for name in columns]
+    return [
+        tuple(
+            value if decode is None or value is None else decode(value)
+            for value, decode in zip((row[index] for index in indexes), decoders)
+        )
+        for row in payload["rows"]
+    ]
+
+
+def _sort_key(row):
+    return row[1], row[0]  # (spent_at, id)
+
+
+def _month_range(month):
+    start = datetime(int(month[:4]), int(month[5:7]), 1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def _store(user_id, month, rows, archive=None):
+    """Write rows as the user's month blob, or drop it if rows is empty."""
+    if not rows:
+        db.session.delete(archive)
+        return
+    rows.sort(key=_sort_key)
+    values = {
+        "count": len(rows),
+        "first_id": min(row[0] for row in rows),
+        "last_id": max(row[0] for row in rows),
+        "data": encode_rows(rows),
+    }
+    if archive is None:
+        db.session.add(ExpenseArchive(user_id=user_id, month=month, **values))
+    else:
+        for name, value in values.items():
+            setattr(archive, name, value)
+
+
+def archive_month(user_id, month):
+    """Move one user's month of expenses into the archive; returns the count.
+
+    Rows are merged into the month's existing blob, if any (e.g. a backdated
+    expense added after the month was archived). The rollups are left as
+    they are, since the archived expenses still count. Doesn't commit.
+    """
+    start, end = _month_range(month)
+    columns = [getattr(Expense, name) for name in ARCHIVE_COLUMNS]
+    rows = [
+        tuple(row) for row in db.session.execute(
+            db.select(*columns)
+            .where(Expense.user_id == user_id, Expense.spent_at >= start,
+                   Expense.spent_at < end)
+            .with_for_update()
+        )
+    ]
+    if not rows:
+        return 0
+
+    archive = db.session.scalars(
+        db.select(ExpenseArchive)
+        .where(ExpenseArchive.user_id == user_id, ExpenseArchive.month == month)
+        .with_for_update()
+    ).first()
+    existing = decode_rows(archive.data) if archive is not None else []
+    _store(user_id, month, existing + rows, archive)
+    # Only the rows read above: anything inserted since stays hot until the
+    # next run
+    db.session.execute(
+        db.delete(Expense).where(Expense.id.in_([row[0] for row in rows])),
+        execution_options={"synchronize_session": False},
+    )
+    return len(rows)
+
+
+def archive_expenses(horizon_days, chunk_size=100):
+    """Archive every whole month older than horizon_days, for all users.
+
+    Works chunk_size (user, month) pairs per transaction and returns
+    (months, expenses) archived.
+    """
+    cutoff = month_key(utcnow() - timedelta(days=horizon_days))
+    cutoff = _month_range(cutoff)[0]
+    month = month_expr(Expense.spent_at)
+    archived_months = archived_expenses = 0
+    while True:
+        pairs = db.session.execute(
+            db.select(Expense.user_id, month)
+            .where(Expense.spent_at < cutoff)
+            .group_by(Expense.user_id, month)
+            .limit(chunk_size)
+        ).all()
+        if not pairs:
+            return archived_months, archived_expenses
+        for user_id, key in pairs:
+            archived_expenses += archive_month(user_id, key)
+            archived_months += 1
+        db.session.commit()
+
+
+def archive_months(user_id, start=None, end=None, newest_first=False):
+    """The user's archived months that may hold expenses in [start, end)."""
+    query = db.select(ExpenseArchive.month).where(ExpenseArchive.user_id == user_id)
+    if start is not None:
+        query = query.where(ExpenseArchive.month >= month_key(start))
+    if end is not None:
+        query = query.where(ExpenseArchive.month <= month_key(end))
+    order = ExpenseArchive.month.desc() if newest_first else ExpenseArchive.month
+    return db.session.scalars(query.order_by(order)).all()
+
+
+def archived_rows(user_id, months, columns, start=None, end=None):
+    """Yield the user's archived expenses in [start, end), oldest first.
+
+    months comes from archive_months(); blobs are fetched and decoded one
+    at a time, so memory holds a single month however long the range.
+    """
+    spent_at = ARCHIVE_COLUMNS.index("spent_at")
+    indexes = [ARCHIVE_COLUMNS.index(name) for name in columns]
+    for month in months:
+        data = db.session.scalar(
+            db.select(ExpenseArchive.data).where(
+                ExpenseArchive.user_id == user_id, ExpenseArchive.month == month
+            )
+        )
+        if data is None:
+            continue  # Restored away since archive_months()
+        for row in decode_rows(data):
+            if start is not None and row[spent_at] < start:
+                continue
+            if end is not None and row[spent_at] >= end:
+                continue
+            yield tuple(row[index] for index in indexes)
+
+
+def find_archived(user_id, expense_id, columns=ARCHIVE_COLUMNS):
+    """One archived expense as a tuple of columns, or None."""
+    blobs = db.session.scalars(
+        db.select(ExpenseArchive.data).where(
+            ExpenseArchive.user_id == user_id,
+            ExpenseArchive.first_id <= expense_id,
+            ExpenseArchive.last_id >= expense_id,
+        )
+    )
+    for data in blobs:
+        for row in decode_rows(data, columns):
+            if row[columns.index("id")] == expense_id:
+                return row
+    return None
+
+
+def find_archived_many(user_id, expense_ids, columns=ARCHIVE_COLUMNS):
+    """{id: tuple of columns} for those of expense_ids that are archived.
+
+    Each blob whose id range covers a wanted id is decoded once, however
+    many of the ids it holds.
+    """
+    wanted = set(expense_ids)
+    if not wanted:
+        return {}
+    blobs = db.session.execute(
+        db.select(ExpenseArchive.month, ExpenseArchive.first_id, ExpenseArchive.last_id)
+        .where(
+            ExpenseArchive.user_id == user_id,
+            ExpenseArchive.first_id <= max(wanted),
+            ExpenseArchive.last_id >= min(wanted),
+        )
+    ).all()
+    found = {}
+    index = columns.index("id")
+    for month, first_id, last_id in blobs:
+        if not any(first_id <= expense_id <= last_id
+                   for expense_id in wanted - found.keys()):
+            continue
+        data = db.session.scalar(
+            db.select(ExpenseArchive.data).where(
+                ExpenseArchive.user_id == user_id, ExpenseArchive.month == month
+            )
+        )
+        for row in decode_rows(data, columns) if data is not None else ():
+            if row[index] in wanted:
+                found[row[index]] = row
+    return found
+
+
+def restore_expense(user_id, expense_id):
+    """Move one archived expense back into the expense table.
+
+    Lets writes to an old expense go through the usual code path. Returns
+    False if it isn't archived. Doesn't commit.
+    """
+    archives = db.session.scalars(
+        db.select(ExpenseArchive)
+        .where(
+            ExpenseArchive.user_id == user_id,
+            ExpenseArchive.first_id <= expense_id,
+            ExpenseArchive.last_id >= expense_id,
+        )
+        .with_for_update()
+    ).all()
+    for archive in archives:
+        rows = decode_rows(archive.data)
+        for index, row in enumerate(rows):
+            if row[0] == expense_id:
+                del rows[index]
+                _store(user_id, archive.month, rows, archive)
+                db.session.execute(
+                    db.insert(Expense),
+                    {"user_id": user_id, **dict(zip(ARCHIVE_COLUMNS, row))},
+                )
+                return True
+    return False
+
+
+def archive_totals(user_ids):
+    """{(user_id, month, category, currency): (total, count)} from archives."""
+    totals = {}
+    rows = db.session.execute(
+        db.select(ExpenseArchive.user_id, ExpenseArchive.month, ExpenseArchive.data)
+        .where(ExpenseArchive.user_id.in_(user_ids))
+    )
+    for user_id, month, data in rows:
+        for amount, category, currency in decode_rows(
+                data, ("amount", "category", "currency")):
+            entry = totals.setdefault((user_id, month, category, currency),
+                                      [Decimal(0), 0])
+            entry[0] += amount
+            entry[1] += 1
+    return {key: tuple(value) for key, value in totals.items()}
+
+
+@job("archive_expenses")
+def archive_job(horizon_days=None, chunk_size=100):
+    if horizon_days is None:
+        horizon_days = current_app.config["ARCHIVE_HORIZON_DAYS"]
+    months, expenses = archive_expenses(horizon_days, chunk_size)
+    current_app.logger.info("Archived %d expense(s) in %d month(s)", expenses, months)
+
+
+archive_cli = AppGroup("archive", help="Move old expenses to cold storage.")
+
+
+@archive_cli.command("run")
+@click.option("--horizon-days", type=int, default=None,
+              help="Archive whole months older than this [ARCHIVE_HORIZON_DAYS].")
+@click.option("--chunk-size", default=100, show_default=True,
+              help="User months archived per transaction.")
+@click.option("--background", is_flag=True,
+              help="Queue the run for `flask jobs work` instead.")
+def run_command(horizon_days, chunk_size, background):
+    """Archive expenses older than the horizon."""
+    if horizon_days is None:
+        horizon_days = current_app.config["ARCHIVE_HORIZON_DAYS"]
+    if background:
+        job_id = enqueue("archive_expenses", horizon_days=horizon_days,
+                         chunk_size=chunk_size)
+        db.session.commit()
+        click.echo(f"Queued job {job_id}")
+        return
+    months, expenses = archive_expenses(horizon_days, chunk_size)
+    click.echo(f"Archived {expenses} expense(s) in {months} month(s)")
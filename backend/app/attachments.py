@@ -0,0 +1,450 @@
+import glob
+import hashlib
+import os
+import tempfile
+from collections import Counter
+from datetime import timedelta
+import click
+from flask import Blueprint, Response, current_app, jsonify, request, send_file
+from flask.cli import AppGroup
+from flask_login import current_user, login_required
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.utils import secure_filename
+from app import db
+from app.archive import find_archived
+from app.jobs import enqueue, job
+from app.models import Attachment, Blob, Expense
+from app.serializers import ATTACHMENT
+from app.util import utcnow
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Optional: only thumbnails need it
+    Image = ImageOps = None
+
+attachments = Blueprint("attachments", __name__)
+
+# Content types are sniffed from the first bytes; the declared type is ignored
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"%PDF-", "application/pdf"),
+)
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp",
+              "application/pdf": "pdf"}
+THUMBNAIL_QUALITY = 80
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def sniff_mimetype(head):
+    for signature, mimetype in SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def blob_path(sha256):
+    # Fanned out over two directory levels so no directory grows huge
+    return os.path.join(current_app.config["ATTACHMENT_DIR"], "blobs",
+                        sha256[:2], sha256[2:4], sha256)
+
+
+def thumbnail_path(sha256, size):
+    return os.path.join(current_app.config["ATTACHMENT_DIR"], "thumbs",
+                        sha256[:2], f"{sha256}-{size}.jpg")
+
+
+def _temp_dir():
+    # Inside the store, so finished files are renamed into place rather
+    # than copied across filesystems
+    path = os.path.join(current_app.config["ATTACHMENT_DIR"], "tmp")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_temp(stream, max_bytes, chunk_size):
+    """Copy stream to a temp file in the store, hashing as it goes.
+
+    Memory holds one chunk whatever the upload's size. Returns (path,
+    sha256, size, first bytes); raises UploadTooLarge past max_bytes,
+    having removed the temp file.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    fd, path = tempfile.mkstemp(dir=_temp_dir(), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, digest.hexdigest(), size, head
+
+
+def retain_blob(sha256, size, mimetype):
+    """Count one more reference to a blob, creating its row if new."""
+    table = Blob.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(table).values(sha256=sha256, size=size, mimetype=mimetype,
+                                    refcount=1, unreferenced_at=None)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.sha256],
+            set_={"refcount": table.c.refcount + 1, "unreferenced_at": None},
+        )
+        db.session.execute(stmt)
+    else:
+        updated = db.session.execute(
+            db.update(table).where(table.c.sha256 == sha256)
+            .values(refcount=table.c.refcount + 1, unreferenced_at=None)
+        ).rowcount
+        if not updated:
+            db.session.execute(db.insert(table).values(
+                sha256=sha256, size=size, mimetype=mimetype, refcount=1))
+
+
+def release_blobs(sha256s):
+    """Drop one reference per listed sha; unreferenced blobs wait for gc."""
+    table = Blob.__table__
+    now = utcnow()
+    for sha256, count in Counter(sha256s).items():
+        remaining = table.c.refcount - count
+        db.session.execute(
+            db.update(table).where(table.c.sha256 == sha256).values(
+                refcount=remaining,
+                unreferenced_at=db.case((remaining <= 0, now),
+                                        else_=table.c.unreferenced_at),
+            )
+        )
+
+
+def detach_expenses(user_id, expense_ids):
+    """Delete the attachments of deleted expenses, in the caller's transaction."""
+    where = (Attachment.user_id == user_id, Attachment.expense_id.in_(expense_ids))
+    if db.session.get_bind().dialect.delete_returning:
+        sha256s = db.session.scalars(
+            db.delete(Attachment).where(*where).returning(Attachment.blob_sha256),
+            execution_options={"synchronize_session": False},
+        ).all()
+    else:
+        sha256s = db.session.scalars(
+            db.select(Attachment.blob_sha256).where(*where).with_for_update()
+        ).all()
+        db.session.execute(db.delete(Attachment).where(*where),
+                           execution_options={"synchronize_session": False})
+    release_blobs(sha256s)
+
+
+def _expense_exists(expense_id):
+    hot = db.session.scalar(
+        db.select(Expense.id).where(Expense.id == expense_id,
+                                    Expense.user_id == current_user.id)
+    )
+    return hot is not None or find_archived(current_user.id, expense_id, ("id",))
+
+
+def _find_attachment(expense_id, attachment_id):
+    return db.session.execute(
+        db.select(Attachment.filename, Blob.sha256, Blob.mimetype)
+        .join(Blob, Blob.sha256 == Attachment.blob_sha256)
+        .where(Attachment.id == attachment_id, Attachment.expense_id == expense_id,
+               Attachment.user_id == current_user.id)
+    ).first()
+
+
+def _upload_source():
+    """(stream, filename) of a multipart "file" field or a raw request body."""
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("file")
+        if upload is None:
+            return None, None
+        return upload.stream, upload.filename
+    return request.stream, request.args.get("filename")
+
+
+def _send(path, mimetype, etag, download_name=None):
+    # conditional=True answers If-None-Match with 304 and Range with 206
+    # from the file itself, and the file goes out through the server's
+    # wsgi.file_wrapper (sendfile) where it has one
+    try:
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=etag,
+                             download_name=download_name,
+                             max_age=current_app.config["ATTACHMENT_MAX_AGE"])
+    except FileNotFoundError:
+        return jsonify({"error": "Attachment not found"}), 404
+    # Content never changes under a sha, but the receipt is the user's
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    return response
+
+
+@attachments.route("/<int:expense_id>/attachments", methods=["POST"])
+@login_required
+def upload_attachment(expense_id):
+    config = current_app.config
+    if not _expense_exists(expense_id):
+        return jsonify({"error": "Expense not found"}), 404
+    if request.mimetype != "multipart/form-data" and \
+            (request.content_length or 0) > config["ATTACHMENT_MAX_BYTES"]:
+        # A raw body says its size up front: refuse before reading a byte
+        return jsonify({"error": "Attachment too large"}), 413
+    stream, filename = _upload_source()
+    if stream is None:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    try:
+        temp, sha256, size, head = write_temp(
+            stream, config["ATTACHMENT_MAX_BYTES"], config["ATTACHMENT_CHUNK_SIZE"]
+        )
+    except UploadTooLarge:
+        return jsonify({"error": "Attachment too large"}), 413
+    try:
+        mimetype = sniff_mimetype(head)
+        if size == 0 or mimetype is None:
+            return jsonify({"error": "Attachments must be JPEG, PNG, WebP or PDF"}), 415
+
+        filename = secure_filename(filename or "")[:255] or \
+            f"receipt.{EXTENSIONS[mimetype]}"
+        retain_blob(sha256, size, mimetype)
+        attachment = Attachment(user_id=current_user.id, expense_id=expense_id,
+                                blob_sha256=sha256, filename=filename)
+        db.session.add(attachment)
+        db.session.commit()
+
+        # Only once our reference is committed: a failed commit leaves nothing
+        # on disk, and gc can no longer remove the file under it. Replacing
+        # identical bytes is harmless when the content was already stored
+        path = blob_path(sha256)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp, path)
+        except OSError:
+            current_app.logger.exception("Could not store attachment %s", sha256)
+            db.session.delete(attachment)
+            release_blobs([sha256])
+            db.session.commit()
+            return jsonify({"error": "Could not store attachment"}), 500
+    finally:
+        if os.path.exists(temp):
+            os.unlink(temp)
+
+    row = db.session.execute(
+        ATTACHMENT.select().join(Blob, Blob.sha256 == Attachment.blob_sha256)
+        .where(Attachment.id == attachment.id)
+    ).one()
+    return jsonify(ATTACHMENT.row_dict(row)), 201
+
+
+@attachments.route("/<int:expense_id>/attachments", methods=["GET"])
+@login_required
+def list_attachments(expense_id):
+    if not _expense_exists(expense_id):
+        return jsonify({"error": "Expense not found"}), 404
+    rows = db.session.execute(
+        ATTACHMENT.select().join(Blob, Blob.sha256 == Attachment.blob_sha256)
+        .where(Attachment.user_id == current_user.id,
+               Attachment.expense_id == expense_id)
+        .order_by(Attachment.id)
+    )
+    return Response(ATTACHMENT.dumps(rows), mimetype="application/json")
+
+
+@attachments.route("/<int:expense_id>/attachments/<int:attachment_id>",
+                   methods=["GET"])
+@login_required
+def download_attachment(expense_id, attachment_id):
+    row = _find_attachment(expense_id, attachment_id)
+    if row is None:
+        return jsonify({"error": "Attachment not found"}), 404
+    filename, sha256, mimetype = row
+    return _send(blob_path(sha256), mimetype, sha256, download_name=filename)
+
+
+@attachments.route("/<int:expense_id>/attachments/<int:attachment_id>/thumbnail",
+                   methods=["GET"])
+@login_required
+def attachment_thumbnail(expense_id, attachment_id):
+    sizes = current_app.config["ATTACHMENT_THUMBNAIL_SIZES"]
+    size = request.args.get("size", sizes[0])
+    if not str(size).isdigit() or int(size) not in sizes:
+        return jsonify({"error": "Size must be one of "
+                                 + ", ".join(str(s) for s in sizes)}), 400
+    size = int(size)
+    row = _find_attachment(expense_id, attachment_id)
+    if row is None:
+        return jsonify({"error": "Attachment not found"}), 404
+    _, sha256, mimetype = row
+    if not mimetype.startswith("image/"):
+        return jsonify({"error": "Thumbnails are only available for images"}), 415
+
+    path = thumbnail_path(sha256, size)
+    if not os.path.exists(path):
+        if Image is None:
+            return jsonify({"error": "Thumbnails are not available"}), 501
+        try:
+            render_thumbnail(blob_path(sha256), path, size)
+        except FileNotFoundError:
+            return jsonify({"error": "Attachment not found"}), 404
+        except (OSError, Image.DecompressionBombError):
+            return jsonify({"error": "Could not read image"}), 422
+    return _send(path, "image/jpeg", f"{sha256}-{size}")
+
+
+def render_thumbnail(source, path, size):
+    """Write a JPEG thumbnail of source, fitting in size x size, to path.
+
+    Rendered once on first request and kept next to the blobs; written
+    under a temp name and renamed, so concurrent requests never see half a
+    file.
+    """
+    with Image.open(source) as image:
+        # Lets JPEG decode at a fraction of full size, far cheaper for photos
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        image = image.convert("RGB")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=_temp_dir(), suffix=".jpg")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                image.save(out, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+
+@attachments.route("/<int:expense_id>/attachments/<int:attachment_id>",
+                   methods=["DELETE"])
+@login_required
+def delete_attachment(expense_id, attachment_id):
+    attachment = Attachment.query.filter_by(
+        id=attachment_id, expense_id=expense_id, user_id=current_user.id
+    ).first()
+    if attachment is None:
+        return jsonify({"error": "Attachment not found"}), 404
+    db.session.delete(attachment)
+    release_blobs([attachment.blob_sha256])
+    db.session.commit()
+    return jsonify({"message": "Attachment deleted successfully"}), 200
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _set_aside(sha256):
+    """Move a blob's file out of the store; returns (set-aside path, original).
+
+    Renamed rather than unlinked, so a rolled back gc can put it back, and an
+    upload of the same bytes committing after gc writes a fresh file at the
+    original path that the later unlink can't touch.
+    """
+    path = blob_path(sha256)
+    aside = os.path.join(_temp_dir(), f"{sha256}.gc")
+    try:
+        os.replace(path, aside)
+    except FileNotFoundError:
+        return None
+    return aside, path
+
+
+def collect_garbage(grace_seconds, chunk_size=500):
+    """Delete blobs unreferenced for grace_seconds, with their files.
+
+    Files are deleted only once the rows' deletion has committed; if the
+    commit fails they are put back. An upload of the same bytes racing with
+    gc either waits on the row and stores the file again after its own
+    commit, or claims the row first so gc leaves it alone. Returns (blobs,
+    bytes) freed.
+    """
+    cutoff = utcnow() - timedelta(seconds=grace_seconds)
+    blobs = freed = 0
+    while True:
+        candidates = db.session.execute(
+            db.select(Blob.sha256, Blob.size)
+            .where(Blob.refcount <= 0, Blob.unreferenced_at <= cutoff,
+                   ~db.exists().where(Attachment.blob_sha256 == Blob.sha256))
+            .limit(chunk_size)
+        ).all()
+        if not candidates:
+            return blobs, freed
+        removed, set_aside = [], []
+        try:
+            for sha256, size in candidates:
+                # Recheck under the row lock: an upload may have claimed it since
+                deleted = db.session.execute(
+                    db.delete(Blob).where(Blob.sha256 == sha256, Blob.refcount <= 0)
+                ).rowcount
+                if deleted:
+                    removed.append((sha256, size))
+                    moved = _set_aside(sha256)
+                    if moved is not None:
+                        set_aside.append(moved)
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            for aside, path in set_aside:
+                os.replace(aside, path)
+            raise
+        for aside, _ in set_aside:
+            _unlink(aside)
+        for sha256, size in removed:
+            # Thumbnails are a cache: one dropped by mistake is rendered again
+            for path in glob.glob(thumbnail_path(sha256, "*")):
+                _unlink(path)
+            blobs += 1
+            freed += size
+
+
+@job("attachments_gc")
+def gc_job(grace_seconds=None, chunk_size=500):
+    if grace_seconds is None:
+        grace_seconds = current_app.config["ATTACHMENT_GC_GRACE_SECONDS"]
+    blobs, freed = collect_garbage(grace_seconds, chunk_size)
+    current_app.logger.info("Removed %d attachment file(s), %d bytes", blobs, freed)
+
+
+attachments_cli = AppGroup("attachments", help="Manage stored receipt files.")
+
+
+@attachments_cli.command("gc")
+@click.option("--grace-seconds", type=int, default=None,
+              help="Keep unreferenced files this long [ATTACHMENT_GC_GRACE_SECONDS].")
+@click.option("--chunk-size", default=500, show_default=True,
+              help="Files removed per transaction.")
+@click.option("--background", is_flag=True,
+              help="Queue the run for `flask jobs work` instead.")
+def gc_command(grace_seconds, chunk_size, background):
+    """Remove stored files no attachment refers to."""
+    if grace_seconds is None:
+        grace_seconds = current_app.config["ATTACHMENT_GC_GRACE_SECONDS"]
+    if background:
+        job_id = enqueue("attachments_gc", grace_seconds=grace_seconds,
+                         chunk_size=chunk_size)
+        db.session.commit()
+        click.echo(f"Queued job {job_id}")
+        return
+    blobs, freed = collect_garbage(grace_seconds, chunk_size)
+    click.echo(f"Removed {blobs} file(s), {freed} bytes")
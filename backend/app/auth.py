@@ -1,13 +1,61 @@
 import re
-from flask import Blueprint, request, jsonify
+from flask import (
+    Blueprint, Response, request, jsonify, current_app, has_app_context,
+    stream_with_context,
+)
 from flask_login import LoginManager, login_required, login_user, current_user
-from app import db, bcrypt
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from app import db, hasher, limiter
+from app.expenses import CURRENCY_PATTERN
+from app.hashing import HasherBusy
+from app.jobs import enqueue
 from app.models import User
+from app.ratelimit import retry_after
+from app.reset_tokens import redeem_reset_token
+from app.serializers import USER
+from app.tokens import TokenUser, bump_credential_version, tokens
+from app.versions import bump_user_version, conditional, users_version
 
 auth = Blueprint("auth", __name__)
 login_manager = LoginManager()
 login_manager.login_view = "auth.signin"
 
+DEFAULT_USER_FIELDS = ("username", "email")
+
+# Endpoints that hash a password or could probe accounts
+RATE_LIMITED_ENDPOINTS = {
+    "auth.signup", "auth.signin", "auth.issue_token", "auth.change_password",
+    "auth.password_reset", "auth.request_password_reset",
+}
+
+
+@auth.before_request
+def rate_limit():
+    # Runs before the view, so a throttled request costs no query and no hash
+    if request.endpoint not in RATE_LIMITED_ENDPOINTS:
+        return None
+    keys = [("auth_ip", request.remote_addr)]
+    data = request.get_json(silent=True)
+    email = data.get("email") if isinstance(data, dict) else None
+    if isinstance(email, str) and email.strip():
+        # Caps guesses against one account however many IPs they come from
+        keys.append(("auth_email", email.strip().lower()))
+    wait = limiter.hit(*keys)
+    if not wait:
+        return None
+    response = jsonify({"error": "Too many attempts, please try again later"})
+    response.headers["Retry-After"] = retry_after(wait)
+    return response, 429
+
+
+@auth.errorhandler(HasherBusy)
+def hasher_busy(error):
+    # Shed load instead of queueing behind a burst of bcrypt work
+    response = jsonify({"error": "Server is busy, please try again"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
 
 @auth.route("/signup", methods=["POST"])
 def signup():
@@ -16,21 +64,37 @@ def signup():
     email = data.get("email")
     password = data.get("password")
 
-    # Check if the username or email already exists
-    user_exists = User.query.filter(
-        (User.email == email) | (User.username == username)
-    ).first()
+    # Check if the username or email already exists, ignoring case. Two
+    # EXISTS probes in one round trip, each a point lookup on its own lower()
+    # index, where a single OR filter could not use either index
+    user_exists = db.session.scalar(
+        db.select(
+            db.or_(
+                db.select(User.id)
+                .where(db.func.lower(User.email) == db.func.lower(email or ""))
+                .exists(),
+                db.select(User.id)
+                .where(db.func.lower(User.username) == db.func.lower(username or ""))
+                .exists(),
+            )
+        )
+    )
 
     if user_exists:
         return jsonify({"error": "Username or email already exists"}), 400
 
     # Hash the password
-    hashed_password = bcrypt.generate_password_hash(password).decode("utf-8")
+    hashed_password = hasher.generate_password_hash(password)
 
     # Create a new user and add to the database
     user = User(username=username, email=email, password=hashed_password)
     db.session.add(user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent signup took the name or email after the check above
+        db.session.rollback()
+        return jsonify({"error": "Username or email already exists"}), 400
 
     return jsonify({"message": "User created successfully"}), 201
 
@@ -41,11 +105,8 @@ def signin():
     email = data.get("email")
     password = data.get("password")
 
-    # Check if the user exists
-    user = User.query.filter_by(email=email).first()
-
-    # Check if the user password matches
-    if user is None or not bcrypt.check_password_hash(user.password, password):
+    user = check_credentials(email, password)
+    if user is None:
         return jsonify({"error": "Invalid email or password"}), 401
 
     # Log the user in
@@ -54,13 +115,167 @@ def signin():
     return jsonify({"message": f"Welcome back, {user.username}!"}), 200
 
 
+@auth.route("/token", methods=["POST"])
+def issue_token():
+    # Bearer tokens for clients that don't keep cookies: requests carrying
+    # one authenticate without a session or a user query
+    data = request.get_json()
+    user = check_credentials(data.get("email"), data.get("password"))
+    if user is None:
+        return jsonify({"error": "Invalid email or password"}), 401
+
+    return jsonify(tokens.issue(user)), 200
+
+
+@auth.route("/token/refresh", methods=["POST"])
+def refresh_token():
+    data = request.get_json(silent=True) or {}
+    user = tokens.refresh(str(data.get("refresh_token") or ""))
+    if user is None:
+        return jsonify({"error": "Invalid or expired refresh token"}), 401
+
+    return jsonify(tokens.issue(user)), 200
+
+
+def check_credentials(email, password):
+    """Return the user if email and password match, else None."""
+    # Check if the user exists
+    user = find_user_by_email(email or "")
+
+    # Check if the user password matches
+    if user is None or not hasher.check_password_hash(user.password, password):
+        return None
+
+    # Upgrade hashes made at an older, cheaper cost while we have the password
+    if hasher.needs_rehash(user.password):
+        user.password = hasher.generate_password_hash(password)
+        db.session.commit()
+    return user
+
+
+def find_user_by_email(email):
+    return User.query.filter(db.func.lower(User.email) == email.lower()).first()
+
+
+def username_filter():
+    usernames = current_app.extensions["username_filter"]
+    if not usernames.warmed:
+        warm_username_filter(usernames)
+    return usernames
+
+
+def warm_username_filter(usernames):
+    # Raw names, lowered in Python: SQLite's lower() only folds ASCII, and
+    # the filter must fold exactly like might_exist() does
+    result = db.session.execute(
+        db.select(User.username).execution_options(yield_per=10000)
+    )
+    usernames.warm(result.scalars())
+
+
+@event.listens_for(User, "after_insert")
+def remember_username(mapper, connection, user):
+    if not has_app_context():
+        return
+    usernames = current_app.extensions.get("username_filter")
+    if usernames is not None:
+        usernames.add(user.username)
+
+
 @auth.route("/users", methods=["GET"])
+@conditional(users_version)
 def list_users():
-    users = User.query.all()  # Query all users from the database
-    user_list = [
-        {"username": user.username, "email": user.email} for user in users
-    ]  # Create a list of user details
-    return jsonify(user_list)  # Return the list as a JSON response
+    fields = request.args.get("fields")
+    names = tuple(fields.split(",")) if fields else DEFAULT_USER_FIELDS
+    try:
+        schema = USER.only(names)
+    except KeyError as error:
+        return jsonify({"error": f"Unknown field: {error.args[0]}"}), 400
+
+    try:
+        after = int(request.args.get("after", 0))
+        limit = request.args.get("limit")
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        return jsonify({"error": "after and limit must be integers"}), 400
+    if limit is not None and limit < 1:
+        return jsonify({"error": "Limit must be a positive integer"}), 400
+
+    # Select plain columns (never the password hash, never ORM objects) in
+    # primary key order; id is always fetched last to drive the cursor
+    stmt = schema.select(User.id).where(User.id > after).order_by(User.id)
+
+    if limit is not None:
+        # A bounded page: fetch one extra row to know if there is a next one
+        limit = min(limit, current_app.config["USERS_MAX_PAGE_SIZE"])
+        rows = db.session.execute(stmt.limit(limit + 1)).all()
+        response = Response(schema.dumps(rows[:limit]), mimetype="application/json")
+        if len(rows) > limit:
+            response.headers["X-Next-Cursor"] = str(rows[limit - 1][-1])
+        return response
+
+    # The full list is streamed: rows are fetched yield_per at a time from a
+    # server-side cursor and written out as they arrive, so memory stays flat
+    # however many users there are
+    batch_size = current_app.config["USERS_STREAM_BATCH_SIZE"]
+    result = db.session.execute(stmt.execution_options(yield_per=batch_size))
+    return Response(
+        stream_with_context(schema.iter_dumps(result.partitions())),
+        mimetype="application/json",
+    )
+
+
+@auth.route("/username-available", methods=["GET"])
+def username_available():
+    username = (request.args.get("username") or "").strip()
+    if not username:
+        return jsonify({"error": "Username is required"}), 400
+
+    # Called on every keystroke: a Bloom filter miss proves the name is free
+    # without touching the database; only possible hits are confirmed there
+    available = True
+    if username_filter().might_exist(username):
+        available = not db.session.scalar(
+            db.select(
+                db.select(User.id)
+                .where(db.func.lower(User.username) == db.func.lower(username))
+                .exists()
+            )
+        )
+
+    return jsonify({"username": username, "available": available}), 200
+
+
+@auth.route("/home-currency", methods=["PUT"])
+@login_required
+def set_home_currency():
+    data = request.get_json(silent=True) or {}
+    currency = str(data.get("currency") or "").strip().upper()
+    if not CURRENCY_PATTERN.match(currency):
+        return jsonify({"error": "Currency must be a 3-letter ISO 4217 code"}), 400
+
+    current_user.home_currency = currency
+    # Every dashboard total changes with it
+    bump_user_version(current_user.id)
+    db.session.commit()
+
+    return jsonify({"home_currency": currency}), 200
+
+
+@auth.route("/password-reset/request", methods=["POST"])
+def request_password_reset():
+    data = request.get_json(silent=True) or {}
+    email = (data.get("email") or "").strip()
+    if not email:
+        return jsonify({"error": "Email is required"}), 400
+
+    # The lookup, token and email all happen in a background job, so the
+    # response is immediate and the same whether or not the account exists
+    enqueue("password_reset_email", email=email)
+    db.session.commit()
+    return jsonify(
+        {"message": "If that email has an account, a reset link is on its way"}
+    ), 202
 
 
 @auth.route("/password-reset", methods=["POST"])
@@ -69,16 +284,20 @@ def password_reset():
     token = data.get("token")
     new_password = data.get("password")
 
-    # Find user by reset token
-    user = User.query.filter_by(reset_token=token).first()
-    if not user:
+    if not token or not new_password:
+        return jsonify({"error": "Token and password are required"}), 400
+
+    # One indexed lookup on the token hash. Claiming the token and changing
+    # the password commit together, so a failed reset leaves it usable
+    user_id = redeem_reset_token(token)
+    if user_id is None:
+        db.session.rollback()
         return jsonify({"error": "Invalid or expired token"}), 400
 
-    # Update the user's password
-    hashed_password = bcrypt.generate_password_hash(
-        new_password).decode("utf-8")
-    user.password = hashed_password
-    user.reset_token = None  # Invalidate the token
+    # Update the user's password; tokens issued before the reset stop working
+    user = db.session.get(User, user_id)
+    user.password = hasher.generate_password_hash(new_password)
+    bump_credential_version(user_id)
     db.session.commit()
 
     return jsonify({"message": "Your password has been reset successfully"}), 200
@@ -99,7 +318,7 @@ def change_password():
         return jsonify({"error": "New password is required"}), 400
 
     # Validate that the current password is correct
-    if not bcrypt.check_password_hash(current_user.password, current_password):
+    if not hasher.check_password_hash(current_user.password, current_password):
         return jsonify({"error": "Incorrect current password"}), 400
 
     # Validate the new password (e.g., length, complexity)
@@ -109,10 +328,15 @@ def change_password():
             400,
         )
 
-    # Hash the new password and update the user record
-    hashed_password = bcrypt.generate_password_hash(
-        new_password).decode("utf-8")
+    # Hash the new password and update the user record, revoking every
+    # token issued so far
+    hashed_password = hasher.generate_password_hash(new_password)
     current_user.password = hashed_password
+    bump_credential_version(current_user.id)
     db.session.commit()
 
-    return jsonify({"message": "Password updated successfully"}), 200
+    payload = {"message": "Password updated successfully"}
+    if isinstance(current_user._get_current_object(), TokenUser):
+        # A token client would otherwise be signed out by its own change
+        payload.update(tokens.issue(db.session.get(User, current_user.id)))
+    return jsonify(payload), 200
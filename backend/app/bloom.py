@@ -0,0 +1,71 @@
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter: no false negatives, tunable false positives."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: k positions from two independent 64-bit halves
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class UsernameFilter:
+    """Every lower-cased username, answered from memory.
+
+    A miss means the name is definitely free; a hit still has to be
+    confirmed against the database. Names inserted by other processes are
+    only picked up by the next warm(), so signup's own uniqueness check
+    stays authoritative.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.warmed = False
+        self._lock = threading.Lock()
+        self._added_while_warming = None
+
+    def warm(self, usernames):
+        """Rebuild from an iterable of usernames, lower-cased here like add()."""
+        with self._lock:
+            self._added_while_warming = []
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        for username in usernames:
+            bloom.add(username.lower())
+        with self._lock:
+            # Keep names inserted while the scan was running
+            for username in self._added_while_warming:
+                bloom.add(username)
+            self._added_while_warming = None
+            self.bloom = bloom
+            self.warmed = True
+
+    def add(self, username):
+        with self._lock:
+            self.bloom.add(username.lower())
+            if self._added_while_warming is not None:
+                self._added_while_warming.append(username.lower())
+
+    def might_exist(self, username):
+        return username.lower() in self.bloom
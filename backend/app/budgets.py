@@ -0,0 +1,383 @@
+import logging
+from collections import defaultdict
+from decimal import Decimal
+import click
+from flask import Blueprint, Response, current_app, jsonify, request
+from flask.cli import AppGroup
+from flask_login import current_user, login_required
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.expenses import CURRENCY_PATTERN, parse_amount, parse_limit
+from app.fx import CENT, MissingRate, month_end, rates
+from app.models import Budget, BudgetAlert, ExpenseRollup
+from app.rollups import month_key
+from app.serializers import ALERT, BUDGET
+from app.util import utcnow
+
+budgets = Blueprint("budgets", __name__)
+logger = logging.getLogger(__name__)
+
+
+def _budget_rows(condition):
+    # Budgets joined to the rollup rows they cover: the rollups are the
+    # running monthly totals, already updated in the current transaction
+    return db.session.execute(
+        db.select(
+            Budget.id, Budget.user_id, Budget.category, Budget.amount,
+            Budget.currency, ExpenseRollup.month, ExpenseRollup.currency,
+            ExpenseRollup.total,
+        )
+        .join(
+            ExpenseRollup,
+            db.and_(
+                ExpenseRollup.user_id == Budget.user_id,
+                ExpenseRollup.category == Budget.category,
+                ExpenseRollup.month >= Budget.start_month,
+            ),
+        )
+        .where(condition)
+    ).all()
+
+
+def _convert(amount, currency, target, day, found):
+    if currency == target:
+        return amount
+    source, dest = found.get((currency, day)), found.get((target, day))
+    if source is None or dest is None:
+        raise MissingRate(currency if source is None else target, day)
+    return amount * source / dest
+
+
+def _rates_for(pairs):
+    """Fetch rates for (currency, target, month) conversions in one batch."""
+    keys = set()
+    for currency, target, month in pairs:
+        if currency != target:
+            keys.update(((currency, month_end(month)), (target, month_end(month))))
+    if not keys:
+        return {}
+    rates.sync()
+    return rates.rates(keys)
+
+
+def _budget_months(rows):
+    """Group _budget_rows() by (budget, month): budget info and per-currency totals."""
+    months = {}
+    for budget_id, user_id, category, amount, currency, month, spent_currency, total \
+            in rows:
+        entry = months.setdefault(
+            (budget_id, month),
+            {"budget_id": budget_id, "user_id": user_id, "category": category,
+             "amount": amount, "currency": currency, "month": month, "totals": {}},
+        )
+        entry["totals"][spent_currency] = Decimal(total)
+    return months
+
+
+def _spent(entry, found, totals=None):
+    day = month_end(entry["month"])
+    return sum(
+        (_convert(total, currency, entry["currency"], day, found)
+         for currency, total in (totals or entry["totals"]).items()),
+        Decimal(0),
+    )
+
+
+def _record_alert(entry, threshold, spent):
+    """Insert an alert unless one exists; returns its payload if inserted."""
+    values = {
+        "budget_id": entry["budget_id"],
+        "month": entry["month"],
+        "threshold": threshold,
+        "spent": spent.quantize(CENT),
+    }
+    table = BudgetAlert.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        # DO NOTHING rather than failing the expense write when a concurrent
+        # transaction recorded the same alert first
+        inserted = db.session.execute(
+            insert(table)
+            .values(**values)
+            .on_conflict_do_nothing(
+                index_elements=[table.c.budget_id, table.c.month, table.c.threshold]
+            )
+            .returning(table.c.id)
+        ).first()
+    else:
+        inserted = not db.session.scalar(
+            db.select(
+                db.select(table.c.id)
+                .where(
+                    table.c.budget_id == values["budget_id"],
+                    table.c.month == values["month"],
+                    table.c.threshold == threshold,
+                )
+                .exists()
+            )
+        )
+        if inserted:
+            db.session.execute(db.insert(table), values)
+    if not inserted:
+        return None
+    return {
+        "budget_id": entry["budget_id"],
+        "category": entry["category"],
+        "month": entry["month"],
+        "threshold": threshold,
+        "spent": float(values["spent"]),
+        "amount": float(entry["amount"]),
+        "currency": entry["currency"],
+    }
+
+
+def check_budgets(applied):
+    """Record alerts for thresholds an expense write just crossed.
+
+    applied is RollupDelta.apply()'s list of row deltas. Each affected
+    (user, month, category) costs one joined lookup of its rollup rows, so
+    the check is constant-time however many expenses the month holds: the
+    spend before the write is the running total minus the write's own delta.
+    Returns the payloads of newly recorded alerts, to publish after commit.
+    """
+    deltas = defaultdict(lambda: defaultdict(Decimal))
+    for row in applied:
+        key = (row["user_id"], row["month"], row["category"])
+        deltas[key][row["currency"]] += Decimal(row["total"])
+    # Only spending more can cross a threshold
+    keys = [key for key, change in deltas.items() if any(v > 0 for v in change.values())]
+    if not keys:
+        return []
+
+    months = _budget_months(_budget_rows(
+        db.tuple_(Budget.user_id, ExpenseRollup.month, Budget.category).in_(keys)
+    ))
+    thresholds = current_app.config["BUDGET_ALERT_THRESHOLDS"]
+    found = _rates_for(
+        (currency, entry["currency"], entry["month"])
+        for entry in months.values()
+        for currency in entry["totals"].keys() | deltas[
+            (entry["user_id"], entry["month"], entry["category"])].keys()
+    )
+
+    alerts = []
+    for entry in months.values():
+        change = deltas[(entry["user_id"], entry["month"], entry["category"])]
+        try:
+            spent = _spent(entry, found)
+            before = spent - _spent(entry, found, change)
+        except MissingRate as error:
+            # Never fail the expense write; reconcile_budgets() catches up
+            logger.warning("Budget %s not checked: %s", entry["budget_id"], error)
+            continue
+        for threshold in thresholds:
+            limit = entry["amount"] * threshold / 100
+            if before < limit <= spent:
+                alert = _record_alert(entry, threshold, spent)
+                if alert is not None:
+                    alerts.append(alert)
+    return alerts
+
+
+def reconcile_budgets(chunk_size=500):
+    """Record every alert whose threshold is reached but was never recorded.
+
+    Covers writes that bypassed check_budgets(), rollup rebuilds and rates
+    loaded after the fact. Works a chunk of budgets per transaction and
+    returns the alerts created.
+    """
+    created = []
+    thresholds = current_app.config["BUDGET_ALERT_THRESHOLDS"]
+    last_id = 0
+    while True:
+        budget_ids = db.session.scalars(
+            db.select(Budget.id).where(Budget.id > last_id).order_by(Budget.id)
+            .limit(chunk_size)
+        ).all()
+        if not budget_ids:
+            return created
+        last_id = budget_ids[-1]
+
+        months = _budget_months(_budget_rows(Budget.id.in_(budget_ids)))
+        recorded = set(db.session.execute(
+            db.select(BudgetAlert.budget_id, BudgetAlert.month, BudgetAlert.threshold)
+            .where(BudgetAlert.budget_id.in_(budget_ids))
+        ).all())
+        found = _rates_for(
+            (currency, entry["currency"], entry["month"])
+            for entry in months.values() for currency in entry["totals"]
+        )
+        for entry in months.values():
+            try:
+                spent = _spent(entry, found)
+            except MissingRate:
+                continue
+            for threshold in thresholds:
+                key = (entry["budget_id"], entry["month"], threshold)
+                if key not in recorded and spent >= entry["amount"] * threshold / 100:
+                    alert = _record_alert(entry, threshold, spent)
+                    if alert is not None:
+                        created.append(alert)
+        db.session.commit()
+
+
+def validate_budget(data, partial=False):
+    """Return (fields, error) for an incoming budget payload."""
+    fields = {}
+    if "category" in data or not partial:
+        category = (data.get("category") or "").strip()
+        if not category:
+            return None, "Category is required"
+        if len(category) > 50:
+            return None, "Category must be 50 characters or fewer"
+        fields["category"] = category
+
+    if "amount" in data or not partial:
+        amount = parse_amount(data.get("amount"))
+        if amount is None or amount <= 0:
+            return None, "Amount must be a positive number"
+        fields["amount"] = amount
+
+    if data.get("currency") not in (None, ""):
+        currency = str(data.get("currency")).strip().upper()
+        if not CURRENCY_PATTERN.match(currency):
+            return None, "Currency must be a 3-letter ISO 4217 code"
+        fields["currency"] = currency
+    return fields, None
+
+
+def category_taken(category, exclude_id=None):
+    query = db.select(Budget.id).where(
+        Budget.user_id == current_user.id, Budget.category == category
+    )
+    if exclude_id is not None:
+        query = query.where(Budget.id != exclude_id)
+    return db.session.scalar(db.select(query.exists()))
+
+
+def budget_payloads(budget_list, month):
+    """Payloads with the month's spend, from one rollup query for all budgets.
+
+    spent is None for a budget whose rates are missing.
+    """
+    months = _budget_months(_budget_rows(
+        db.and_(Budget.id.in_([budget.id for budget in budget_list]),
+                ExpenseRollup.month == month)
+    )) if budget_list else {}
+    found = _rates_for(
+        (currency, entry["currency"], month)
+        for entry in months.values() for currency in entry["totals"]
+    )
+    payloads = []
+    for budget in budget_list:
+        entry = months.get((budget.id, month))
+        spent = Decimal(0)
+        if entry is not None:
+            try:
+                spent = _spent(entry, found)
+            except MissingRate:
+                spent = None
+        payload = BUDGET.dump(budget)
+        payload["month"] = month
+        payload["spent"] = float(spent.quantize(CENT)) if spent is not None else None
+        payloads.append(payload)
+    return payloads
+
+
+def budget_payload(budget, month):
+    return budget_payloads([budget], month)[0]
+
+
+@budgets.route("", methods=["GET"])
+@login_required
+def list_budgets():
+    month = month_key(utcnow())
+    rows = Budget.query.filter_by(user_id=current_user.id).order_by(Budget.category)
+    return jsonify(budget_payloads(rows.all(), month)), 200
+
+
+@budgets.route("", methods=["POST"])
+@login_required
+def create_budget():
+    data = request.get_json(silent=True) or {}
+    fields, error = validate_budget(data)
+    if error:
+        return jsonify({"error": error}), 400
+    if category_taken(fields["category"]):
+        return jsonify({"error": "A budget for this category already exists"}), 400
+
+    fields.setdefault("currency", current_user.home_currency)
+    month = month_key(utcnow())
+    budget = Budget(user_id=current_user.id, start_month=month, **fields)
+    db.session.add(budget)
+    db.session.commit()
+
+    return jsonify(budget_payload(budget, month)), 201
+
+
+@budgets.route("/<int:budget_id>", methods=["PUT"])
+@login_required
+def update_budget(budget_id):
+    budget = Budget.query.filter_by(id=budget_id, user_id=current_user.id).first()
+    if budget is None:
+        return jsonify({"error": "Budget not found"}), 404
+
+    data = request.get_json(silent=True) or {}
+    fields, error = validate_budget(data, partial=True)
+    if error:
+        return jsonify({"error": error}), 400
+    if "category" in fields and category_taken(fields["category"], budget.id):
+        return jsonify({"error": "A budget for this category already exists"}), 400
+
+    for name, value in fields.items():
+        setattr(budget, name, value)
+    db.session.commit()
+
+    return jsonify(budget_payload(budget, month_key(utcnow()))), 200
+
+
+@budgets.route("/<int:budget_id>", methods=["DELETE"])
+@login_required
+def delete_budget(budget_id):
+    budget = Budget.query.filter_by(id=budget_id, user_id=current_user.id).first()
+    if budget is None:
+        return jsonify({"error": "Budget not found"}), 404
+
+    db.session.delete(budget)
+    db.session.commit()
+    return jsonify({"message": "Budget deleted successfully"}), 200
+
+
+@budgets.route("/alerts", methods=["GET"])
+@login_required
+def list_alerts():
+    limit = parse_limit(request.args.get("limit"), 50, 200)
+    if limit is None:
+        return jsonify({"error": "Limit must be a positive integer"}), 400
+
+    rows = db.session.execute(
+        ALERT.select()
+        .join(Budget, Budget.id == BudgetAlert.budget_id)
+        .where(Budget.user_id == current_user.id)
+        .order_by(BudgetAlert.id.desc())
+        .limit(limit)
+    ).all()
+    return Response(ALERT.dumps(rows), mimetype="application/json")
+
+
+budgets_cli = AppGroup("budgets", help="Maintain budget alerts.")
+
+
+@budgets_cli.command("reconcile")
+@click.option("--chunk-size", default=500, show_default=True,
+              help="Budgets checked per transaction.")
+def reconcile_command(chunk_size):
+    """Record alerts for thresholds reached without one being recorded."""
+    created = reconcile_budgets(chunk_size)
+    for alert in created:
+        click.echo(
+            f"budget={alert['budget_id']} month={alert['month']} "
+            f"threshold={alert['threshold']}% spent={alert['spent']}"
+        )
+    click.echo(f"{len(created)} missing alert(s) recorded")
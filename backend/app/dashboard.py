@@ -0,0 +1,167 @@
+import json
+import re
+from flask import Blueprint, Response, current_app, g, request, jsonify
+from flask_login import login_required, current_user
+from app import db
+from app.expenses import parse_datetime
+from app.fx import FX_VERSION, convert_monthly, rates
+from app.models import DataVersion, ExpenseRollup, User
+from app.serializers import ROLLUP
+from app.series import (
+    BUCKETS, RANGES, advance, bucket_count, bucket_rows, build_series, downsample,
+    series_cache, truncate,
+)
+from app.util import utcnow
+from app.versions import conditional
+
+dashboard = Blueprint("dashboard", __name__)
+
+MONTH_PATTERN = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+
+def summary_version():
+    # Totals change with the user's data or with newly loaded rates; both
+    # counters come back from one round trip
+    data_version, fx_version = db.session.execute(
+        db.select(
+            User.data_version,
+            db.select(DataVersion.version)
+            .where(DataVersion.name == FX_VERSION)
+            .scalar_subquery(),
+        ).where(User.id == current_user.id)
+    ).one()
+    return f"u{current_user.id}.{data_version}.fx{fx_version or 0}"
+
+
+@dashboard.route("/summary", methods=["GET"])
+@login_required
+@conditional(summary_version)
+def summary():
+    start = request.args.get("from")
+    end = request.args.get("to")
+    for value in (start, end):
+        if value is not None and not MONTH_PATTERN.match(value):
+            return jsonify({"error": "Months must be formatted as YYYY-MM"}), 400
+
+    # Reads only the rollup rows (months x categories), never raw expenses
+    query = ROLLUP.select().where(ExpenseRollup.user_id == current_user.id)
+    if start:
+        query = query.where(ExpenseRollup.month >= start)
+    if end:
+        query = query.where(ExpenseRollup.month <= end)
+    rows = db.session.execute(query).all()
+
+    # Rollups are kept per currency; all the rates needed are looked up in
+    # one batch, then rows are converted and merged in memory
+    home = current_user.home_currency
+    rates.sync()
+    totals, unconverted = convert_monthly(rows, home)
+
+    response = Response(
+        ROLLUP.dumps(
+            (month, category, home, total, count)
+            for (month, category), (total, count) in sorted(totals.items())
+        ),
+        mimetype="application/json",
+    )
+    if unconverted:
+        # Spending in these currencies is left out of the totals until
+        # their rates are loaded
+        response.headers["X-Unconverted-Currencies"] = ",".join(unconverted)
+    return response
+
+
+def parse_series_args(args):
+    """Return (params, error) for a /series query.
+
+    The window is whole buckets ending with the one holding `end` (default
+    now), so every request within one bucket resolves to the same window and
+    can share a cached body.
+    """
+    config = current_app.config
+    range_name = args.get("range", "month")
+    if range_name not in RANGES:
+        return None, f"Range must be one of: {', '.join(RANGES)}"
+    span, bucket = RANGES[range_name]
+    bucket = args.get("bucket", bucket)
+    if bucket not in BUCKETS:
+        return None, f"Bucket must be one of: {', '.join(BUCKETS)}"
+
+    try:
+        points = int(args.get("points", config["SERIES_DEFAULT_POINTS"]))
+    except ValueError:
+        return None, "Points must be an integer"
+    if not 3 <= points <= config["SERIES_MAX_POINTS"]:
+        return None, f"Points must be between 3 and {config['SERIES_MAX_POINTS']}"
+
+    end = parse_datetime(args["end"]) if "end" in args else utcnow()
+    if end is None:
+        return None, "End must be an ISO 8601 date or datetime"
+    try:
+        end = advance(truncate(end, bucket), bucket)
+        start = truncate(end - span, bucket)
+    except (OverflowError, ValueError):
+        # The window would run past year 1 or year 9999
+        return None, "End is out of range"
+    if bucket_count(start, end, bucket) > config["SERIES_MAX_BUCKETS"]:
+        return None, "Bucket is too small for this range"
+
+    category = (args.get("category") or "").strip() or None
+    return {
+        "range": range_name,
+        "bucket": bucket,
+        "from": start,
+        "to": end,
+        "points": points,
+        "category": category,
+    }, None
+
+
+def series_version():
+    # The resolved window is part of the tag: the same URL covers a later
+    # window once a new bucket starts. The data version is kept for the
+    # view's cache
+    g.series_data_version = version = summary_version()
+    params, error = parse_series_args(request.args)
+    if error:
+        return version
+    return f"{version}.{params['to']:%Y%m%d%H%M}"
+
+
+@dashboard.route("/series", methods=["GET"])
+@login_required
+@conditional(series_version)
+def series():
+    params, error = parse_series_args(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # The data version read for the ETag doubles as the cache tag: any
+    # expense write or rate load changes it
+    version = g.series_data_version
+    home = current_user.home_currency
+    key = (params["bucket"], params["from"], params["to"], params["points"],
+           params["category"], home)
+    body = series_cache.get(current_user.id, version, key)
+    if body is None:
+        # Bucketing, summing and running totals happen in one SQL query;
+        # only the non-empty buckets ever leave the database
+        rows = bucket_rows(current_user.id, params["from"], params["to"],
+                           params["bucket"], params["category"])
+        rates.sync()
+        points, unconverted = build_series(rows, home)
+        kept = downsample(points, params["points"])
+        body = json.dumps({
+            "range": params["range"],
+            "bucket": params["bucket"],
+            "from": params["from"].isoformat(),
+            "to": params["to"].isoformat(),
+            "currency": home,
+            "buckets": len(points),
+            "downsampled": len(kept) < len(points),
+            "points": kept,
+            # Currencies left out of the points for want of a rate
+            "unconverted": unconverted,
+        })
+        series_cache.put(current_user.id, version, key, body)
+    return Response(body, mimetype="application/json")
@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+from collections import OrderedDict, defaultdict, deque
+from flask import Blueprint, Response, current_app, jsonify, request
+from flask_login import login_required, current_user
+
+events = Blueprint("events", __name__)
+
+
+class Subscription:
+    """One connected client's pending events."""
+
+    def __init__(self, max_pending):
+        self.pending = deque()
+        self.max_pending = max_pending
+        self.overflowed = False
+        self.condition = threading.Condition()
+
+    def push(self, record):
+        with self.condition:
+            if len(self.pending) >= self.max_pending:
+                # A client this far behind resyncs instead of growing the queue
+                self.pending.clear()
+                self.overflowed = True
+            else:
+                self.pending.append(record)
+            self.condition.notify()
+
+    def wait(self, timeout):
+        """Return queued records, or an empty list once timeout expires."""
+        with self.condition:
+            if not self.pending and not self.overflowed:
+                self.condition.wait(timeout)
+            records = list(self.pending)
+            self.pending.clear()
+            if self.overflowed:
+                self.overflowed = False
+                records.append(None)
+            return records
+
+
+class EventBroker:
+    """In-process pub/sub of per-user change events.
+
+    Each user keeps a short history so a reconnecting EventSource can resume
+    from its Last-Event-ID. Event ids are "<epoch>-<seq>" where the epoch is
+    unique to this process, so ids from before a restart are recognised and
+    answered with a reset event rather than silently missing changes.
+    """
+
+    def __init__(self, history_size=256, max_users=10000, max_pending=1000,
+                 max_streams=100):
+        self.epoch = os.urandom(4).hex()
+        self.history_size = history_size
+        self.max_users = max_users
+        self.max_pending = max_pending
+        self.max_streams = max_streams
+        self._streams = 0
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._history = OrderedDict()  # user_id -> deque of records, LRU
+        # user_id -> last seq trimmed from that user's history. Kept only
+        # while the history is, so it stays bounded by max_users; a user
+        # evicted whole falls back to the _evicted watermark instead
+        self._dropped = {}
+        self._evicted = 0  # Last seq at which a whole history was evicted
+        self._subscribers = defaultdict(set)
+
+    def configure(self, config):
+        self.history_size = config["SSE_HISTORY_SIZE"]
+        self.max_pending = config["SSE_MAX_PENDING"]
+        self.max_streams = config["SSE_MAX_STREAMS"]
+
+    def publish(self, user_id, event, data):
+        payload = json.dumps(data)
+        with self._lock:
+            self._seq += 1
+            record = (self._seq, event, payload)
+
+            history = self._history.get(user_id)
+            if history is None:
+                history = self._history[user_id] = deque()
+                if self._evicted:
+                    # Whatever this user had before may have been evicted
+                    self._dropped[user_id] = self._evicted
+                if len(self._history) > self.max_users:
+                    evicted, _ = self._history.popitem(last=False)
+                    self._dropped.pop(evicted, None)
+                    self._evicted = self._seq
+            self._history.move_to_end(user_id)
+            history.append(record)
+            if len(history) > self.history_size:
+                self._dropped[user_id] = history.popleft()[0]
+
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.push(record)
+
+    def subscribe(self, user_id, last_event_id=None):
+        """A new Subscription, or None once max_streams are open."""
+        subscription = Subscription(self.max_pending)
+        with self._lock:
+            if self._streams >= self.max_streams:
+                return None
+            self._streams += 1
+            self._subscribers[user_id].add(subscription)
+            if last_event_id is not None:
+                epoch, _, seq = last_event_id.partition("-")
+                seq = int(seq) if seq.isdigit() else None
+                if user_id in self._history:
+                    dropped = self._dropped.get(user_id, 0)
+                else:
+                    dropped = self._evicted
+                if epoch != self.epoch or seq is None or seq < dropped:
+                    # The events since last_event_id are gone
+                    subscription.overflowed = True
+                else:
+                    for record in self._history.get(user_id, ()):
+                        if record[0] > seq:
+                            subscription.pending.append(record)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is not None and subscription in subscribers:
+                subscribers.remove(subscription)
+                self._streams -= 1
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def format(self, record):
+        if record is None:
+            return "event: reset\ndata: {}\n\n"
+        seq, event, payload = record
+        return f"id: {self.epoch}-{seq}\nevent: {event}\ndata: {payload}\n\n"
+
+
+broker = EventBroker()
+
+
+# Each open stream parks a worker thread in Subscription.wait() between
+# events, so a process serves at most SSE_MAX_STREAMS of them and answers 503
+# past that, keeping threads free for ordinary requests. Keep it below the
+# server's thread count (e.g. gunicorn --threads).
+@events.route("", methods=["GET"])
+@login_required
+def stream():
+    user_id = current_user.id
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get(
+        "last_event_id"
+    )
+    heartbeat = current_app.config["SSE_HEARTBEAT_SECONDS"]
+    retry_ms = current_app.config["SSE_RETRY_MS"]
+
+    # Subscribe before returning so nothing published in between is lost
+    subscription = broker.subscribe(user_id, last_event_id)
+    if subscription is None:
+        response = jsonify({"error": "Too many open event streams"})
+        response.headers["Retry-After"] = str(max(1, retry_ms // 1000))
+        return response, 503
+
+    def generate():
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            while True:
+                records = subscription.wait(heartbeat)
+                if not records:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield "".join(broker.format(record) for record in records)
+        finally:
+            broker.unsubscribe(user_id, subscription)
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Also when the client goes away before the generator ever starts
+    response.call_on_close(lambda: broker.unsubscribe(user_id, subscription))
+    return response
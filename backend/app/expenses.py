@@ -0,0 +1,512 @@
+import base64
+import binascii
+import heapq
+import itertools
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from flask_login import login_required, current_user
+from app import db
+from app.archive import archive_months, archived_rows, find_archived, restore_expense
+from app.events import broker
+from app.exports import CSV_COLUMNS, iter_csv, iter_gzip
+from app.imports import detect_format, iter_rows
+from app.models import Expense
+from app.rollups import RollupDelta, month_key
+from app.search import decode_search_cursor, encode_search_cursor, search_expenses
+from app.serializers import EXPENSE
+from app.util import utcnow
+from app.versions import bump_user_version, conditional, current_user_version
+
+expenses = Blueprint("expenses", __name__)
+
+CURRENCY_PATTERN = re.compile(r"^[A-Z]{3}$")
+
+
+# Amounts are Numeric(12, 2): ten digits before the point
+MAX_AMOUNT = Decimal(10) ** 10
+
+
+def parse_amount(value):
+    try:
+        amount = Decimal(str(value))
+        if not amount.is_finite() or abs(amount) >= MAX_AMOUNT:
+            return None
+        return amount.quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def parse_datetime(value):
+    # Accept ISO dates or datetimes; aware values are normalized to naive UTC
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def validate_expense(data, partial=False):
+    """Return (fields, error) for an incoming expense payload."""
+    if not isinstance(data, dict):
+        return None, "Expense must be a JSON object"
+    for name in ("description", "category"):
+        if data.get(name) is not None and not isinstance(data[name], str):
+            return None, f"{name.capitalize()} must be a string"
+    fields = {}
+
+    if "amount" in data or not partial:
+        if data.get("amount") in (None, ""):
+            return None, "Amount is required"
+        amount = parse_amount(data.get("amount"))
+        if amount is None:
+            return None, "Amount must be a number"
+        fields["amount"] = amount
+
+    if "description" in data or not partial:
+        description = (data.get("description") or "").strip()
+        if not description:
+            return None, "Description is required"
+        if len(description) > 255:
+            return None, "Description must be 255 characters or fewer"
+        fields["description"] = description
+
+    if "category" in data or not partial:
+        category = (data.get("category") or "").strip()
+        if not category:
+            return None, "Category is required"
+        if len(category) > 50:
+            return None, "Category must be 50 characters or fewer"
+        fields["category"] = category
+
+    # Left unset when absent; callers default to the user's home currency
+    if data.get("currency") not in (None, ""):
+        currency = str(data.get("currency")).strip().upper()
+        if not CURRENCY_PATTERN.match(currency):
+            return None, "Currency must be a 3-letter ISO 4217 code"
+        fields["currency"] = currency
+
+    if data.get("spent_at") not in (None, ""):
+        spent_at = parse_datetime(data.get("spent_at"))
+        if spent_at is None:
+            return None, "Invalid spent_at date"
+        fields["spent_at"] = spent_at
+    elif not partial:
+        fields["spent_at"] = utcnow()
+
+    return fields, None
+
+
+def encode_cursor(spent_at, expense_id):
+    raw = f"{spent_at.isoformat()}|{expense_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        spent_at, expense_id = (
+            base64.urlsafe_b64decode(padded).decode("utf-8").split("|")
+        )
+        return datetime.fromisoformat(spent_at), int(expense_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def parse_limit(value, default, maximum):
+    try:
+        limit = int(value) if value is not None else default
+    except ValueError:
+        return None
+    if limit < 1:
+        return None
+    return min(limit, maximum)
+
+
+def apply_write(user_id, rollup, upserted=(), deleted=()):
+    """Finish an expense write inside its transaction, before the commit.
+
+    Applies the rollup changes, bumps the user's data version, records the
+    ids of written and deleted expenses in the sync change log at that
+    version, detaches deleted expenses' receipts and checks budgets against
+    the new totals. Returns budget alerts to publish once the transaction
+    has committed.
+    """
+    # All three modules import this one
+    from app.attachments import detach_expenses
+    from app.budgets import check_budgets
+    from app.sync import record_changes
+
+    applied = rollup.apply()
+    record_changes(user_id, bump_user_version(user_id), upserted, deleted)
+    if deleted:
+        detach_expenses(user_id, deleted)
+    return check_budgets(applied)
+
+
+def publish_alerts(user_id, alerts):
+    for alert in alerts:
+        broker.publish(user_id, "budget.alert", alert)
+
+
+def find_expense(expense_id):
+    """The current user's expense for a write, restoring it if archived."""
+    expense = Expense.query.filter_by(id=expense_id, user_id=current_user.id).first()
+    if expense is None and restore_expense(current_user.id, expense_id):
+        expense = Expense.query.filter_by(
+            id=expense_id, user_id=current_user.id).first()
+    return expense
+
+
+def merge_archived_page(rows, limit, position):
+    """Merge archived expenses into a page of hot rows, newest first.
+
+    rows are up to limit + 1 hot rows after the cursor position. Only
+    archived rows newer than the last of them can land on the page, so the
+    archive is read only when the page reaches back to an archived month.
+    Months are decoded newest first from the cursor's, one at a time, until
+    the page is full with rows no older month could displace, so a page
+    costs the months it spans however long the history.
+    """
+    lower = tuple(rows[limit][-2:]) if len(rows) > limit else None
+    upper = tuple(position) if position is not None else None
+    months = archive_months(
+        current_user.id,
+        start=lower[0] if lower is not None else None,
+        end=upper[0] if upper is not None else None,
+        newest_first=True,
+    )
+    if not months:
+        return rows
+
+    # The same shape as the hot rows: the schema's columns, then the cursor's
+    columns = [column.key for column in EXPENSE.columns] + ["spent_at", "id"]
+    page = list(rows)
+    for month in months:
+        page.extend(
+            row for row in archived_rows(current_user.id, [month], columns)
+            if (lower is None or row[-2:] > lower)
+            and (upper is None or row[-2:] < upper)
+        )
+        page.sort(key=lambda row: tuple(row[-2:]), reverse=True)
+        del page[limit + 1:]
+        # Every older month's rows sort after the page's last row
+        if len(page) > limit and month_key(page[-1][-2]) >= month:
+            break
+    return page
+
+
+@expenses.route("", methods=["GET"])
+@login_required
+@conditional(current_user_version)
+def list_expenses():
+    limit = parse_limit(
+        request.args.get("limit"),
+        current_app.config["EXPENSES_PAGE_SIZE"],
+        current_app.config["EXPENSES_MAX_PAGE_SIZE"],
+    )
+    if limit is None:
+        return jsonify({"error": "Limit must be a positive integer"}), 400
+
+    # Newest first; the cursor is the (spent_at, id) of the last row already
+    # seen, so every page is a range scan on ix_expense_user_spent_at instead
+    # of an OFFSET that re-reads all previous pages
+    query = EXPENSE.select(Expense.spent_at, Expense.id).where(
+        Expense.user_id == current_user.id
+    )
+    position = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.where(
+            db.tuple_(Expense.spent_at, Expense.id) < db.tuple_(*position)
+        )
+
+    rows = db.session.execute(
+        query.order_by(Expense.spent_at.desc(), Expense.id.desc()).limit(limit + 1)
+    ).all()
+    rows = merge_archived_page(rows, limit, position)
+
+    response = Response(EXPENSE.dumps(rows[:limit]), mimetype="application/json")
+    if len(rows) > limit:
+        # The cursor columns were appended after the schema's own
+        spent_at, expense_id = rows[limit - 1][-2:]
+        response.headers["X-Next-Cursor"] = encode_cursor(spent_at, expense_id)
+    return response
+
+
+@expenses.route("/search", methods=["GET"])
+@login_required
+@conditional(current_user_version)
+def search():
+    text = request.args.get("q", "")
+    if not text.strip():
+        return jsonify({"error": "Query is required"}), 400
+    limit = parse_limit(
+        request.args.get("limit"),
+        current_app.config["SEARCH_PAGE_SIZE"],
+        current_app.config["EXPENSES_MAX_PAGE_SIZE"],
+    )
+    if limit is None:
+        return jsonify({"error": "Limit must be a positive integer"}), 400
+
+    # Ranked by relevance; the cursor is the (score, id) of the last row seen
+    position = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        position = decode_search_cursor(cursor)
+        if position is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    rows = search_expenses(current_user.id, text, limit, position, EXPENSE.columns)
+
+    response = Response(EXPENSE.dumps(rows[:limit]), mimetype="application/json")
+    if len(rows) > limit:
+        score, expense_id = rows[limit - 1][-2:]
+        response.headers["X-Next-Cursor"] = encode_search_cursor(score, expense_id)
+    return response
+
+
+@expenses.route("", methods=["POST"])
+@login_required
+def create_expense():
+    data = request.get_json(silent=True) or {}
+    fields, error = validate_expense(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    fields.setdefault("currency", current_user.home_currency)
+    expense = Expense(user_id=current_user.id, **fields)
+    db.session.add(expense)
+    db.session.flush()  # Assigns the id for the change log
+
+    rollup = RollupDelta()
+    rollup.add(expense.user_id, expense.spent_at, expense.category, expense.amount,
+               expense.currency)
+    alerts = apply_write(expense.user_id, rollup, upserted=[expense.id])
+    db.session.commit()
+
+    payload = EXPENSE.dump(expense)
+    broker.publish(expense.user_id, "expense.created", payload)
+    publish_alerts(expense.user_id, alerts)
+    return jsonify(payload), 201
+
+
+@expenses.route("/<int:expense_id>", methods=["GET"])
+@login_required
+@conditional(current_user_version)
+def get_expense(expense_id):
+    row = db.session.execute(
+        EXPENSE.select().where(Expense.id == expense_id,
+                               Expense.user_id == current_user.id)
+    ).first()
+    if row is None:
+        row = find_archived(current_user.id, expense_id,
+                            tuple(column.key for column in EXPENSE.columns))
+    if row is None:
+        return jsonify({"error": "Expense not found"}), 404
+
+    return jsonify(EXPENSE.row_dict(row)), 200
+
+
+@expenses.route("/<int:expense_id>", methods=["PUT"])
+@login_required
+def update_expense(expense_id):
+    expense = find_expense(expense_id)
+    if expense is None:
+        return jsonify({"error": "Expense not found"}), 404
+
+    data = request.get_json(silent=True) or {}
+    fields, error = validate_expense(data, partial=True)
+    if error:
+        return jsonify({"error": error}), 400
+
+    rollup = RollupDelta()
+    rollup.remove(expense.user_id, expense.spent_at, expense.category,
+                  expense.amount, expense.currency)
+    for name, value in fields.items():
+        setattr(expense, name, value)
+    rollup.add(expense.user_id, expense.spent_at, expense.category, expense.amount,
+               expense.currency)
+    alerts = apply_write(expense.user_id, rollup, upserted=[expense.id])
+    db.session.commit()
+
+    payload = EXPENSE.dump(expense)
+    broker.publish(expense.user_id, "expense.updated", payload)
+    publish_alerts(expense.user_id, alerts)
+    return jsonify(payload), 200
+
+
+@expenses.route("/<int:expense_id>", methods=["DELETE"])
+@login_required
+def delete_expense(expense_id):
+    expense = find_expense(expense_id)
+    if expense is None:
+        return jsonify({"error": "Expense not found"}), 404
+
+    rollup = RollupDelta()
+    rollup.remove(expense.user_id, expense.spent_at, expense.category,
+                  expense.amount, expense.currency)
+    db.session.delete(expense)
+    # Less spend never raises an alert
+    apply_write(expense.user_id, rollup, deleted=[expense_id])
+    db.session.commit()
+
+    broker.publish(expense.user_id, "expense.deleted", {"id": expense_id})
+    return jsonify({"message": "Expense deleted successfully"}), 200
+
+
+def merge_archived_partitions(partitions, archived, categories, size):
+    # Both streams are oldest first by (spent_at, id), so a lazy merge keeps
+    # memory at one partition plus one archived month
+    if categories:
+        category = CSV_COLUMNS.index("category")
+        archived = (row for row in archived if row[category] in categories)
+    merged = heapq.merge(itertools.chain.from_iterable(partitions), archived,
+                         key=lambda row: (row[1], row[0]))
+    while True:
+        partition = list(itertools.islice(merged, size))
+        if not partition:
+            return
+        yield partition
+
+
+@expenses.route("/export", methods=["GET"])
+@login_required
+def export_expenses():
+    query = db.select(
+        *(getattr(Expense, name) for name in CSV_COLUMNS)
+    ).where(Expense.user_id == current_user.id)
+
+    start = request.args.get("from")
+    if start:
+        start = parse_datetime(start)
+        if start is None:
+            return jsonify({"error": "Invalid from date"}), 400
+        query = query.where(Expense.spent_at >= start)
+    else:
+        start = None
+
+    end = request.args.get("to")
+    if end:
+        date_only = len(end) == 10
+        end = parse_datetime(end)
+        if end is None:
+            return jsonify({"error": "Invalid to date"}), 400
+        # Exclusive from here on; a bare date includes that whole day
+        end += timedelta(days=1) if date_only else timedelta(microseconds=1)
+        query = query.where(Expense.spent_at < end)
+    else:
+        end = None
+
+    categories = request.args.getlist("category")
+    if categories:
+        query = query.where(Expense.category.in_(categories))
+
+    # Oldest first along ix_expense_user_spent_at; yield_per streams from a
+    # server-side cursor, so each partition is written out and dropped before
+    # the next is fetched and memory stays flat on any history length
+    result = db.session.execute(
+        query.order_by(Expense.spent_at, Expense.id).execution_options(
+            yield_per=current_app.config["EXPORT_BATCH_SIZE"]
+        )
+    )
+    partitions = result.partitions()
+    months = archive_months(current_user.id, start, end)
+    if months:
+        partitions = merge_archived_partitions(
+            partitions, archived_rows(current_user.id, months, CSV_COLUMNS, start, end),
+            categories, current_app.config["EXPORT_BATCH_SIZE"],
+        )
+    chunks = iter_csv(partitions)
+    headers = {"Content-Disposition": 'attachment; filename="expenses.csv"'}
+    if request.accept_encodings["gzip"]:
+        chunks = iter_gzip(chunks)
+        headers["Content-Encoding"] = "gzip"
+
+    response = Response(stream_with_context(chunks), mimetype="text/csv",
+                        headers=headers)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+@expenses.route("/import", methods=["POST"])
+@login_required
+def import_expenses():
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("file")
+        if upload is None:
+            return jsonify({"error": "File is required"}), 400
+        source = upload.stream
+        fmt = detect_format(upload.mimetype, upload.filename)
+    else:
+        source = request.stream
+        fmt = detect_format(request.mimetype)
+
+    if fmt is None:
+        return jsonify({"error": "Upload must be CSV or NDJSON"}), 415
+
+    user_id = current_user.id
+    home_currency = current_user.home_currency
+    batch_size = current_app.config["IMPORT_BATCH_SIZE"]
+    max_errors = current_app.config["IMPORT_MAX_REPORTED_ERRORS"]
+
+    def event(payload):
+        return json.dumps(payload) + "\n"
+
+    def flush(batch):
+        # A list of parameter dicts goes through executemany, which SQLAlchemy
+        # 2.0 batches into multi-row INSERTs (insertmanyvalues) where the
+        # driver benefits, still returning the new ids for the change log;
+        # one commit per batch keeps transactions short
+        ids = db.session.scalars(
+            db.insert(Expense).returning(Expense.id), batch
+        ).all()
+        rollup = RollupDelta()
+        for fields in batch:
+            rollup.add(user_id, fields["spent_at"], fields["category"],
+                       fields["amount"], fields["currency"])
+        alerts = apply_write(user_id, rollup, upserted=ids)
+        db.session.commit()
+        publish_alerts(user_id, alerts)
+
+    def generate():
+        imported = failed = 0
+        batch = []
+        for line, row, error in iter_rows(source, fmt):
+            if error is None:
+                fields, error = validate_expense(row)
+            if error is not None:
+                failed += 1
+                if failed <= max_errors:
+                    yield event({"event": "error", "line": line, "error": error})
+                continue
+
+            fields["user_id"] = user_id
+            fields.setdefault("currency", home_currency)
+            batch.append(fields)
+            if len(batch) >= batch_size:
+                flush(batch)
+                imported += len(batch)
+                batch = []
+                yield event(
+                    {"event": "progress", "imported": imported, "failed": failed}
+                )
+
+        if batch:
+            flush(batch)
+            imported += len(batch)
+        if imported:
+            # Too many rows to push one by one; clients refetch on this event
+            broker.publish(user_id, "expenses.imported", {"imported": imported})
+        yield event({"event": "done", "imported": imported, "failed": failed})
+
+    return Response(
+        stream_with_context(generate()), mimetype="application/x-ndjson"
+    )
@@ -0,0 +1,54 @@
+import csv
+import io
+import re
+import zlib
+
+# Same column names the importer reads, so an export can be imported back
+CSV_COLUMNS = ("id", "spent_at", "amount", "currency", "description", "category")
+
+
+# Text a spreadsheet would run as a formula. Escaped with a leading
+# apostrophe, which spreadsheets hide; values that already start with
+# apostrophes before a trigger get one more, so unescape_csv_value() can
+# always strip exactly one
+FORMULA_PATTERN = re.compile(r"^'*[=+\-@\t\r]")
+
+
+def _csv_value(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if isinstance(value, str) and FORMULA_PATTERN.match(value):
+        return "'" + value
+    return value
+
+
+def unescape_csv_value(value):
+    """Undo _csv_value()'s formula escaping on an imported cell."""
+    if isinstance(value, str) and value.startswith("'") and FORMULA_PATTERN.match(value):
+        return value[1:]
+    return value
+
+
+def iter_csv(partitions, columns=CSV_COLUMNS):
+    """Yield CSV text: a header, then one chunk per partition of row tuples."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in partitions:
+        writer.writerows(tuple(_csv_value(value) for value in row) for row in rows)
+        yield buffer.getvalue()
+        # Reuse the buffer so only one partition's text is ever held
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_gzip(chunks, level=6):
+    """Gzip a stream of text chunks incrementally, as UTF-8 bytes."""
+    # wbits=31 writes the gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,221 @@
+import calendar
+import csv
+import threading
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+import click
+from flask.cli import AppGroup
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models import FxRate
+from app.versions import bump_version, global_version
+
+FX_VERSION = "fx"
+CENT = Decimal("0.01")
+LOOKUP_CHUNK = 200  # Keys resolved per SELECT
+LOAD_BATCH = 5000
+
+
+class MissingRate(LookupError):
+    """No rate for a currency on or before the requested date."""
+
+    def __init__(self, currency, day):
+        super().__init__(f"No exchange rate for {currency} on or before {day}")
+        self.currency = currency
+        self.day = day
+
+
+def month_end(month):
+    # "2024-02" -> date(2024, 2, 29)
+    year, number = int(month[:4]), int(month[5:7])
+    return date(year, number, calendar.monthrange(year, number)[1])
+
+
+class RateCache:
+    """LRU of (currency, date) -> rate, filled from fx_rate in batches.
+
+    A rate is the value of one unit of the currency in FX_BASE_CURRENCY, as
+    of the latest row on or before the date. Loading new rates bumps the
+    "fx" data version, and every process drops its cache when it sees the
+    version change, so no request ever needs a network fetch or a stale rate.
+    """
+
+    def __init__(self, capacity=4096, base="USD"):
+        self.capacity = capacity
+        self.base = base
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        with self._lock:
+            self.capacity = config["FX_CACHE_SIZE"]
+            self.base = config["FX_BASE_CURRENCY"]
+            self._entries.clear()
+            self.version = None
+
+    def sync(self):
+        """Drop cached rates if rates were loaded since they were cached."""
+        version = global_version(FX_VERSION)
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def rates(self, keys):
+        """Return {(currency, date): rate or None} for every key, in one batch."""
+        found = {}
+        missing = []
+        with self._lock:
+            for key in set(keys):
+                if key[0] == self.base:
+                    found[key] = Decimal(1)
+                elif key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+                else:
+                    missing.append(key)
+
+        loaded = {}
+        for start in range(0, len(missing), LOOKUP_CHUNK):
+            chunk = missing[start:start + LOOKUP_CHUNK]
+            # One round trip per chunk: a scalar subquery per key, each a
+            # backwards seek on the (currency, day) primary key
+            row = db.session.execute(
+                db.select(*(_latest_rate(currency, day) for currency, day in chunk))
+            ).one()
+            loaded.update(zip(chunk, row))
+
+        with self._lock:
+            for key, rate in loaded.items():
+                # Misses are cached too; loading rates clears them
+                self._entries[key] = rate
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        found.update(loaded)
+        return found
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _latest_rate(currency, day):
+    return (
+        db.select(FxRate.rate)
+        .where(FxRate.currency == currency, FxRate.day <= day)
+        .order_by(FxRate.day.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+rates = RateCache()
+
+
+def convert_monthly(rows, home):
+    """Sum (month, key, currency, total, count) rows into home currency.
+
+    Each month is converted at the rate in effect on its last day. All rates
+    are fetched in one batch up front. Rows whose rate is absent are left
+    out rather than failing the whole sum. Returns ({(month, key): (total,
+    count)}, unconverted) with totals rounded to cents and unconverted the
+    sorted currencies that lacked a rate.
+    """
+    rows = list(rows)
+    keys = set()
+    for month, _, currency, _, _ in rows:
+        if currency != home:
+            keys.add((currency, month_end(month)))
+            keys.add((home, month_end(month)))
+    found = rates.rates(keys)
+
+    totals = {}
+    unconverted = set()
+    for month, key, currency, total, count in rows:
+        total = Decimal(total)
+        if currency != home:
+            day = month_end(month)
+            missing = [needed for needed in (currency, home) if found[(needed, day)] is None]
+            if missing:
+                unconverted.update(missing)
+                continue
+            total = total * found[(currency, day)] / found[(home, day)]
+        entry = totals.setdefault((month, key), [Decimal(0), 0])
+        entry[0] += total
+        entry[1] += count
+    return {
+        key: (total.quantize(CENT), count) for key, (total, count) in totals.items()
+    }, sorted(unconverted)
+
+
+def upsert_rates(params):
+    table = FxRate.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.currency, table.c.day],
+            set_={"rate": stmt.excluded.rate},
+        )
+        db.session.execute(stmt, params)
+    else:
+        for row in params:
+            db.session.execute(
+                db.delete(table).where(
+                    table.c.currency == row["currency"], table.c.day == row["day"]
+                )
+            )
+        db.session.execute(db.insert(table), params)
+
+
+def load_rates(lines):
+    """Upsert date,currency,rate CSV rows; returns (loaded, errors)."""
+    loaded = 0
+    errors = []
+    batch = []
+    for line, row in enumerate(csv.DictReader(lines), start=2):
+        try:
+            params = {
+                "day": date.fromisoformat(row["date"].strip()),
+                "currency": row["currency"].strip().upper(),
+                "rate": Decimal(row["rate"].strip()),
+            }
+        except (AttributeError, KeyError, ValueError, InvalidOperation):
+            errors.append(line)
+            continue
+        if len(params["currency"]) != 3 or not params["rate"] > 0:
+            errors.append(line)
+            continue
+        batch.append(params)
+        if len(batch) >= LOAD_BATCH:
+            upsert_rates(batch)
+            loaded += len(batch)
+            batch = []
+    if batch:
+        upsert_rates(batch)
+        loaded += len(batch)
+    if loaded:
+        bump_version(FX_VERSION)
+    db.session.commit()
+    return loaded, errors
+
+
+fx_cli = AppGroup("fx", help="Manage exchange rates.")
+
+
+@fx_cli.command("load")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def load_command(path):
+    """Load rates from a CSV file with date,currency,rate columns.
+
+    A rate is the value of one unit of the currency in FX_BASE_CURRENCY.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as lines:
+        loaded, errors = load_rates(lines)
+    for line in errors:
+        click.echo(f"Skipped invalid line {line}")
+    click.echo(f"Loaded {loaded} rate(s)")
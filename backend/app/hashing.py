@@ -0,0 +1,112 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt as bcrypt_lib
+
+CALIBRATION_ROUNDS = 8
+_calibrated = {}  # target_ms -> rounds, shared by every app in the process
+
+
+class HasherBusy(Exception):
+    """Raised when too many hashes are already queued."""
+
+
+def hash_cost(pw_hash):
+    # "$2b$12$..." -> 12
+    try:
+        return int(pw_hash.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return 0
+
+
+def calibrate(target_ms, min_rounds, max_rounds):
+    """Return the highest cost whose hash still fits in target_ms."""
+    if target_ms not in _calibrated:
+        salt = bcrypt_lib.gensalt(CALIBRATION_ROUNDS)
+        elapsed = min(_time_hash(salt) for _ in range(3))
+        # Each extra round doubles the work
+        extra = math.floor(math.log2(target_ms / 1000 / elapsed))
+        _calibrated[target_ms] = CALIBRATION_ROUNDS + extra
+    return max(min_rounds, min(max_rounds, _calibrated[target_ms]))
+
+
+def _time_hash(salt):
+    start = time.perf_counter()
+    bcrypt_lib.hashpw(b"calibration", salt)
+    return time.perf_counter() - start
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded pool so hashing can't starve other requests.
+
+    bcrypt releases the GIL, so at most BCRYPT_WORKERS hashes burn CPU at
+    once and at most BCRYPT_MAX_QUEUE more wait for a worker; beyond that
+    callers get HasherBusy immediately instead of piling up.
+    """
+
+    def __init__(self):
+        self.rounds = 12
+        self.max_pending = 0
+        self.timing_callback = None  # Called as (operation, seconds)
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        if app.config.get("BCRYPT_LOG_ROUNDS"):
+            self.rounds = int(app.config["BCRYPT_LOG_ROUNDS"])
+        else:
+            self.rounds = calibrate(
+                app.config["BCRYPT_TARGET_MS"],
+                app.config["BCRYPT_MIN_ROUNDS"],
+                app.config["BCRYPT_MAX_ROUNDS"],
+            )
+            # Keep Flask-Bcrypt on the same cost as the pool
+            app.config["BCRYPT_LOG_ROUNDS"] = self.rounds
+
+        workers = app.config["BCRYPT_WORKERS"] or os.cpu_count() or 1
+        self.max_pending = workers + app.config["BCRYPT_MAX_QUEUE"]
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bcrypt"
+        )
+
+    def _run(self, operation, func, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise HasherBusy()
+            self._pending += 1
+        try:
+            return self._executor.submit(self._timed, operation, func, *args).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _timed(self, operation, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            if self.timing_callback is not None:
+                self.timing_callback(operation, time.perf_counter() - start)
+
+    def generate_password_hash(self, password):
+        salt = bcrypt_lib.gensalt(self.rounds)
+        return self._run(
+            "hash", bcrypt_lib.hashpw, password.encode("utf-8"), salt
+        ).decode("utf-8")
+
+    def check_password_hash(self, pw_hash, password):
+        try:
+            return self._run(
+                "check", bcrypt_lib.checkpw, password.encode("utf-8"),
+                pw_hash.encode("utf-8"),
+            )
+        except ValueError:  # Not a bcrypt hash
+            return False
+
+    def needs_rehash(self, pw_hash):
+        return hash_cost(pw_hash) < self.rounds
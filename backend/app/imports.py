@@ -0,0 +1,82 @@
+import codecs
+import csv
+import io
+import json
+from app.exports import unescape_csv_value
+
+CSV_TYPES = ("text/csv", "application/csv")
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+NOT_UTF8 = "File is not valid UTF-8"
+
+
+def detect_format(mimetype, filename=None):
+    if mimetype in CSV_TYPES:
+        return "csv"
+    if mimetype in NDJSON_TYPES:
+        return "ndjson"
+    if filename:
+        extension = filename.rsplit(".", 1)[-1].lower()
+        if extension == "csv":
+            return "csv"
+        if extension in ("ndjson", "jsonl"):
+            return "ndjson"
+    return None
+
+
+def _text_stream(binary):
+    # Decode incrementally so only one read buffer is ever held in memory
+    if not isinstance(binary, io.BufferedIOBase):
+        binary = io.BufferedReader(binary)
+    return io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+
+
+def iter_csv_rows(binary):
+    """Yield (line_number, row_dict or None, error) from a CSV byte stream.
+
+    Undecodable bytes end the file with an error row, since the text stream
+    can't resynchronise past them; rows from earlier read buffers are kept.
+    """
+    reader = csv.DictReader(_text_stream(binary))
+    try:
+        if reader.fieldnames is None:
+            return
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        for row in reader:
+            if None in row:
+                yield reader.line_num, None, "Too many columns"
+                continue
+            row = {name: unescape_csv_value(value) for name, value in row.items()}
+            yield reader.line_num, row, None
+    except csv.Error as exc:
+        yield reader.line_num, None, f"Malformed CSV: {exc}"
+    except UnicodeDecodeError:
+        yield reader.line_num + 1, None, NOT_UTF8
+
+
+def iter_ndjson_rows(binary):
+    """Yield (line_number, row_dict or None, error) from an NDJSON byte stream."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    for line_number, raw in enumerate(binary, start=1):
+        try:
+            line = decoder.decode(raw).strip()
+        except UnicodeDecodeError:
+            decoder.reset()  # Lines are independent: carry on with the next
+            yield line_number, None, NOT_UTF8
+            continue
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None, "Invalid JSON"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Each line must be a JSON object"
+            continue
+        yield line_number, row, None
+
+
+def iter_rows(binary, fmt):
+    if fmt == "csv":
+        return iter_csv_rows(binary)
+    return iter_ndjson_rows(binary)
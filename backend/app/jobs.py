@@ -0,0 +1,258 @@
+import json
+import random
+import secrets
+import signal
+import threading
+import traceback
+from datetime import timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.models import Job
+from app.util import utcnow
+
+HANDLERS = {}
+_INSERT_JOB = db.insert(Job.__table__)
+
+
+def job(name):
+    """Register a function as the handler for jobs called name.
+
+    Handlers take the enqueued payload as keyword arguments and run in an
+    app context with a fresh session; raising fails the attempt.
+    """
+    def register(func):
+        HANDLERS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, delay=0, max_attempts=None, **payload):
+    """Queue a job in the current transaction and return its id.
+
+    A single INSERT; the job becomes visible to workers when the caller
+    commits, so it never runs for a write that rolled back.
+    """
+    if name not in HANDLERS:
+        raise KeyError(f"No job handler named {name!r}")
+    # One prebuilt statement with bound parameters: its compiled form is
+    # cached, so each call only binds values and runs the INSERT
+    result = db.session.execute(
+        _INSERT_JOB,
+        {
+            "name": name,
+            "payload": json.dumps(payload),
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": max_attempts or current_app.config["JOB_MAX_ATTEMPTS"],
+            "available_at": utcnow() + timedelta(seconds=delay),
+        },
+    )
+    return result.inserted_primary_key[0]
+
+
+def backoff(attempts, base, cap):
+    """Seconds before retrying after the given number of failed attempts."""
+    delay = min(base * 2 ** (attempts - 1), cap)
+    # Jitter spreads out jobs that failed together, e.g. on an outage
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def claim(lease_seconds):
+    """Atomically claim the next available job; returns its row or None.
+
+    The claim is one UPDATE ... RETURNING of the oldest available job, so two
+    workers can never take the same one. A claimed job stays hidden until
+    its lease expires; if the worker dies, it is claimed again after that,
+    unless that was its last attempt: then it is parked as failed. Commits.
+    """
+    table = Job.__table__
+    now = utcnow()
+    lease = secrets.token_hex(16)
+    # A worker that died on the last attempt never called fail()
+    db.session.execute(
+        db.update(table)
+        .where(table.c.available_at <= now, table.c.status == "running",
+               table.c.attempts >= table.c.max_attempts)
+        .values(status="failed", available_at=None, lease=None,
+                last_error="Lease expired on the last attempt")
+    )
+    candidate = (
+        db.select(table.c.id)
+        .where(table.c.available_at <= now, table.c.attempts < table.c.max_attempts)
+        .order_by(table.c.available_at)
+        .limit(1)
+        # Concurrent claimers skip each other's row on PostgreSQL
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    values = {
+        "status": "running",
+        "attempts": table.c.attempts + 1,
+        "lease": lease,
+        "available_at": now + timedelta(seconds=lease_seconds),
+    }
+    returning = (table.c.id, table.c.name, table.c.payload, table.c.attempts,
+                 table.c.max_attempts, table.c.lease)
+
+    if db.session.get_bind().dialect.update_returning:
+        row = db.session.execute(
+            db.update(table)
+            .where(table.c.id == candidate, table.c.available_at <= now)
+            .values(**values)
+            .returning(*returning)
+        ).first()
+    else:
+        job_id = db.session.scalar(db.select(candidate))
+        row = None
+        if job_id is not None and db.session.execute(
+            db.update(table)
+            .where(table.c.id == job_id, table.c.available_at <= now)
+            .values(**values)
+        ).rowcount:
+            row = db.session.execute(
+                db.select(*returning).where(table.c.id == job_id)
+            ).first()
+    db.session.commit()
+    return row
+
+
+def complete(job_id, lease):
+    """Delete a finished job, unless its lease expired and it was reclaimed."""
+    db.session.execute(
+        db.delete(Job.__table__).where(Job.id == job_id, Job.lease == lease)
+    )
+    db.session.commit()
+
+
+def fail(job_id, lease, attempts, max_attempts, error):
+    """Schedule a retry with backoff, or park the job as failed after the last attempt."""
+    config = current_app.config
+    if attempts >= max_attempts:
+        values = {"status": "failed", "available_at": None}
+    else:
+        delay = backoff(attempts, config["JOB_BACKOFF_SECONDS"],
+                        config["JOB_BACKOFF_MAX_SECONDS"])
+        values = {"status": "queued",
+                  "available_at": utcnow() + timedelta(seconds=delay)}
+    db.session.execute(
+        db.update(Job.__table__)
+        .where(Job.id == job_id, Job.lease == lease)
+        .values(lease=None, last_error=error, **values)
+    )
+    db.session.commit()
+
+
+def run_next(lease_seconds):
+    """Claim and run one job; returns False if none was available."""
+    row = claim(lease_seconds)
+    if row is None:
+        return False
+
+    job_id, name, payload, attempts, max_attempts, lease = row
+    handler = HANDLERS.get(name)
+    try:
+        if handler is None:
+            raise LookupError(f"No job handler named {name!r}")
+        handler(**json.loads(payload))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("Job %s (%s) attempt %d failed",
+                                     job_id, name, attempts)
+        fail(job_id, lease, attempts,
+             attempts if handler is None else max_attempts,
+             traceback.format_exc(limit=5))
+    else:
+        complete(job_id, lease)
+    return True
+
+
+class Worker(threading.Thread):
+    """Runs jobs one at a time until stopped, polling while the queue is empty."""
+
+    def __init__(self, app, stopped, number, lease_seconds, poll_seconds, burst=False):
+        super().__init__(name=f"job-worker-{number}")
+        self.app = app
+        self.stopped = stopped
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.burst = burst
+        self.processed = 0
+
+    def run(self):
+        while not self.stopped.is_set():
+            with self.app.app_context():
+                try:
+                    ran = run_next(self.lease_seconds)
+                except SQLAlchemyError:
+                    # e.g. the database is briefly locked; try again shortly
+                    db.session.rollback()
+                    self.app.logger.exception("Claiming a job failed")
+                    ran = False
+                finally:
+                    db.session.remove()
+            if ran:
+                self.processed += 1
+            elif self.burst:
+                return
+            else:
+                self.stopped.wait(self.poll_seconds)
+
+
+def run_workers(app, concurrency, burst=False):
+    """Run a pool of worker threads; returns the number of jobs processed.
+
+    SIGINT or SIGTERM stops the pool once the jobs in progress finish.
+    """
+    stopped = threading.Event()
+    workers = [
+        Worker(app, stopped, number, app.config["JOB_LEASE_SECONDS"],
+               app.config["JOB_POLL_SECONDS"], burst)
+        for number in range(concurrency)
+    ]
+    previous = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            previous[signum] = signal.signal(signum, lambda *_: stopped.set())
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            # Joined with a timeout so signals are still handled while waiting
+            while worker.is_alive():
+                worker.join(0.5)
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+    return sum(worker.processed for worker in workers)
+
+
+jobs_cli = AppGroup("jobs", help="Run and inspect background jobs.")
+
+
+@jobs_cli.command("work")
+@click.option("--concurrency", default=4, show_default=True,
+              help="Worker threads in the pool.")
+@click.option("--burst", is_flag=True,
+              help="Exit once the queue is empty instead of polling.")
+def work_command(concurrency, burst):
+    """Run queued jobs until interrupted."""
+    processed = run_workers(current_app._get_current_object(), concurrency, burst)
+    click.echo(f"Processed {processed} job(s)")
+
+
+@jobs_cli.command("retry")
+@click.argument("job_ids", nargs=-1, type=int)
+def retry_command(job_ids):
+    """Requeue failed jobs, all of them if no ids are given."""
+    query = db.update(Job.__table__).where(Job.status == "failed")
+    if job_ids:
+        query = query.where(Job.id.in_(job_ids))
+    requeued = db.session.execute(
+        query.values(status="queued", attempts=0, available_at=utcnow())
+    ).rowcount
+    db.session.commit()
+    click.echo(f"Requeued {requeued} job(s)")
@@ -0,0 +1,27 @@
+import smtplib
+from email.message import EmailMessage
+from flask import current_app
+
+
+def send_mail(to, subject, body):
+    """Send a plain-text email through MAIL_SERVER.
+
+    Without a MAIL_SERVER (development, tests) the message is logged instead.
+    Meant to run from a background job, never on a request thread.
+    """
+    config = current_app.config
+    if not config["MAIL_SERVER"]:
+        current_app.logger.info("Mail to %s: %s\n%s", to, subject, body)
+        return
+
+    message = EmailMessage()
+    message["From"] = config["MAIL_SENDER"]
+    message["To"] = to
+    message["Subject"] = subject
+    message.set_content(body)
+    with smtplib.SMTP(config["MAIL_SERVER"], config["MAIL_PORT"], timeout=30) as smtp:
+        if config["MAIL_USE_TLS"]:
+            smtp.starttls()
+        if config["MAIL_USERNAME"]:
+            smtp.login(config["MAIL_USERNAME"], config["MAIL_PASSWORD"])
+        smtp.send_message(message)
@@ -0,0 +1,237 @@
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from flask import Response, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=(), lock=None):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = lock or threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.inc_locked(labels, amount)
+
+    def inc_locked(self, labels=(), amount=1):
+        # Caller already holds the (possibly shared) lock
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS,
+                 lock=None):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = lock or threading.Lock()
+
+    def observe(self, value, labels=()):
+        with self._lock:
+            self.observe_locked(value, labels)
+
+    def observe_locked(self, value, labels=()):
+        # Caller already holds the (possibly shared) lock
+        self.record(self.series(labels), value)
+
+    def series(self, labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        return series
+
+    def record(self, series, value):
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((labels, list(s)) for labels, s in self._series.items())
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            label_text = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {series[-1]}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """Request, SQL, connection pool and bcrypt metrics in Prometheus format.
+
+    Everything is recorded in-process with one short lock per observation,
+    and exposed at GET /metrics.
+    """
+
+    def __init__(self):
+        # The per-request series share one lock so finishing a request costs
+        # a single acquire
+        self._request_lock = threading.Lock()
+        self._route_series = {}  # (method, route) -> per-request series
+        self.requests = Counter(
+            "http_requests_total", "Requests handled.", ("method", "route", "status"),
+            lock=self._request_lock,
+        )
+        self.latency = Histogram(
+            "http_request_duration_seconds",
+            "Time spent in the view, until the response headers are ready.",
+            ("method", "route"),
+            lock=self._request_lock,
+        )
+        self.statements = Histogram(
+            "db_statements_per_request",
+            "SQL statements executed per request.",
+            ("route",),
+            COUNT_BUCKETS,
+            lock=self._request_lock,
+        )
+        self.db_time = Histogram(
+            "db_time_per_request_seconds",
+            "Time spent executing SQL per request.",
+            ("route",),
+            lock=self._request_lock,
+        )
+        self.pool_wait = Histogram(
+            "db_pool_checkout_seconds", "Time waiting for a pooled connection."
+        )
+        self.bcrypt_time = Histogram(
+            "bcrypt_seconds", "Time spent hashing or checking passwords.",
+            ("operation",),
+        )
+
+    def init_app(self, app, db, hasher):
+        if not app.config["METRICS_ENABLED"]:
+            hasher.timing_callback = None
+            return
+
+        app.wsgi_app = self._wrap_wsgi_app(app.wsgi_app)
+        app.add_url_rule("/metrics", "metrics", self.render)
+        hasher.timing_callback = self._observe_bcrypt
+
+        with app.app_context():
+            for engine in db.engines.values():
+                self._instrument_engine(engine)
+
+    def _instrument_engine(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+        # Engine.connect() goes through Pool.connect(), so timing it captures
+        # both waiting for a free connection and opening a new one
+        pool = engine.pool
+        connect = pool.connect
+
+        def timed_connect():
+            start = perf_counter()
+            try:
+                return connect()
+            finally:
+                self.pool_wait.observe(perf_counter() - start)
+
+        pool.connect = timed_connect
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context,
+                               executemany):
+        conn.info["query_start"] = perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context,
+                              executemany):
+        elapsed = perf_counter() - conn.info.pop("query_start", perf_counter())
+        if has_request_context():
+            stats = request.environ.get("app.metrics")
+            if stats is not None:
+                stats[1] += 1
+                stats[2] += elapsed
+
+    def _wrap_wsgi_app(self, wsgi_app):
+        # Plain WSGI middleware rather than before/after_request hooks: on a
+        # trivial route Flask's hook dispatch and context-local lookups cost
+        # more than the histogram updates themselves
+        def timed_wsgi_app(environ, start_response):
+            # [start, statements, db seconds, status line, request]
+            stats = environ["app.metrics"] = [perf_counter(), 0, 0.0, None, None]
+
+            def timed_start_response(status, headers, exc_info=None):
+                stats[3] = status
+                # Flask clears environ["werkzeug.request"] when the request
+                # context ends, so grab the request (for its url_rule) now
+                stats[4] = environ.get("werkzeug.request")
+                return start_response(status, headers, exc_info)
+
+            try:
+                return wsgi_app(environ, timed_start_response)
+            finally:
+                # Break the environ -> stats -> request -> environ cycle so it
+                # is freed by refcounting rather than left for the GC
+                del environ["app.metrics"]
+                self._finish_request(environ, stats)
+                stats.clear()
+
+        return timed_wsgi_app
+
+    def _finish_request(self, environ, stats):
+        start, statements, db_time, status, req = stats
+        elapsed = perf_counter() - start
+        rule = getattr(req, "url_rule", None)
+        route = rule.rule if rule is not None else "<unmatched>"
+        key = (environ.get("REQUEST_METHOD", "GET"), route)
+        status = int(status[:3]) if status else 500
+        with self._request_lock:
+            series = self._route_series.get(key)
+            if series is None:
+                series = self._route_series[key] = (
+                    self.latency.series(key),
+                    self.statements.series((route,)),
+                    self.db_time.series((route,)),
+                )
+            self.latency.record(series[0], elapsed)
+            self.statements.record(series[1], statements)
+            self.db_time.record(series[2], db_time)
+            self.requests.inc_locked(key + (status,))
+
+    def _observe_bcrypt(self, operation, seconds):
+        self.bcrypt_time.observe(seconds, (operation,))
+
+    def render(self):
+        lines = []
+        for metric in (
+            self.requests, self.latency, self.statements, self.db_time,
+            self.pool_wait, self.bcrypt_time,
+        ):
+            lines.extend(metric.render())
+        return Response(
+            "\n".join(lines) + "\n",
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
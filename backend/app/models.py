@@ -1,5 +1,6 @@
 from app import db
 from flask_login import UserMixin
+from sqlalchemy import DDL, event
 from sqlalchemy.sql import func
 
 
@@ -8,9 +9,350 @@ class User(db.Model, UserMixin):
     username = db.Column(db.String(150), unique=True, nullable=False)
     email = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(200), nullable=False)
-    reset_token = db.Column(db.String(200), nullable=True)
+    # Dashboard totals are converted into this ISO 4217 currency
+    home_currency = db.Column(db.String(3), nullable=False, default='USD',
+                              server_default='USD')
+    # Bumped with every change to the user's expense data; drives ETags
+    data_version = db.Column(db.Integer, nullable=False, default=0,
+                             server_default='0')
+    # Signed into every access token; bumping it revokes them all
+    credential_version = db.Column(db.Integer, nullable=False, default=0,
+                                   server_default='0')
+    # Highest sequence number of a compacted delete tombstone: a sync from
+    # before it could miss deletions, so such clients must resync in full
+    tombstone_seq = db.Column(db.Integer, nullable=False, default=0,
+                              server_default='0')
     created_at = db.Column(db.DateTime(timezone=True),
                            server_default=func.now())
 
+    # Identity lookups compare lower(email)/lower(username), so these
+    # functional indexes keep them point lookups and make uniqueness
+    # case-insensitive
+    __table_args__ = (
+        db.Index('ix_user_email_lower', func.lower(email), unique=True),
+        db.Index('ix_user_username_lower', func.lower(username), unique=True),
+    )
+
     def __repr__(self):
         return f'<User {self.username}>'
+
+
+class Expense(db.Model):
+    # Listing pages walk (user_id, spent_at, id) with a keyset cursor, so the
+    # composite index lets every page be a single index range scan
+    __table_args__ = (
+        db.Index('ix_expense_user_spent_at', 'user_id', 'spent_at', 'id'),
+        # One row per occurrence of a recurring template, however many times
+        # the scheduler retries it
+        db.UniqueConstraint('recurring_id', 'spent_at',
+                            name='uq_expense_recurring_spent_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default='USD',
+                         server_default='USD')  # ISO 4217
+    description = db.Column(db.String(255), nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    spent_at = db.Column(db.DateTime, nullable=False)  # Naive UTC
+    recurring_id = db.Column(
+        db.Integer, db.ForeignKey('recurring_expense.id', ondelete='SET NULL'),
+        nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True),
+                           server_default=func.now())
+
+    def __repr__(self):
+        return f'<Expense {self.id} {self.amount}>'
+
+
+# Text index behind GET /expenses/search, kept in sync by the database itself
+# so ORM writes, bulk imports and cascades all stay searchable. SQLite gets an
+# external-content FTS5 table (no copy of the text) with prefix indexes for
+# typeahead; PostgreSQL gets tsvector and trigram GIN indexes. Production
+# databases get the same objects from migration 7d3e5a0c9b14
+EXPENSE_SEARCH_DDL = {
+    "sqlite": (
+        "CREATE VIRTUAL TABLE expense_fts USING fts5(description, "
+        "content='expense', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        "CREATE TRIGGER expense_fts_ai AFTER INSERT ON expense BEGIN "
+        "INSERT INTO expense_fts(rowid, description) "
+        "VALUES (new.id, new.description); END",
+        "CREATE TRIGGER expense_fts_ad AFTER DELETE ON expense BEGIN "
+        "INSERT INTO expense_fts(expense_fts, rowid, description) "
+        "VALUES ('delete', old.id, old.description); END",
+        "CREATE TRIGGER expense_fts_au AFTER UPDATE OF description ON expense BEGIN "
+        "INSERT INTO expense_fts(expense_fts, rowid, description) "
+        "VALUES ('delete', old.id, old.description); "
+        "INSERT INTO expense_fts(rowid, description) "
+        "VALUES (new.id, new.description); END",
+    ),
+    "postgresql": (
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX ix_expense_description_tsv ON expense "
+        "USING gin (to_tsvector('simple', description))",
+        "CREATE INDEX ix_expense_description_trgm ON expense "
+        "USING gin (description gin_trgm_ops)",
+    ),
+}
+
+for _dialect, _statements in EXPENSE_SEARCH_DDL.items():
+    for _statement in _statements:
+        event.listen(Expense.__table__, "after_create",
+                     DDL(_statement).execute_if(dialect=_dialect))
+# The triggers and indexes go with the table; the FTS table doesn't
+event.listen(Expense.__table__, "before_drop",
+             DDL("DROP TABLE IF EXISTS expense_fts").execute_if(dialect="sqlite"))
+
+
+class ExpenseArchive(db.Model):
+    # Cold storage for expenses older than ARCHIVE_HORIZON_DAYS: one row per
+    # user and month holding all of its expenses as compressed JSON, moved
+    # out of the expense table by app.archive. Their rollups stay where they
+    # are. first_id/last_id bound the ids inside, so an archived expense can
+    # be found by id without opening every blob
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    count = db.Column(db.Integer, nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True),
+                           server_default=func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'month', name='uq_expense_archive_user_month'),
+    )
+
+    def __repr__(self):
+        return f'<ExpenseArchive {self.user_id} {self.month} ({self.count})>'
+
+
+class ExpenseChange(db.Model):
+    # The sync change log, compacted as it is written: one row per expense
+    # the user ever had, stamped with the data_version of the transaction
+    # that last inserted, updated or deleted it. Deleted expenses leave a
+    # tombstone until `flask sync compact` removes it. GET /sync?since=N is
+    # a range scan of (user_id, seq), so it costs O(changes since N)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        primary_key=True)
+    expense_id = db.Column(db.Integer, primary_key=True)  # No FK: tombstones
+    seq = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    changed_at = db.Column(db.DateTime, nullable=False)  # Naive UTC
+
+    __table_args__ = (
+        db.Index('ix_expense_change_user_seq', 'user_id', 'seq'),
+    )
+
+    def __repr__(self):
+        state = 'deleted' if self.deleted else 'live'
+        return f'<ExpenseChange {self.user_id}/{self.expense_id} @{self.seq} {state}>'
+
+
+class SyncMutation(db.Model):
+    # Idempotency keys of mutations applied by POST /sync, with the result
+    # sent back, so a client replaying its queue after a lost response gets
+    # the same answer instead of a second write. Purged with the tombstones
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    result = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, nullable=False, index=True)  # Naive UTC
+
+    def __repr__(self):
+        return f'<SyncMutation {self.user_id}/{self.key}>'
+
+
+class Blob(db.Model):
+    # One stored file per distinct content, named by its SHA-256 under
+    # ATTACHMENT_DIR and shared by every attachment with the same bytes.
+    # refcount counts those attachments; once it drops to 0 the file is
+    # deleted by `flask attachments gc` after a grace period
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    mimetype = db.Column(db.String(100), nullable=False)  # Sniffed, not declared
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    unreferenced_at = db.Column(db.DateTime, nullable=True, index=True)  # Naive UTC
+    created_at = db.Column(db.DateTime(timezone=True),
+                           server_default=func.now())
+
+    def __repr__(self):
+        return f'<Blob {self.sha256[:12]} refs={self.refcount}>'
+
+
+class Attachment(db.Model):
+    # A receipt attached to an expense. expense_id has no foreign key so
+    # attachments stay put while their expense is archived; deleting the
+    # expense detaches them in the same transaction (app.expenses.apply_write)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False)
+    expense_id = db.Column(db.Integer, nullable=False)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('blob.sha256'),
+                            nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True),
+                           server_default=func.now())
+
+    __table_args__ = (
+        db.Index('ix_attachment_user_expense', 'user_id', 'expense_id'),
+    )
+
+    def __repr__(self):
+        return f'<Attachment {self.id} expense={self.expense_id} {self.filename}>'
+
+
+class RecurringExpense(db.Model):
+    # A template that app.recurring turns into expenses. Occurrence n falls
+    # at starts_at plus n * interval frequency units; fired counts those
+    # written since starts_at and next_at is occurrence number fired (None
+    # once past ends_at), updated in the same transaction as the rows it
+    # produced
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False, index=True)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default='USD')
+    description = db.Column(db.String(255), nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    frequency = db.Column(db.String(10), nullable=False)  # daily ... yearly
+    interval = db.Column(db.Integer, nullable=False, default=1)
+    starts_at = db.Column(db.DateTime, nullable=False)  # Naive UTC
+    ends_at = db.Column(db.DateTime, nullable=True)
+    fired = db.Column(db.Integer, nullable=False, default=0)
+    # The scheduler only ever range-scans this index for what is due soon
+    next_at = db.Column(db.DateTime, nullable=True, index=True)
+    created_at = db.Column(db.DateTime(timezone=True),
+                           server_default=func.now())
+
+    def __repr__(self):
+        return f'<RecurringExpense {self.id} {self.frequency}>'
+
+
+class ExpenseRollup(db.Model):
+    # Per-user monthly totals by category, maintained in the same transaction
+    # as every expense write so the dashboard never aggregates raw expenses.
+    # Totals stay in each expense's own currency and are converted on read,
+    # so new rates or a new home currency never require a rebuild
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    category = db.Column(db.String(50), primary_key=True)
+    currency = db.Column(db.String(3), primary_key=True)
+    total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return (f'<ExpenseRollup {self.user_id} {self.month} {self.category} '
+                f'{self.currency}>')
+
+
+class Budget(db.Model):
+    # A monthly limit per category, from start_month on. Spend is read from
+    # the expense_rollup rows, which already are the running monthly totals
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default='USD')
+    start_month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    created_at = db.Column(db.DateTime(timezone=True),
+                           server_default=func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'category', name='uq_budget_user_category'),
+    )
+
+    def __repr__(self):
+        return f'<Budget {self.id} {self.category} {self.amount} {self.currency}>'
+
+
+class BudgetAlert(db.Model):
+    # One row per threshold crossed per budget month; the unique key is what
+    # makes each alert fire once
+    id = db.Column(db.Integer, primary_key=True)
+    budget_id = db.Column(db.Integer,
+                          db.ForeignKey('budget.id', ondelete='CASCADE'),
+                          nullable=False)
+    month = db.Column(db.String(7), nullable=False)
+    threshold = db.Column(db.Integer, nullable=False)  # Percent of the budget
+    spent = db.Column(db.Numeric(14, 2), nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True),
+                           server_default=func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('budget_id', 'month', 'threshold',
+                            name='uq_budget_alert_budget_month_threshold'),
+    )
+
+    def __repr__(self):
+        return f'<BudgetAlert {self.budget_id} {self.month} {self.threshold}%>'
+
+
+class FxRate(db.Model):
+    # Loaded with `flask fx load`, never fetched at request time. rate is the
+    # value of one unit of currency in FX_BASE_CURRENCY from day onwards
+    currency = db.Column(db.String(3), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    rate = db.Column(db.Numeric(18, 8), nullable=False)
+
+    def __repr__(self):
+        return f'<FxRate {self.currency} {self.day} {self.rate}>'
+
+
+class ResetToken(db.Model):
+    # Only the SHA-256 of a token is stored, so redeeming one is a point
+    # lookup on the unique index and a leaked table can't reset passwords
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False, index=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # Naive UTC
+    used_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True),
+                           server_default=func.now())
+
+    def __repr__(self):
+        return f'<ResetToken {self.id} user={self.user_id}>'
+
+
+class Job(db.Model):
+    # Background work queued by app.jobs. available_at is when the job can
+    # next be claimed: its run time while queued, its lease expiry while
+    # running, and NULL once it has failed for good, so claiming is one range
+    # scan of a single index. Finished jobs are deleted
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON keyword arguments
+    status = db.Column(db.String(10), nullable=False)  # queued/running/failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    available_at = db.Column(db.DateTime, nullable=True, index=True)  # Naive UTC
+    lease = db.Column(db.String(32), nullable=True)  # Set by each claim
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True),
+                           server_default=func.now())
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.name} {self.status}>'
+
+
+class DataVersion(db.Model):
+    # Named counters for data not owned by one user ("users" for the user
+    # directory), bumped on every change and used for ETags like
+    # User.data_version
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DataVersion {self.name}={self.version}>'
+
+
+event.listen(DataVersion.__table__, "after_create",
+             DDL("INSERT INTO data_version (name, version) VALUES ('users', 0)"))
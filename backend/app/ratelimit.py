@@ -0,0 +1,170 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+PRUNE_EVERY = 1000  # Takes between prunes of refilled buckets
+
+
+def parse_limit(value):
+    """Parse "count/seconds", e.g. "20/60", into (rate per second, burst)."""
+    count, _, seconds = value.partition("/")
+    count, seconds = int(count), float(seconds)
+    if count < 1 or seconds <= 0:
+        raise ValueError(f"Invalid rate limit {value!r}")
+    return count / seconds, count
+
+
+class MemoryBuckets:
+    """Token buckets for one process, sharded over lock-striped dicts.
+
+    Each key hashes to one of `stripes` shards with its own lock, so
+    concurrent requests for different keys rarely contend. A bucket that has
+    refilled completely is the same as no bucket, so once a shard outgrows
+    its share of max_keys those are dropped first, then the oldest.
+    """
+
+    def __init__(self, stripes=64, max_keys=100000):
+        self._shards = [{} for _ in range(stripes)]
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._max_per_shard = max(1, max_keys // stripes)
+
+    def take(self, key, rate, burst, now=None):
+        """Take one token; returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        index = hash(key) % len(self._shards)
+        shard = self._shards[index]
+        with self._locks[index]:
+            state = shard.get(key)
+            tokens = burst if state is None else min(
+                burst, state[0] + (now - state[1]) * rate
+            )
+            if tokens < 1:
+                return (1 - tokens) / rate
+            tokens -= 1
+            # [tokens, updated, time the bucket is full again]
+            shard[key] = [tokens, now, now + (burst - tokens) / rate]
+            if state is None and len(shard) > self._max_per_shard:
+                self._prune(shard, now)
+            return 0
+
+    def _prune(self, shard, now):
+        for key in [key for key, state in shard.items() if state[2] <= now]:
+            del shard[key]
+        while len(shard) > self._max_per_shard:
+            del shard[next(iter(shard))]  # Oldest first; dicts keep insertion order
+
+    def clear(self):
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                shard.clear()
+
+
+class SQLiteBuckets:
+    """Token buckets in a SQLite file shared by every process on a host.
+
+    Each take is a single upsert that refills and spends in SQL, so
+    processes never race between reading and writing a bucket. Times are
+    wall-clock, since monotonic clocks aren't shared between processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit: each statement is its own short write transaction
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")  # Losing buckets is harmless
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, "
+                "tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL) "
+                "WITHOUT ROWID"
+            )
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, rate, burst, now=None):
+        now = time.time() if now is None else now
+        connection = self._connection()
+        refilled = "min(:burst, tokens + (:now - updated) * :rate)"
+        row = connection.execute(
+            "INSERT INTO bucket (key, tokens, updated, full_at) "
+            "VALUES (:key, :burst - 1, :now, :now + 1 / :rate) "
+            f"ON CONFLICT (key) DO UPDATE SET tokens = {refilled} - 1, "
+            f"updated = :now, full_at = :now + (:burst - {refilled} + 1) / :rate "
+            f"WHERE {refilled} >= 1 RETURNING tokens",
+            {"key": key, "rate": rate, "burst": burst, "now": now},
+        ).fetchone()
+        self._takes += 1
+        if self._takes % PRUNE_EVERY == 0:
+            connection.execute("DELETE FROM bucket WHERE full_at <= ?", (now,))
+        if row is not None:
+            return 0
+        # Denied: the WHERE kept the bucket as it was
+        (tokens,) = connection.execute(
+            f"SELECT {refilled} FROM bucket WHERE key = :key",
+            {"key": key, "rate": rate, "burst": burst, "now": now},
+        ).fetchone()
+        return (1 - tokens) / rate
+
+    def clear(self):
+        self._connection().execute("DELETE FROM bucket")
+
+
+class RateLimiter:
+    """Named token-bucket limits, checked before any expensive work.
+
+    RATELIMIT_STORAGE is "memory" (per process) or "sqlite:///path" to share
+    buckets between the processes of one host.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.limits = {}
+        self.buckets = MemoryBuckets()
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config["RATELIMIT_ENABLED"]
+        self.limits = {
+            name: parse_limit(value)
+            for name, value in config["RATELIMIT_LIMITS"].items()
+        }
+        storage = config["RATELIMIT_STORAGE"]
+        if storage.startswith("sqlite:///"):
+            path = storage[len("sqlite:///"):]
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.buckets = SQLiteBuckets(path)
+        elif storage == "memory":
+            self.buckets = MemoryBuckets(
+                config["RATELIMIT_STRIPES"], config["RATELIMIT_MAX_KEYS"]
+            )
+        else:
+            raise ValueError(f"Unknown RATELIMIT_STORAGE {storage!r}")
+
+    def hit(self, *keys):
+        """Spend a token from each (limit name, value) bucket.
+
+        Returns 0 if every bucket had one, else the seconds to wait. Buckets
+        checked before a denial keep their spent token, so retrying early
+        only pushes the next allowed attempt further out.
+        """
+        if not self.enabled:
+            return 0
+        for name, value in keys:
+            rate, burst = self.limits[name]
+            wait = self.buckets.take(f"{name}:{value}", rate, burst)
+            if wait:
+                return wait
+        return 0
+
+
+def retry_after(seconds):
+    # Retry-After takes whole seconds; never tell a client 0
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,411 @@
+import calendar
+import heapq
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+import click
+from flask import Blueprint, Response, current_app, jsonify, request
+from flask.cli import AppGroup
+from flask_login import current_user, login_required
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.events import broker
+from app.expenses import (
+    apply_write, parse_datetime, parse_limit, publish_alerts, validate_expense,
+)
+from app.models import Expense, RecurringExpense
+from app.rollups import RollupDelta
+from app.serializers import RECURRING
+from app.util import utcnow
+
+recurring = Blueprint("recurring", __name__)
+
+FREQUENCIES = ("daily", "weekly", "monthly", "yearly")
+
+
+def occurrence(rule, number):
+    """Datetime of occurrence number (0-based) of a recurring template.
+
+    Months and years are counted from starts_at rather than from the
+    previous occurrence, so a rule starting on the 31st falls on the last
+    day of shorter months and returns to the 31st afterwards.
+    """
+    step = number * rule.interval
+    if rule.frequency == "daily":
+        return rule.starts_at + timedelta(days=step)
+    if rule.frequency == "weekly":
+        return rule.starts_at + timedelta(weeks=step)
+    months = step * 12 if rule.frequency == "yearly" else step
+    year, month = divmod(rule.starts_at.month - 1 + months, 12)
+    year += rule.starts_at.year
+    day = min(rule.starts_at.day, calendar.monthrange(year, month + 1)[1])
+    return rule.starts_at.replace(year=year, month=month + 1, day=day)
+
+
+def _insert_occurrences(params):
+    """Insert occurrence rows, skipping ones already written; returns the new rows."""
+    if not params:
+        return []
+    table = Expense.__table__
+    returning = (table.c.id, table.c.user_id, table.c.spent_at, table.c.category,
+                 table.c.amount, table.c.currency)
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        # One multi-row INSERT per batch; conflicts with the unique
+        # (recurring_id, spent_at) key are rows a previous run already wrote
+        return db.session.execute(
+            insert(table)
+            .on_conflict_do_nothing(index_elements=[table.c.recurring_id,
+                                                    table.c.spent_at])
+            .returning(*returning),
+            params,
+        ).all()
+
+    existing = set(db.session.execute(
+        db.select(table.c.recurring_id, table.c.spent_at).where(
+            db.tuple_(table.c.recurring_id, table.c.spent_at).in_(
+                [(row["recurring_id"], row["spent_at"]) for row in params]
+            )
+        )
+    ).all())
+    params = [row for row in params
+              if (row["recurring_id"], row["spent_at"]) not in existing]
+    if not params:
+        return []
+    db.session.execute(db.insert(table), params)
+    return db.session.execute(
+        db.select(*returning).where(
+            db.tuple_(table.c.recurring_id, table.c.spent_at).in_(
+                [(row["recurring_id"], row["spent_at"]) for row in params]
+            )
+        )
+    ).all()
+
+
+def materialize(rule_ids, now, max_catchup=1000):
+    """Write every occurrence due by now for the given templates.
+
+    Missed periods are caught up in bulk, up to max_catchup occurrences per
+    template per call, and all rows go out in one batched INSERT. Progress is
+    committed with the rows, and the unique (recurring_id, spent_at) key makes
+    a crashed or concurrent run harmless, so calling this again is always safe.
+    Returns {template id: next_at} for the templates processed.
+    """
+    rules = db.session.scalars(
+        db.select(RecurringExpense)
+        .where(RecurringExpense.id.in_(rule_ids), RecurringExpense.next_at <= now)
+        # Other workers skip templates this one is firing (PostgreSQL)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not rules:
+        db.session.commit()
+        return {}
+
+    params = []
+    for rule in rules:
+        for _ in range(max_catchup):
+            if rule.next_at is None or rule.next_at > now:
+                break
+            params.append({
+                "user_id": rule.user_id,
+                "amount": rule.amount,
+                "currency": rule.currency,
+                "description": rule.description,
+                "category": rule.category,
+                "spent_at": rule.next_at,
+                "recurring_id": rule.id,
+            })
+            rule.fired += 1
+            next_at = occurrence(rule, rule.fired)
+            rule.next_at = (
+                next_at if rule.ends_at is None or next_at <= rule.ends_at else None
+            )
+
+    rollups = defaultdict(RollupDelta)
+    written = defaultdict(list)
+    for expense_id, user_id, spent_at, category, amount, currency \
+            in _insert_occurrences(params):
+        rollups[user_id].add(user_id, spent_at, category, amount, currency)
+        written[user_id].append(expense_id)
+    alerts = {user_id: apply_write(user_id, rollup, upserted=written[user_id])
+              for user_id, rollup in rollups.items()}
+    fired = {rule.id: rule.next_at for rule in rules}
+    db.session.commit()
+
+    for user_id, expense_ids in written.items():
+        # Clients refetch on this, as after an import
+        broker.publish(user_id, "expenses.materialized",
+                       {"materialized": len(expense_ids)})
+        publish_alerts(user_id, alerts[user_id])
+    return fired
+
+
+def materialize_due(now, batch_size=500, max_catchup=1000):
+    """Catch up every template due by now; returns how many were processed."""
+    processed = 0
+    while True:
+        rule_ids = db.session.scalars(
+            db.select(RecurringExpense.id)
+            .where(RecurringExpense.next_at <= now)
+            .order_by(RecurringExpense.next_at)
+            .limit(batch_size)
+        ).all()
+        fired = materialize(rule_ids, now, max_catchup) if rule_ids else {}
+        if not fired:
+            # Nothing due, or only templates other workers hold locked
+            return processed
+        processed += len(fired)
+
+
+class RecurringScheduler(threading.Thread):
+    """Fires recurring templates from a min-heap of (next_at, id).
+
+    Only templates due within the next horizon are held, loaded by a range
+    scan of ix_recurring_expense_next_at, so memory and per-wakeup work
+    follow what is about to fire rather than how many templates exist. The
+    thread sleeps until the earliest entry or the end of the horizon,
+    whichever comes first. Heap entries can go stale when a template is
+    edited or deleted; materialize() rechecks next_at, so they are harmless.
+    """
+
+    def __init__(self, app, horizon, batch_size, max_catchup):
+        super().__init__(name="recurring-scheduler", daemon=True)
+        self.app = app
+        self.horizon = timedelta(seconds=horizon)
+        self.batch_size = batch_size
+        self.max_catchup = max_catchup
+        self.loaded_until = None
+        self.stopped = threading.Event()
+        self._heap = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    @classmethod
+    def from_config(cls, app):
+        return cls(
+            app,
+            app.config["RECURRING_HORIZON_SECONDS"],
+            app.config["RECURRING_BATCH_SIZE"],
+            app.config["RECURRING_MAX_CATCHUP"],
+        )
+
+    def schedule(self, rule_id, next_at):
+        """Queue a new or edited template that falls inside the loaded horizon."""
+        with self._lock:
+            if next_at is None or self.loaded_until is None or (
+                next_at >= self.loaded_until
+            ):
+                return  # The next refill picks it up
+            heapq.heappush(self._heap, (next_at, rule_id))
+        self._wakeup.set()
+
+    def refill(self, now):
+        until = now + self.horizon
+        rows = db.session.execute(
+            db.select(RecurringExpense.next_at, RecurringExpense.id)
+            .where(RecurringExpense.next_at < until)
+        ).all()
+        heap = [tuple(row) for row in rows]
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap = heap
+            self.loaded_until = until
+
+    def tick(self, now):
+        """Fire what is due; returns seconds until the next wakeup."""
+        if self.loaded_until is None or now >= self.loaded_until:
+            self.refill(now)
+
+        due = set()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.add(heapq.heappop(self._heap)[1])
+        due = sorted(due)
+        for start in range(0, len(due), self.batch_size):
+            fired = materialize(due[start:start + self.batch_size], now,
+                                self.max_catchup)
+            for rule_id, next_at in fired.items():
+                self.schedule(rule_id, next_at)
+
+        with self._lock:
+            wake_at = min(self._heap[0][0], self.loaded_until) if self._heap \
+                else self.loaded_until
+        return max((wake_at - now).total_seconds(), 0)
+
+    def run(self):
+        while not self.stopped.is_set():
+            with self.app.app_context():
+                try:
+                    delay = self.tick(utcnow())
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    self.app.logger.exception("Recurring expense run failed")
+                    delay = 5
+                    self.loaded_until = None  # Reload rather than trust the heap
+                finally:
+                    db.session.remove()
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self._wakeup.set()
+
+
+def start_scheduler(app):
+    if not app.config["RECURRING_SCHEDULER_IN_PROCESS"] or app.testing:
+        return None
+    scheduler = RecurringScheduler.from_config(app)
+    scheduler.start()
+    return scheduler
+
+
+def validate_recurring(data, partial=False):
+    """Return (fields, error) for an incoming recurring expense payload."""
+    if not isinstance(data, dict):
+        return None, "Recurring expense must be a JSON object"
+    fields, error = validate_expense(
+        {key: value for key, value in data.items() if key != "spent_at"},
+        partial=True,
+    ) if partial else validate_expense({**data, "spent_at": data.get("starts_at")})
+    if error:
+        return None, error.replace("spent_at", "starts_at")
+    if not partial:
+        fields["starts_at"] = fields.pop("spent_at")
+
+    if "frequency" in data or not partial:
+        if data.get("frequency") not in FREQUENCIES:
+            return None, f"Frequency must be one of {', '.join(FREQUENCIES)}"
+        fields["frequency"] = data["frequency"]
+
+    if "interval" in data:
+        interval = data.get("interval")
+        if not isinstance(interval, int) or isinstance(interval, bool) or not (
+            1 <= interval <= 1000
+        ):
+            return None, "Interval must be an integer from 1 to 1000"
+        fields["interval"] = interval
+
+    if data.get("ends_at") not in (None, ""):
+        ends_at = parse_datetime(data.get("ends_at"))
+        if ends_at is None:
+            return None, "Invalid ends_at date"
+        fields["ends_at"] = ends_at
+    elif "ends_at" in data:
+        fields["ends_at"] = None  # Recurs indefinitely
+    return fields, None
+
+
+def notify_scheduler(rule):
+    scheduler = current_app.extensions.get("recurring_scheduler")
+    if scheduler is not None:
+        scheduler.schedule(rule.id, rule.next_at)
+
+
+@recurring.route("", methods=["GET"])
+@login_required
+def list_recurring():
+    limit = parse_limit(request.args.get("limit"), 100, 500)
+    if limit is None:
+        return jsonify({"error": "Limit must be a positive integer"}), 400
+
+    rows = db.session.execute(
+        RECURRING.select()
+        .where(RecurringExpense.user_id == current_user.id)
+        .order_by(RecurringExpense.id)
+        .limit(limit)
+    ).all()
+    return Response(RECURRING.dumps(rows), mimetype="application/json")
+
+
+@recurring.route("", methods=["POST"])
+@login_required
+def create_recurring():
+    data = request.get_json(silent=True) or {}
+    fields, error = validate_recurring(data)
+    if error:
+        return jsonify({"error": error}), 400
+    if fields.get("ends_at") is not None and fields["ends_at"] < fields["starts_at"]:
+        return jsonify({"error": "ends_at must not be before starts_at"}), 400
+
+    fields.setdefault("currency", current_user.home_currency)
+    rule = RecurringExpense(user_id=current_user.id, fired=0,
+                            next_at=fields["starts_at"], **fields)
+    db.session.add(rule)
+    db.session.commit()
+
+    # Occurrences already due (a start date in the past) are written now
+    # rather than on the scheduler's next refill
+    materialize([rule.id], utcnow(), current_app.config["RECURRING_MAX_CATCHUP"])
+    notify_scheduler(rule)
+    return jsonify(RECURRING.dump(rule)), 201
+
+
+@recurring.route("/<int:rule_id>", methods=["PUT"])
+@login_required
+def update_recurring(rule_id):
+    rule = RecurringExpense.query.filter_by(
+        id=rule_id, user_id=current_user.id).first()
+    if rule is None:
+        return jsonify({"error": "Recurring expense not found"}), 404
+
+    data = request.get_json(silent=True) or {}
+    fields, error = validate_recurring(data, partial=True)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Changes apply to future occurrences; fired ones stay as written
+    if "frequency" in fields or "interval" in fields:
+        # Re-anchor on the first unwritten occurrence so written ones never
+        # shift under the new period
+        rule.starts_at, rule.fired = occurrence(rule, rule.fired), 0
+    for name, value in fields.items():
+        setattr(rule, name, value)
+    # A finished rule resumes if ends_at moved later
+    next_at = occurrence(rule, rule.fired)
+    rule.next_at = next_at if rule.ends_at is None or next_at <= rule.ends_at else None
+    db.session.commit()
+
+    notify_scheduler(rule)
+    return jsonify(RECURRING.dump(rule)), 200
+
+
+@recurring.route("/<int:rule_id>", methods=["DELETE"])
+@login_required
+def delete_recurring(rule_id):
+    rule = RecurringExpense.query.filter_by(
+        id=rule_id, user_id=current_user.id).first()
+    if rule is None:
+        return jsonify({"error": "Recurring expense not found"}), 404
+
+    # Expenses already written are kept, detached from the template (also
+    # the FK's ON DELETE, which SQLite only enforces with foreign_keys on)
+    db.session.execute(
+        db.update(Expense).where(Expense.recurring_id == rule.id)
+        .values(recurring_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.delete(rule)
+    db.session.commit()
+    return jsonify({"message": "Recurring expense deleted successfully"}), 200
+
+
+recurring_cli = AppGroup("recurring", help="Materialize recurring expenses.")
+
+
+@recurring_cli.command("run")
+@click.option("--batch-size", default=500, show_default=True,
+              help="Templates fired per transaction.")
+def run_command(batch_size):
+    """Write every occurrence that is due, catching up missed periods."""
+    started = time.monotonic()
+    processed = materialize_due(
+        utcnow(), batch_size, current_app.config["RECURRING_MAX_CATCHUP"]
+    )
+    click.echo(
+        f"Fired {processed} recurring expense(s) in "
+        f"{time.monotonic() - started:.2f}s"
+    )
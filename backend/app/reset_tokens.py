@@ -0,0 +1,158 @@
+import hashlib
+import secrets
+import threading
+from datetime import timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.jobs import job
+from app.mail import send_mail
+from app.models import ResetToken, User
+from app.util import utcnow
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def issue_reset_token(user_id, ttl_seconds=None):
+    """Create a reset token for user_id and return its plaintext.
+
+    Earlier tokens for the user are revoked, so only the newest link works.
+    The caller commits.
+    """
+    if ttl_seconds is None:
+        ttl_seconds = current_app.config["RESET_TOKEN_TTL_SECONDS"]
+    token = secrets.token_urlsafe(32)
+    db.session.execute(
+        db.delete(ResetToken).where(ResetToken.user_id == user_id),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.add(
+        ResetToken(
+            user_id=user_id,
+            token_hash=hash_token(token),
+            expires_at=utcnow() + timedelta(seconds=ttl_seconds),
+        )
+    )
+    return token
+
+
+def redeem_reset_token(token):
+    """Mark token used and return its user id, or None if it can't be used.
+
+    The conditional UPDATE is the single-use guarantee: of two concurrent
+    redemptions only one sees a row change. The caller commits.
+    """
+    token_hash = hash_token(token)
+    claimed = db.session.execute(
+        db.update(ResetToken)
+        .where(
+            ResetToken.token_hash == token_hash,
+            ResetToken.used_at.is_(None),
+            ResetToken.expires_at > utcnow(),
+        )
+        .values(used_at=utcnow()),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if not claimed:
+        return None
+    return db.session.scalar(
+        db.select(ResetToken.user_id).where(ResetToken.token_hash == token_hash)
+    )
+
+
+@job("password_reset_email")
+def send_password_reset_email(email):
+    """Issue a reset token for the account with email, if any, and mail the link."""
+    user = User.query.filter(db.func.lower(User.email) == email.lower()).first()
+    if user is None:
+        return
+    token = issue_reset_token(user.id)
+    db.session.commit()
+    send_mail(
+        user.email,
+        "Reset your password",
+        "Use this link to choose a new password:\n\n"
+        + current_app.config["PASSWORD_RESET_URL"].format(token=token)
+        + "\n\nIf you didn't ask for this, you can ignore this email.",
+    )
+
+
+def sweep_reset_tokens(batch_size=1000):
+    """Delete expired and used tokens, batch_size rows per transaction."""
+    deleted = 0
+    while True:
+        # Select then delete by id: LIMIT inside a DELETE isn't portable
+        ids = db.session.scalars(
+            db.select(ResetToken.id)
+            .where(
+                db.or_(
+                    ResetToken.expires_at <= utcnow(),
+                    ResetToken.used_at.is_not(None),
+                )
+            )
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            db.session.rollback()
+            return deleted
+        db.session.execute(
+            db.delete(ResetToken).where(ResetToken.id.in_(ids)),
+            execution_options={"synchronize_session": False},
+        )
+        db.session.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            return deleted
+
+
+class ResetTokenSweeper(threading.Thread):
+    """Daemon thread running sweep_reset_tokens() every interval seconds."""
+
+    def __init__(self, app, interval, batch_size):
+        super().__init__(name="reset-token-sweeper", daemon=True)
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    deleted = sweep_reset_tokens(self.batch_size)
+                    if deleted:
+                        self.app.logger.info("Swept %d reset token(s)", deleted)
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    self.app.logger.exception("Reset token sweep failed")
+                finally:
+                    db.session.remove()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_sweeper(app):
+    interval = app.config["RESET_TOKEN_SWEEP_SECONDS"]
+    if not interval or app.testing:
+        return None
+    sweeper = ResetTokenSweeper(
+        app, interval, app.config["RESET_TOKEN_SWEEP_BATCH_SIZE"]
+    )
+    sweeper.start()
+    return sweeper
+
+
+reset_tokens_cli = AppGroup("reset-tokens", help="Maintain password reset tokens.")
+
+
+@reset_tokens_cli.command("sweep")
+@click.option("--batch-size", default=1000, show_default=True,
+              help="Tokens deleted per transaction.")
+def sweep_command(batch_size):
+    """Delete expired and already-used reset tokens."""
+    click.echo(f"Deleted {sweep_reset_tokens(batch_size)} reset token(s)")
@@ -0,0 +1,248 @@
+from collections import defaultdict
+from decimal import Decimal
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.jobs import enqueue, job
+from app.models import Expense, ExpenseRollup, User
+
+CENT = Decimal("0.01")
+
+
+def month_key(spent_at):
+    return spent_at.strftime("%Y-%m")
+
+
+def month_expr(column):
+    # SQL equivalent of month_key() for the GROUP BY used by rebuilds
+    if db.session.get_bind().dialect.name == "postgresql":
+        return db.func.to_char(column, "YYYY-MM")
+    return db.func.strftime("%Y-%m", column)
+
+
+class RollupDelta:
+    """Collects rollup changes for one transaction and applies them at once.
+
+    Callers add a +1/-1 entry for every expense they insert, delete or move,
+    then call apply() before committing so the rollup commits (or rolls back)
+    together with the expenses themselves.
+    """
+
+    def __init__(self):
+        self.changes = defaultdict(lambda: [Decimal(0), 0])
+
+    def add(self, user_id, spent_at, category, amount, currency, sign=1):
+        entry = self.changes[(user_id, month_key(spent_at), category, currency)]
+        entry[0] += sign * Decimal(amount)
+        entry[1] += sign
+
+    def remove(self, user_id, spent_at, category, amount, currency):
+        self.add(user_id, spent_at, category, amount, currency, sign=-1)
+
+    def apply(self):
+        """Write the collected changes; returns them as a list of row deltas."""
+        params = [
+            {
+                "user_id": user_id,
+                "month": month,
+                "category": category,
+                "currency": currency,
+                "total": total,
+                "count": count,
+            }
+            for (user_id, month, category, currency), (total, count)
+            in self.changes.items()
+            if total or count
+        ]
+        self.changes.clear()
+        if not params:
+            return params
+
+        table = ExpenseRollup.__table__
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.user_id, table.c.month, table.c.category,
+                                table.c.currency],
+                set_={
+                    "total": table.c.total + stmt.excluded.total,
+                    "count": table.c.count + stmt.excluded.count,
+                },
+            )
+            db.session.execute(stmt, params)
+        else:
+            for row in params:
+                key = (
+                    (table.c.user_id == row["user_id"])
+                    & (table.c.month == row["month"])
+                    & (table.c.category == row["category"])
+                    & (table.c.currency == row["currency"])
+                )
+                result = db.session.execute(
+                    db.update(table)
+                    .where(key)
+                    .values(
+                        total=table.c.total + row["total"],
+                        count=table.c.count + row["count"],
+                    )
+                )
+                if result.rowcount == 0:
+                    db.session.execute(db.insert(table), row)
+
+        # Months/categories whose last expense went away disappear entirely
+        user_ids = {row["user_id"] for row in params}
+        db.session.execute(
+            db.delete(table).where(table.c.user_id.in_(user_ids), table.c.count <= 0)
+        )
+        return params
+
+
+def _expected_totals(user_ids):
+    from app.archive import archive_totals  # app.archive imports this module
+
+    month = month_expr(Expense.spent_at)
+    rows = db.session.execute(
+        db.select(
+            Expense.user_id,
+            month,
+            Expense.category,
+            Expense.currency,
+            db.func.sum(Expense.amount),
+            db.func.count(),
+        )
+        .where(Expense.user_id.in_(user_ids))
+        .group_by(Expense.user_id, month, Expense.category, Expense.currency)
+    )
+    totals = {
+        (user_id, month, category, currency): (Decimal(total), count)
+        for user_id, month, category, currency, total, count in rows
+    }
+    # Archived expenses still count towards their months
+    for key, (total, count) in archive_totals(user_ids).items():
+        hot_total, hot_count = totals.get(key, (Decimal(0), 0))
+        totals[key] = (hot_total + total, hot_count + count)
+    return {
+        key: (total.quantize(CENT), count) for key, (total, count) in totals.items()
+    }
+
+
+def _stored_totals(user_ids):
+    rows = db.session.execute(
+        db.select(
+            ExpenseRollup.user_id,
+            ExpenseRollup.month,
+            ExpenseRollup.category,
+            ExpenseRollup.currency,
+            ExpenseRollup.total,
+            ExpenseRollup.count,
+        ).where(ExpenseRollup.user_id.in_(user_ids))
+    )
+    return {
+        (user_id, month, category, currency): (Decimal(total).quantize(CENT), count)
+        for user_id, month, category, currency, total, count in rows
+    }
+
+
+def _user_id_chunks(chunk_size):
+    last_id = 0
+    while True:
+        user_ids = db.session.scalars(
+            db.select(User.id)
+            .where(User.id > last_id)
+            .order_by(User.id)
+            .limit(chunk_size)
+        ).all()
+        if not user_ids:
+            return
+        yield user_ids
+        last_id = user_ids[-1]
+
+
+def reconcile(chunk_size=500, rebuild=False):
+    """Recompute rollups from the expense table a chunk of users at a time.
+
+    Returns a list of (key, stored, expected) for every rollup row that had
+    drifted. With rebuild=True each chunk's rollups are rewritten from the
+    recomputed totals and committed before moving on to the next chunk.
+    """
+    drift = []
+    for user_ids in _user_id_chunks(chunk_size):
+        expected = _expected_totals(user_ids)
+        stored = _stored_totals(user_ids)
+        for key in sorted(expected.keys() | stored.keys()):
+            if expected.get(key) != stored.get(key):
+                drift.append((key, stored.get(key), expected.get(key)))
+
+        if rebuild:
+            db.session.execute(
+                db.delete(ExpenseRollup).where(ExpenseRollup.user_id.in_(user_ids))
+            )
+            if expected:
+                db.session.execute(
+                    db.insert(ExpenseRollup),
+                    [
+                        {
+                            "user_id": user_id,
+                            "month": month,
+                            "category": category,
+                            "currency": currency,
+                            "total": total,
+                            "count": count,
+                        }
+                        for (user_id, month, category, currency), (total, count)
+                        in expected.items()
+                    ],
+                )
+            db.session.commit()
+        else:
+            db.session.rollback()  # Release the read snapshot between chunks
+    return drift
+
+
+rollups_cli = AppGroup("rollups", help="Verify or rebuild the expense rollup table.")
+
+
+def _report(drift):
+    for (user_id, month, category, currency), stored, expected in drift:
+        click.echo(
+            f"user={user_id} month={month} category={category} "
+            f"currency={currency} stored={stored} expected={expected}"
+        )
+    click.echo(f"{len(drift)} drifted rollup row(s)")
+
+
+@rollups_cli.command("verify")
+@click.option("--chunk-size", default=500, show_default=True,
+              help="Users recomputed per query.")
+def verify_command(chunk_size):
+    """Report rollup rows that disagree with the expense table."""
+    drift = reconcile(chunk_size)
+    _report(drift)
+    if drift:
+        raise SystemExit(1)
+
+
+@job("rollups_rebuild")
+def rebuild_job(chunk_size=500):
+    drift = reconcile(chunk_size, rebuild=True)
+    if drift:
+        current_app.logger.warning("Rebuilt %d drifted rollup row(s)", len(drift))
+
+
+@rollups_cli.command("rebuild")
+@click.option("--chunk-size", default=500, show_default=True,
+              help="Users recomputed and committed per transaction.")
+@click.option("--background", is_flag=True,
+              help="Queue the rebuild for `flask jobs work` instead.")
+def rebuild_command(chunk_size, background):
+    """Recompute the rollup table from scratch."""
+    if background:
+        job_id = enqueue("rollups_rebuild", chunk_size=chunk_size)
+        db.session.commit()
+        click.echo(f"Queued job {job_id}")
+        return
+    _report(reconcile(chunk_size, rebuild=True))
@@ -0,0 +1,163 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from flask import g, has_request_context, request, session as cookie_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect
+from sqlalchemy.sql.dml import UpdateBase
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+LAST_WRITE_KEY = "_last_write"
+
+
+def _login_user_id():
+    """Id of the user Flask-Login authenticated this request, or None.
+
+    Never emits SQL: a User row expired by a commit still knows its
+    identity, and a TokenUser carries its id.
+    """
+    if not has_request_context():
+        return None
+    user = g.get("_login_user")
+    if user is None or not user.is_authenticated:
+        return None
+    state = inspect(user, raiseerr=False)
+    if state is not None and state.identity is not None:
+        return state.identity[0]
+    return user.id
+
+
+class RecentWrites:
+    """User id -> monotonic time of the user's last committed write.
+
+    Entries older than the sticky window are pruned on every write, so the
+    map only holds users who wrote within it.
+    """
+
+    def __init__(self):
+        self._stamps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark(self, user_id, window):
+        now = time.monotonic()
+        with self._lock:
+            self._stamps[user_id] = now
+            self._stamps.move_to_end(user_id)
+            while self._stamps:
+                oldest = next(iter(self._stamps.values()))
+                if now - oldest < window:
+                    break
+                self._stamps.popitem(last=False)
+
+    def recent(self, user_id, window):
+        stamp = self._stamps.get(user_id)
+        return stamp is not None and time.monotonic() - stamp < window
+
+
+class ReplicaRouter:
+    """Picks a read replica for each read-only request, round-robin.
+
+    Replica URIs become extra SQLALCHEMY_BINDS ("replica_0", ...). A client
+    whose last write was less than SQLALCHEMY_REPLICA_STICKY_SECONDS ago
+    keeps reading from the primary so it always sees its own writes. Writes
+    are stamped in the cookie session and, per user id, in this process, so
+    bearer-token clients that never send the cookie back are pinned too.
+    """
+
+    def __init__(self):
+        self.bind_keys = []
+        self.sticky_seconds = 0
+        self.writes = RecentWrites()
+        self._cycle = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # Must run before db.init_app so the replica engines get created
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        self.bind_keys = []
+        for number, uri in enumerate(app.config["SQLALCHEMY_REPLICA_URIS"]):
+            key = f"replica_{number}"
+            binds[key] = uri
+            self.bind_keys.append(key)
+        app.config["SQLALCHEMY_BINDS"] = binds
+        self.sticky_seconds = app.config["SQLALCHEMY_REPLICA_STICKY_SECONDS"]
+        self.writes = RecentWrites()
+        self._cycle = itertools.cycle(self.bind_keys)
+
+        if self.bind_keys:
+            app.before_request(self.route_request)
+
+    def route_request(self):
+        g.read_router = self
+        g.read_bind = None
+        g.read_user_checked = True
+        if request.method not in READ_METHODS:
+            return
+        last_write = cookie_session.get(LAST_WRITE_KEY)
+        if last_write and time.time() - last_write < self.sticky_seconds:
+            return
+        with self._lock:
+            g.read_bind = next(self._cycle)
+        # The user isn't known until authentication, which runs after this
+        # hook; get_bind checks their write stamp once they are
+        g.read_user_checked = False
+
+    def check_user(self):
+        """The read bind once the request's user is known, else the replica."""
+        user_id = _login_user_id()
+        if user_id is None:
+            return g.read_bind  # Authentication's own reads
+        g.read_user_checked = True
+        if self.writes.recent(user_id, self.sticky_seconds):
+            g.read_bind = None
+        return g.read_bind
+
+    def wrote(self):
+        user_id = _login_user_id()
+        if user_id is not None:
+            self.writes.mark(user_id, self.sticky_seconds)
+
+
+class RoutingSession(Session):
+    """Sends reads in a replica-routed request to that request's replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and not isinstance(clause, UpdateBase)
+            and has_request_context()
+        ):
+            key = g.get("read_bind")
+            if key is not None and not g.get("read_user_checked", True):
+                key = g.read_router.check_user()
+            if key is not None:
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _flushed(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _executed(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _committed(session):
+    if session.info.pop("wrote", False) and has_request_context():
+        # Read-your-writes: pin this client to the primary for a while
+        cookie_session[LAST_WRITE_KEY] = time.time()
+        router = g.get("read_router")
+        if router is not None:
+            router.wrote()
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _rolled_back(session):
+    session.info.pop("wrote", None)
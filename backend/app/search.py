@@ -0,0 +1,81 @@
+import base64
+import binascii
+import re
+from app import db
+from app.models import Expense
+
+MAX_TERMS = 8
+_fts = db.table("expense_fts", db.column("rowid"))
+_fts_ref = db.literal_column("expense_fts")
+
+
+def search_terms(text):
+    """Lower-cased word tokens of a query, at most MAX_TERMS of them."""
+    return re.findall(r"\w+", text.lower())[:MAX_TERMS]
+
+
+def encode_search_cursor(score, expense_id):
+    # repr() round-trips floats exactly, so the next page resumes precisely
+    raw = f"{score!r}|{expense_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_search_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, expense_id = base64.urlsafe_b64decode(padded).decode("utf-8").split("|")
+        return float(score), int(expense_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def _ranked_matches(user_id, text, terms):
+    """Select (id, score) of the user's matching expenses; lower scores rank higher."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "sqlite":
+        # Every term must match; the last one may be half typed, but prefix
+        # matching all of them costs nothing with the prefix indexes
+        match = " ".join(f'"{term}"*' for term in terms)
+        return (
+            db.select(Expense.id, db.func.bm25(_fts_ref).label("score"))
+            .select_from(_fts)
+            .join(Expense, Expense.id == _fts.c.rowid)
+            .where(_fts_ref.op("MATCH")(match), Expense.user_id == user_id)
+        )
+    if dialect == "postgresql":
+        # Word prefixes through the tsvector index, plus substrings through
+        # the trigram index for queries that start mid-word
+        query = db.func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+        document = db.func.to_tsvector("simple", Expense.description)
+        return (
+            db.select(Expense.id, (-db.func.ts_rank_cd(document, query)).label("score"))
+            .where(
+                Expense.user_id == user_id,
+                db.or_(
+                    document.op("@@")(query),
+                    Expense.description.icontains(text, autoescape=True),
+                ),
+            )
+        )
+    return db.select(Expense.id, db.literal(0.0).label("score")).where(
+        Expense.user_id == user_id,
+        Expense.description.icontains(text, autoescape=True),
+    )
+
+
+def search_expenses(user_id, text, limit, position, columns):
+    """Return up to limit + 1 rows of columns plus (score, id), best match first.
+
+    position is the (score, id) of the last row of the previous page.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return []
+    ranked = _ranked_matches(user_id, text.strip(), terms).subquery()
+    query = db.select(*columns, ranked.c.score, ranked.c.id).join(
+        ranked, ranked.c.id == Expense.id
+    )
+    if position is not None:
+        query = query.where(db.tuple_(ranked.c.score, ranked.c.id) > db.tuple_(*position))
+    query = query.order_by(ranked.c.score, ranked.c.id).limit(limit + 1)
+    return db.session.execute(query).all()
@@ -0,0 +1,153 @@
+import json
+from app import db
+from app.models import (
+    Attachment, Blob, Budget, BudgetAlert, Expense, ExpenseRollup, RecurringExpense,
+    User,
+)
+
+
+def isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def number(value):
+    # Numeric columns come back as Decimal, which JSON can't encode
+    return float(value) if value is not None else None
+
+
+class Field:
+    def __init__(self, column, encode=None):
+        self.column = column
+        self.encode = encode
+
+
+class Schema:
+    """Declared output fields of a resource, serialized from Core rows.
+
+    select() fetches exactly the declared columns, and dumps() turns the
+    resulting row tuples into JSON without building ORM objects, so large
+    lists skip the identity map and per-attribute instrumentation. Columns
+    appended to select() (cursor keys, scores) are ignored when dumping.
+    """
+
+    def __init__(self, **fields):
+        self.fields = {
+            name: field if isinstance(field, Field) else Field(field)
+            for name, field in fields.items()
+        }
+        self.names = tuple(self.fields)
+        self.columns = tuple(field.column for field in self.fields.values())
+        self.row_dict = self._compile()
+
+    def _compile(self):
+        # dict(zip()) builds the plain fields in C; only the few encoded ones
+        # (dates, decimals) are then overwritten one by one. Extra trailing
+        # columns fall off the end of the zip
+        names = self.names
+        encoded = tuple(
+            (name, index, field.encode)
+            for index, (name, field) in enumerate(self.fields.items())
+            if field.encode is not None
+        )
+
+        def row_dict(row):
+            data = dict(zip(names, row))
+            for name, index, encode in encoded:
+                data[name] = encode(row[index])
+            return data
+
+        return row_dict
+
+    def only(self, names):
+        """A schema with just these fields; KeyError names an unknown one."""
+        return Schema(**{name: self.fields[name] for name in names})
+
+    def select(self, *extra):
+        return db.select(*self.columns, *extra)
+
+    def dump(self, obj):
+        """Serialize one ORM object, e.g. right after writing it."""
+        return self.row_dict(
+            [getattr(obj, field.column.key) for field in self.fields.values()]
+        )
+
+    def dumps(self, rows):
+        """JSON array text for a list of rows."""
+        return json.dumps([self.row_dict(row) for row in rows])
+
+    def iter_dumps(self, partitions):
+        """Yield a JSON array in pieces, one per partition of rows."""
+        yield "["
+        separator = ""
+        for rows in partitions:
+            if rows:
+                yield separator + self.dumps(rows)[1:-1]
+                separator = ","
+        yield "]"
+
+
+EXPENSE = Schema(
+    id=Expense.id,
+    amount=Field(Expense.amount, number),
+    currency=Expense.currency,
+    description=Expense.description,
+    category=Expense.category,
+    spent_at=Field(Expense.spent_at, isoformat),
+)
+
+ROLLUP = Schema(
+    month=ExpenseRollup.month,
+    category=ExpenseRollup.category,
+    currency=ExpenseRollup.currency,
+    total=Field(ExpenseRollup.total, number),
+    count=ExpenseRollup.count,
+)
+
+# Fields GET /auth/users may project with ?fields=; never the password hash
+USER = Schema(
+    id=User.id,
+    username=User.username,
+    email=User.email,
+    created_at=Field(User.created_at, isoformat),
+)
+
+BUDGET = Schema(
+    id=Budget.id,
+    category=Budget.category,
+    amount=Field(Budget.amount, number),
+    currency=Budget.currency,
+    start_month=Budget.start_month,
+)
+
+ALERT = Schema(
+    id=BudgetAlert.id,
+    budget_id=BudgetAlert.budget_id,
+    month=BudgetAlert.month,
+    threshold=BudgetAlert.threshold,
+    spent=Field(BudgetAlert.spent, number),
+    created_at=Field(BudgetAlert.created_at, isoformat),
+)
+
+# Selected with .join(Blob, Blob.sha256 == Attachment.blob_sha256)
+ATTACHMENT = Schema(
+    id=Attachment.id,
+    expense_id=Attachment.expense_id,
+    filename=Attachment.filename,
+    content_type=Blob.mimetype,
+    size=Blob.size,
+    sha256=Attachment.blob_sha256,
+    created_at=Field(Attachment.created_at, isoformat),
+)
+
+RECURRING = Schema(
+    id=RecurringExpense.id,
+    amount=Field(RecurringExpense.amount, number),
+    currency=RecurringExpense.currency,
+    description=RecurringExpense.description,
+    category=RecurringExpense.category,
+    frequency=RecurringExpense.frequency,
+    interval=RecurringExpense.interval,
+    starts_at=Field(RecurringExpense.starts_at, isoformat),
+    ends_at=Field(RecurringExpense.ends_at, isoformat),
+    next_at=Field(RecurringExpense.next_at, isoformat),
+)
@@ -0,0 +1,295 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from app import db
+from app.archive import archive_months, archived_rows
+from app.fx import CENT, month_end, rates
+from app.models import Expense
+
+BUCKETS = ("minute", "hour", "day", "week", "month")
+# Span covered by each range, and the bucket it uses unless told otherwise
+RANGES = {
+    "day": (timedelta(days=1), "hour"),
+    "week": (timedelta(days=7), "hour"),
+    "month": (timedelta(days=30), "day"),
+    "year": (timedelta(days=365), "day"),
+}
+_STEPS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(days=7),
+}
+
+
+def truncate(value, bucket):
+    """Start of the bucket holding value; weeks start on Monday."""
+    if bucket == "minute":
+        return value.replace(second=0, microsecond=0)
+    if bucket == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    day = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        return day
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def advance(start, bucket):
+    """Start of the bucket after the one starting at start."""
+    if bucket != "month":
+        return start + _STEPS[bucket]
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def bucket_count(start, end, bucket):
+    if bucket == "month":
+        return (end.year - start.year) * 12 + end.month - start.month
+    return int((end - start) / _STEPS[bucket])
+
+
+def bucket_expr(column, bucket):
+    # SQL equivalent of truncate(), so expenses are bucketed by the database
+    if db.session.get_bind().dialect.name == "postgresql":
+        # date_trunc('week') starts weeks on Monday too
+        return db.func.date_trunc(bucket, column)
+    if bucket == "week":
+        # Back six days, then forward to the next Monday: the Monday on or
+        # before the value
+        return db.func.strftime("%Y-%m-%d 00:00:00", column, "-6 days", "weekday 1")
+    formats = {
+        "minute": "%Y-%m-%d %H:%M:00",
+        "hour": "%Y-%m-%d %H:00:00",
+        "day": "%Y-%m-%d 00:00:00",
+        "month": "%Y-%m-01 00:00:00",
+    }
+    return db.func.strftime(formats[bucket], column)
+
+
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets: indexes of threshold points to keep.
+
+    points is a list of (x, y) sorted by x. The first and last points are
+    always kept; in between, each of threshold - 2 equal slices contributes
+    the point forming the largest triangle with the point kept before it and
+    the average of the next slice, which preserves peaks and dips far
+    better than taking every nth point.
+    """
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(range(count))
+
+    every = (count - 2) / (threshold - 2)
+    kept = [0]
+    previous = 0
+    for slice_number in range(threshold - 2):
+        start = int(slice_number * every) + 1
+        end = int((slice_number + 1) * every) + 1
+        next_start, next_end = end, min(int((slice_number + 2) * every) + 1, count)
+        next_points = points[next_start:next_end]
+        average_x = sum(x for x, _ in next_points) / len(next_points)
+        average_y = sum(y for _, y in next_points) / len(next_points)
+
+        previous_x, previous_y = points[previous]
+        best, best_area = start, -1.0
+        for index in range(start, end):
+            x, y = points[index]
+            # Twice the triangle's area; only the comparison matters
+            area = abs(
+                (previous_x - average_x) * (y - previous_y)
+                - (previous_x - x) * (average_y - previous_y)
+            )
+            if area > best_area:
+                best, best_area = index, area
+        kept.append(best)
+        previous = best
+    kept.append(count - 1)
+    return kept
+
+
+def _parse_bucket(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def bucket_rows(user_id, start, end, bucket, category=None):
+    """Per-(bucket, currency) totals of user_id's expenses in [start, end).
+
+    One grouped query; each row also carries the currency's running total
+    up to and including its bucket, from a window over the grouped rows.
+    Archived months in the range are bucketed here instead and merged in.
+    """
+    bucket_start = bucket_expr(Expense.spent_at, bucket)
+    total = db.func.sum(Expense.amount)
+    query = (
+        db.select(
+            bucket_start,
+            Expense.currency,
+            total,
+            db.func.count(),
+            db.func.sum(total).over(
+                partition_by=Expense.currency, order_by=bucket_start
+            ),
+        )
+        .where(
+            Expense.user_id == user_id,
+            Expense.spent_at >= start,
+            Expense.spent_at < end,
+        )
+        .group_by(bucket_start, Expense.currency)
+        .order_by(bucket_start)
+    )
+    if category is not None:
+        query = query.where(Expense.category == category)
+    rows = [
+        (_parse_bucket(bucket_start), currency, Decimal(total), count, Decimal(running))
+        for bucket_start, currency, total, count, running
+        in db.session.execute(query)
+    ]
+    months = archive_months(user_id, start, end)
+    if not months:
+        return rows
+    archived = archived_rows(user_id, months,
+                             ("spent_at", "currency", "amount", "category"), start, end)
+    return _merge_archived(rows, archived, bucket, category)
+
+
+def _merge_archived(rows, archived, bucket, category):
+    totals = {}
+    for bucket_start, currency, total, count, _ in rows:
+        totals[(bucket_start, currency)] = [total, count]
+    for spent_at, currency, amount, expense_category in archived:
+        if category is not None and expense_category != category:
+            continue
+        entry = totals.setdefault((truncate(spent_at, bucket), currency),
+                                  [Decimal(0), 0])
+        entry[0] += amount
+        entry[1] += 1
+    # The SQL running totals no longer hold; recompute them in the same order
+    merged = []
+    running = {}
+    for (bucket_start, currency), (total, count) in sorted(totals.items()):
+        running[currency] = running.get(currency, Decimal(0)) + total
+        merged.append((bucket_start, currency, total, count, running[currency]))
+    return merged
+
+
+def build_series(rows, home):
+    """Merge bucket_rows() into home-currency points, oldest first.
+
+    Foreign amounts are converted at the rate on the last day of their
+    month, like the monthly summary. Home-currency running totals come
+    straight from the SQL window; converted amounts are added to them as
+    they accumulate. Rows whose rate is absent are left out. Returns
+    (points, unconverted), unconverted being the sorted currencies that
+    lacked a rate.
+    """
+    keys = set()
+    for bucket_start, currency, _, _, _ in rows:
+        if currency != home:
+            day = month_end(bucket_start.strftime("%Y-%m"))
+            keys.update(((currency, day), (home, day)))
+    found = rates.rates(keys) if keys else {}
+
+    points = OrderedDict()
+    unconverted = set()
+    home_running = Decimal(0)
+    converted_running = Decimal(0)
+    for bucket_start, currency, total, count, running in rows:
+        if currency == home:
+            home_running = running
+        else:
+            day = month_end(bucket_start.strftime("%Y-%m"))
+            missing = [needed for needed in (currency, home) if found[(needed, day)] is None]
+            if missing:
+                unconverted.update(missing)
+                continue
+            total = total * found[(currency, day)] / found[(home, day)]
+            converted_running += total
+        point = points.setdefault(bucket_start, [Decimal(0), 0, Decimal(0)])
+        point[0] += total
+        point[1] += count
+        # Rows come in bucket order, so the last row of a bucket sets it
+        point[2] = home_running + converted_running
+    return [
+        {
+            "t": bucket_start.isoformat(),
+            "total": float(total.quantize(CENT)),
+            "count": count,
+            "cumulative": float(cumulative.quantize(CENT)),
+        }
+        for bucket_start, (total, count, cumulative) in points.items()
+    ], sorted(unconverted)
+
+
+def downsample(points, threshold):
+    """Keep at most threshold points, chosen by LTTB on the bucket totals.
+
+    Running totals stay exact at every kept point; totals and counts of
+    dropped buckets are not folded into their neighbours.
+    """
+    if len(points) <= threshold:
+        return points
+    xy = [(datetime.fromisoformat(point["t"]).timestamp(), point["total"])
+          for point in points]
+    return [points[index] for index in lttb(xy, threshold)]
+
+
+class SeriesCache:
+    """Per-user LRU of built series bodies, valid for one data version.
+
+    Entries are tagged with the version string they were built from (the
+    user's data version and the rates version). A write bumps the data
+    version, so the next read sees a different tag and drops the user's
+    entries; other processes notice the same way, with no messaging.
+    """
+
+    def __init__(self, users=1000, per_user=32):
+        self.users = users
+        self.per_user = per_user
+        self._entries = OrderedDict()  # user id -> (version, OrderedDict)
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        with self._lock:
+            self.users = config["SERIES_CACHE_USERS"]
+            self.per_user = config["SERIES_CACHE_PER_USER"]
+            self._entries.clear()
+
+    def get(self, user_id, version, key):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(user_id)
+            bodies = entry[1]
+            body = bodies.get(key)
+            if body is not None:
+                bodies.move_to_end(key)
+            return body
+
+    def put(self, user_id, version, key, body):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version:
+                entry = self._entries[user_id] = (version, OrderedDict())
+            self._entries.move_to_end(user_id)
+            bodies = entry[1]
+            bodies[key] = body
+            bodies.move_to_end(key)
+            while len(bodies) > self.per_user:
+                bodies.popitem(last=False)
+            while len(self._entries) > self.users:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+series_cache = SeriesCache()
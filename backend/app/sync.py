@@ -0,0 +1,371 @@
+import json
+from datetime import timedelta
+import click
+from flask import Blueprint, Response, current_app, jsonify, request
+from flask.cli import AppGroup
+from flask_login import current_user, login_required
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.archive import find_archived_many, restore_expense
+from app.events import broker
+from app.expenses import apply_write, parse_limit, publish_alerts, validate_expense
+from app.jobs import enqueue, job
+from app.models import Expense, ExpenseChange, SyncMutation, User
+from app.rollups import RollupDelta
+from app.serializers import EXPENSE
+from app.util import utcnow
+from app.versions import conditional, current_user_version
+
+sync = Blueprint("sync", __name__)
+
+OPERATIONS = ("create", "update", "delete")
+
+
+def record_changes(user_id, seq, upserted=(), deleted=()):
+    """Stamp changed expenses with seq in the change log, in the caller's transaction.
+
+    One row per expense, overwritten on every change, so the log is always
+    compacted: a row changed ten times since a client's last sync is sent
+    once.
+    """
+    now = utcnow()
+    params = [
+        {"user_id": user_id, "expense_id": expense_id, "seq": seq,
+         "deleted": is_deleted, "changed_at": now}
+        for ids, is_deleted in ((upserted, False), (deleted, True))
+        for expense_id in ids
+    ]
+    if not params:
+        return
+    table = ExpenseChange.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.expense_id],
+            set_={"seq": stmt.excluded.seq, "deleted": stmt.excluded.deleted,
+                  "changed_at": stmt.excluded.changed_at},
+        )
+        db.session.execute(stmt, params)
+    else:
+        db.session.execute(
+            db.delete(table).where(
+                table.c.user_id == user_id,
+                table.c.expense_id.in_([row["expense_id"] for row in params]),
+            )
+        )
+        db.session.execute(db.insert(table), params)
+
+
+def _change_rows(user_id, since, limit):
+    """Changes after since in (seq, id) order, never splitting one seq.
+
+    A seq is one transaction's changes; ending a page inside it would make
+    the next since skip the rest, so the page is extended to its end.
+    """
+    conditions = [ExpenseChange.user_id == user_id]
+    if since == 0:
+        # A full sync has nothing to delete
+        conditions.append(ExpenseChange.deleted.is_(False))
+    query = (
+        db.select(ExpenseChange.seq, ExpenseChange.expense_id, ExpenseChange.deleted,
+                  *EXPENSE.columns)
+        .outerjoin(Expense, Expense.id == ExpenseChange.expense_id)
+        .where(*conditions)
+        .order_by(ExpenseChange.seq, ExpenseChange.expense_id)
+    )
+    rows = db.session.execute(
+        query.where(ExpenseChange.seq > since).limit(limit + 1)
+    ).all()
+    if len(rows) <= limit:
+        return rows, False
+
+    last_seq, last_id = rows[limit - 1][:2]
+    rows = rows[:limit]
+    if rows[-1][0] == last_seq:
+        rows += db.session.execute(
+            query.where(ExpenseChange.seq == last_seq,
+                        ExpenseChange.expense_id > last_id)
+        ).all()
+    more = db.session.scalar(
+        db.select(
+            db.select(ExpenseChange.expense_id)
+            .where(*conditions, ExpenseChange.seq > last_seq)
+            .exists()
+        )
+    )
+    return rows, more
+
+
+@sync.route("", methods=["GET"])
+@login_required
+@conditional(current_user_version)
+def pull():
+    try:
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        since = -1
+    if since < 0:
+        return jsonify({"error": "Since must be a non-negative integer"}), 400
+    limit = parse_limit(
+        request.args.get("limit"),
+        current_app.config["SYNC_PAGE_SIZE"],
+        current_app.config["SYNC_MAX_PAGE_SIZE"],
+    )
+    if limit is None:
+        return jsonify({"error": "Limit must be a positive integer"}), 400
+
+    user_id = current_user.id
+    if since and since < current_user.tombstone_seq:
+        # Deletions after since may have been compacted away
+        return jsonify({"error": "Changes since this point are no longer kept; "
+                                 "resync from since=0", "resync": True}), 410
+
+    rows, more = _change_rows(user_id, since, limit)
+    # Live changes whose expense is archived, looked up a blob at a time
+    archived = find_archived_many(
+        user_id,
+        [row[1] for row in rows if not row[2] and row[3] is None],
+        tuple(column.key for column in EXPENSE.columns),
+    )
+    changes = []
+    for row in rows:
+        seq, expense_id, deleted = row[:3]
+        change = {"seq": seq, "id": expense_id, "deleted": deleted}
+        if not deleted:
+            expense = row[3:] if row[3] is not None else archived.get(expense_id)
+            if expense is None:
+                continue  # Deleted by a transaction committed after this read
+            change["expense"] = EXPENSE.row_dict(expense)
+        changes.append(change)
+
+    return Response(
+        json.dumps({
+            "changes": changes,
+            "since": rows[-1][0] if rows else since,
+            "more": more,
+        }),
+        mimetype="application/json",
+    )
+
+
+def _validate_mutations(mutations):
+    """Return an error message for a malformed batch, else None."""
+    if not isinstance(mutations, list) or not mutations:
+        return "Mutations must be a non-empty list"
+    maximum = current_app.config["SYNC_MAX_MUTATIONS"]
+    if len(mutations) > maximum:
+        return f"At most {maximum} mutations per request"
+    keys = set()
+    for index, mutation in enumerate(mutations):
+        if not isinstance(mutation, dict):
+            return f"Mutation {index} must be an object"
+        key = mutation.get("key")
+        if not isinstance(key, str) or not 0 < len(key) <= 64:
+            return f"Mutation {index} needs a key of 1 to 64 characters"
+        if key in keys:
+            return f"Mutation {index} repeats key {key!r}"
+        keys.add(key)
+        if mutation.get("op") not in OPERATIONS:
+            return f"Mutation {index} op must be one of: {', '.join(OPERATIONS)}"
+        if mutation["op"] != "create" and (
+                not isinstance(mutation.get("id"), int)
+                or isinstance(mutation.get("id"), bool)):
+            return f"Mutation {index} needs an integer id"
+        if mutation["op"] != "delete" and not isinstance(mutation.get("data"), dict):
+            return f"Mutation {index} needs a data object"
+    return None
+
+
+def _load_expenses(user_id, ids):
+    def load():
+        return {
+            expense.id: expense for expense in
+            Expense.query.filter(Expense.user_id == user_id, Expense.id.in_(ids))
+        }
+
+    expenses = load()
+    # Archived ones come back to the expense table to be written
+    restored = [expense_id for expense_id in ids
+                if expense_id not in expenses and restore_expense(user_id, expense_id)]
+    return load() if restored else expenses
+
+
+@sync.route("", methods=["POST"])
+@login_required
+def push():
+    """Apply a client's queued offline mutations in one transaction.
+
+    Each mutation carries a client-generated idempotency key; one already
+    applied is answered with its stored result and not applied again. An
+    invalid mutation rejects the whole batch, while one naming an expense
+    that no longer exists gets a 404 result and the rest still apply.
+    """
+    data = request.get_json(silent=True) or {}
+    mutations = data.get("mutations")
+    error = _validate_mutations(mutations)
+    if error:
+        return jsonify({"error": error}), 400
+
+    user_id = current_user.id
+    results = {
+        key: json.loads(result) for key, result in db.session.execute(
+            db.select(SyncMutation.key, SyncMutation.result).where(
+                SyncMutation.user_id == user_id,
+                SyncMutation.key.in_([mutation["key"] for mutation in mutations]),
+            )
+        )
+    }
+    pending = [mutation for mutation in mutations if mutation["key"] not in results]
+
+    fields = {}
+    for index, mutation in enumerate(mutations):
+        if mutation["key"] not in results and mutation["op"] != "delete":
+            fields[mutation["key"]], error = validate_expense(
+                mutation["data"], partial=mutation["op"] == "update"
+            )
+            if error:
+                return jsonify({"error": error, "index": index,
+                                "key": mutation["key"]}), 400
+
+    expenses = _load_expenses(
+        user_id, {mutation["id"] for mutation in pending if mutation["op"] != "create"}
+    )
+    rollup = RollupDelta()
+    written, upserted, deleted = {}, set(), set()
+    for mutation in pending:
+        key, op = mutation["key"], mutation["op"]
+        if op == "create":
+            fields[key].setdefault("currency", current_user.home_currency)
+            expense = Expense(user_id=user_id, **fields[key])
+            db.session.add(expense)
+            rollup.add(user_id, expense.spent_at, expense.category, expense.amount,
+                       expense.currency)
+            written[key] = (201, expense)
+            continue
+
+        expense = expenses.get(mutation["id"])
+        if expense is None:
+            results[key] = {"status": 404, "error": "Expense not found"}
+            continue
+        rollup.remove(user_id, expense.spent_at, expense.category, expense.amount,
+                      expense.currency)
+        if op == "update":
+            for name, value in fields[key].items():
+                setattr(expense, name, value)
+            rollup.add(user_id, expense.spent_at, expense.category, expense.amount,
+                       expense.currency)
+            written[key] = (200, expense)
+        else:
+            db.session.delete(expense)
+            del expenses[expense.id]
+            deleted.add(expense.id)
+            results[key] = {"status": 200, "id": expense.id}
+
+    alerts = []
+    if pending:
+        db.session.flush()  # Assigns the created expenses' ids
+        for key, (status, expense) in written.items():
+            upserted.add(expense.id)
+            results[key] = {"status": status, "expense": EXPENSE.dump(expense)}
+        if upserted or deleted:
+            alerts = apply_write(user_id, rollup, upserted, deleted)
+        now = utcnow()
+        db.session.execute(
+            db.insert(SyncMutation),
+            [{"user_id": user_id, "key": mutation["key"], "created_at": now,
+              "result": json.dumps(results[mutation["key"]])}
+             for mutation in pending],
+        )
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent request stored one of these keys first
+            db.session.rollback()
+            return jsonify({"error": "Some of these mutations were applied by a "
+                                     "concurrent request; retry"}), 409
+
+    if upserted or deleted:
+        # Other devices pull the changes with GET /sync
+        broker.publish(user_id, "expenses.synced",
+                       {"changed": len(upserted) + len(deleted)})
+        publish_alerts(user_id, alerts)
+    return jsonify({
+        "results": [{"key": mutation["key"], **results[mutation["key"]]}
+                    for mutation in mutations]
+    }), 200
+
+
+def compact(tombstone_days, key_days, chunk_size=500):
+    """Delete old tombstones and idempotency keys; returns (tombstones, keys).
+
+    A user's tombstone_seq is raised to the newest tombstone removed, so
+    clients that synced before it are told to resync rather than silently
+    keeping expenses deleted elsewhere. Commits every chunk_size users.
+    """
+    now = utcnow()
+    floors = db.session.execute(
+        db.select(ExpenseChange.user_id, db.func.max(ExpenseChange.seq))
+        .where(ExpenseChange.deleted.is_(True),
+               ExpenseChange.changed_at < now - timedelta(days=tombstone_days))
+        .group_by(ExpenseChange.user_id)
+    ).all()
+
+    tombstones = 0
+    for start in range(0, len(floors), chunk_size):
+        for user_id, floor in floors[start:start + chunk_size]:
+            db.session.execute(
+                db.update(User)
+                .where(User.id == user_id, User.tombstone_seq < floor)
+                .values(tombstone_seq=floor),
+                execution_options={"synchronize_session": False},
+            )
+            # Only up to the floor: newer tombstones stay until the next run
+            tombstones += db.session.execute(
+                db.delete(ExpenseChange).where(
+                    ExpenseChange.user_id == user_id,
+                    ExpenseChange.deleted.is_(True),
+                    ExpenseChange.seq <= floor,
+                )
+            ).rowcount
+        db.session.commit()
+
+    keys = db.session.execute(
+        db.delete(SyncMutation).where(
+            SyncMutation.created_at < now - timedelta(days=key_days)
+        )
+    ).rowcount
+    db.session.commit()
+    return tombstones, keys
+
+
+@job("sync_compact")
+def compact_job(chunk_size=500):
+    config = current_app.config
+    tombstones, keys = compact(config["SYNC_TOMBSTONE_DAYS"],
+                               config["SYNC_IDEMPOTENCY_DAYS"], chunk_size)
+    current_app.logger.info("Compacted %d tombstone(s) and %d idempotency key(s)",
+                            tombstones, keys)
+
+
+sync_cli = AppGroup("sync", help="Maintain the sync change log.")
+
+
+@sync_cli.command("compact")
+@click.option("--chunk-size", default=500, show_default=True,
+              help="Users compacted per transaction.")
+@click.option("--background", is_flag=True,
+              help="Queue the compaction for `flask jobs work` instead.")
+def compact_command(chunk_size, background):
+    """Delete tombstones and idempotency keys past their retention."""
+    if background:
+        job_id = enqueue("sync_compact", chunk_size=chunk_size)
+        db.session.commit()
+        click.echo(f"Queued job {job_id}")
+        return
+    config = current_app.config
+    tombstones, keys = compact(config["SYNC_TOMBSTONE_DAYS"],
+                               config["SYNC_IDEMPOTENCY_DAYS"], chunk_size)
+    click.echo(f"Compacted {tombstones} tombstone(s) and {keys} idempotency key(s)")
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from app import db
+from app.models import User
+
+
+class TokenUser(UserMixin):
+    """The user named by a verified access token, loaded only when needed.
+
+    The id comes from the token, and it is all most routes use. Reading or
+    setting any other attribute goes to the User row, which is loaded on first
+    use through the session's identity map. Within one request it is loaded
+    at most once.
+    """
+
+    def __init__(self, user_id):
+        object.__setattr__(self, "id", user_id)
+
+    def _user(self):
+        return db.session.get(User, self.id)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._user(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._user(), name, value)
+
+
+class CredentialCache:
+    """LRU of user id -> credential version, trusted for ttl seconds.
+
+    This lets most requests authenticate without a query. A version bumped
+    in this process is dropped at once. Other processes notice it within ttl
+    seconds.
+    """
+
+    def __init__(self, ttl=30, capacity=100000):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] <= now:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[0]
+
+    def put(self, user_id, version):
+        with self._lock:
+            self._entries[user_id] = (version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TokenIssuer:
+    """Signed, expiring bearer tokens: [user id, credential version].
+
+    Access and refresh tokens are signed with different salts, so neither
+    works as the other. A refresh always checks the database. An access
+    token is checked against the credential cache, so authentication
+    normally costs one HMAC and no query.
+    """
+
+    def __init__(self):
+        self.access_seconds = 900
+        self.refresh_seconds = 30 * 86400
+        self.credentials = CredentialCache()
+        self._access = self._refresh = None
+
+    def configure(self, config):
+        self.access_seconds = config["ACCESS_TOKEN_SECONDS"]
+        self.refresh_seconds = config["REFRESH_TOKEN_SECONDS"]
+        self.credentials = CredentialCache(
+            config["CREDENTIAL_CACHE_SECONDS"], config["CREDENTIAL_CACHE_SIZE"]
+        )
+        self._access = URLSafeTimedSerializer(config["SECRET_KEY"], salt="access-token")
+        self._refresh = URLSafeTimedSerializer(config["SECRET_KEY"], salt="refresh-token")
+
+    def issue(self, user):
+        claims = [user.id, user.credential_version]
+        self.credentials.put(user.id, user.credential_version)
+        return {
+            "access_token": self._access.dumps(claims),
+            "refresh_token": self._refresh.dumps(claims),
+            "token_type": "Bearer",
+            "expires_in": self.access_seconds,
+        }
+
+    def _load(self, serializer, token, max_age):
+        try:
+            user_id, version = serializer.loads(token, max_age=max_age)
+        except (BadSignature, TypeError, ValueError):
+            return None  # Tampered, expired or malformed
+        return user_id, version
+
+    def authenticate(self, token):
+        """Return a TokenUser for a valid access token, else None."""
+        claims = self._load(self._access, token, self.access_seconds)
+        if claims is None:
+            return None
+        user_id, version = claims
+        current = self.credentials.get(user_id)
+        if current is None:
+            current = db.session.scalar(
+                db.select(User.credential_version).where(User.id == user_id)
+            )
+            if current is None:
+                return None  # Deleted user
+            self.credentials.put(user_id, current)
+        return TokenUser(user_id) if version == current else None
+
+    def refresh(self, token):
+        """Return the User for a valid refresh token, else None."""
+        claims = self._load(self._refresh, token, self.refresh_seconds)
+        if claims is None:
+            return None
+        user_id, version = claims
+        user = db.session.get(User, user_id)
+        if user is None or user.credential_version != version:
+            return None
+        return user
+
+
+tokens = TokenIssuer()
+
+
+def bump_credential_version(user_id):
+    """Revoke every token issued to user_id; the caller commits."""
+    db.session.execute(
+        db.update(User)
+        .where(User.id == user_id)
+        .values(credential_version=User.credential_version + 1),
+        execution_options={"synchronize_session": False},
+    )
+    tokens.credentials.invalidate(user_id)
+
+
+def bearer_token(request):
+    header = request.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    return token.strip() if scheme.lower() == "bearer" and token.strip() else None
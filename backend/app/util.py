@@ -0,0 +1,6 @@
+from datetime import datetime, timezone
+
+
+def utcnow():
+    """The current UTC time, naive, as the DateTime columns store it."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
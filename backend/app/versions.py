@@ -0,0 +1,115 @@
+import hashlib
+from functools import wraps
+from flask import current_app, make_response, request
+from flask_login import current_user
+from sqlalchemy import event
+from app import db
+from app.models import DataVersion, User
+
+USERS_VERSION = "users"
+
+
+def bump_user_version(user_id):
+    """Mark user_id's data as changed, in the caller's transaction.
+
+    Returns the new version. The UPDATE locks the user's row until commit,
+    so concurrent writers get increasing versions in commit order, which is
+    what lets the sync change log use them as sequence numbers.
+    """
+    query = (
+        db.update(User)
+        .where(User.id == user_id)
+        .values(data_version=User.data_version + 1)
+    )
+    options = {"synchronize_session": False}
+    if db.session.get_bind().dialect.update_returning:
+        return db.session.execute(
+            query.returning(User.data_version), execution_options=options
+        ).scalar_one()
+    db.session.execute(query, execution_options=options)
+    return user_version(user_id)
+
+
+def user_version(user_id):
+    return db.session.scalar(db.select(User.data_version).where(User.id == user_id))
+
+
+def global_version(name):
+    return db.session.scalar(
+        db.select(DataVersion.version).where(DataVersion.name == name)
+    ) or 0
+
+
+def bump_version(name):
+    """Bump a named DataVersion counter, in the caller's transaction."""
+    bumped = db.session.execute(
+        db.update(DataVersion)
+        .where(DataVersion.name == name)
+        .values(version=DataVersion.version + 1)
+    ).rowcount
+    if not bumped:
+        db.session.add(DataVersion(name=name, version=1))
+
+
+def current_user_version():
+    return f"u{current_user.id}.{user_version(current_user.id)}"
+
+
+def users_version():
+    return f"{USERS_VERSION}.{global_version(USERS_VERSION)}"
+
+
+def _bump_users_version(connection):
+    connection.execute(
+        db.update(DataVersion)
+        .where(DataVersion.name == USERS_VERSION)
+        .values(version=DataVersion.version + 1)
+    )
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_delete")
+def _user_added_or_removed(mapper, connection, user):
+    _bump_users_version(connection)
+
+
+@event.listens_for(User, "after_update")
+def _user_updated(mapper, connection, user):
+    # Only fields GET /auth/users can show; password rehashes don't count
+    state = db.inspect(user)
+    if state.attrs.username.history.has_changes() or \
+            state.attrs.email.history.has_changes():
+        _bump_users_version(connection)
+
+
+def conditional(version):
+    """Give a GET view a strong ETag and answer If-None-Match with 304.
+
+    version() returns a string naming the data version the response is built
+    from. It is read before the view runs: a write racing the view can only
+    make the tag older than the body, which costs the client one extra
+    refetch, never a stale 304.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # The same version yields different bodies per path and query
+            variant = hashlib.blake2b(
+                request.full_path.encode("utf-8"), digest_size=6
+            ).hexdigest()
+            etag = f"{version()}-{variant}"
+
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # Per-user data: browsers may keep it but must revalidate
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+
+        return wrapper
+
+    return decorator
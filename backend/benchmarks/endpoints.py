@@ -0,0 +1,294 @@
+"""HTTP benchmark for the auth and expense endpoints.
+
+    python -m benchmarks.endpoints [--users 200] [--expenses-per-user 50]
+        [--clients 8] [--requests 400] [--output results.json]
+        [--baseline baseline.json [--tolerance 0.15]] [--save-baseline]
+
+Builds the app through create_app() on a throwaway file-backed SQLite
+database, seeds it deterministically from --seed, serves it from a threaded
+HTTP server and drives every scenario with --clients concurrent keep-alive
+connections. Latency percentiles and throughput are printed and written as
+JSON. With --baseline the run is compared against a stored result and the
+exit status is 1 if any scenario's p95 or throughput regressed by more than
+--tolerance.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from werkzeug.serving import WSGIRequestHandler, make_server
+from app import create_app, db, hasher
+from app.models import Expense, User
+from app.rollups import reconcile
+from config import TestConfig
+
+CATEGORIES = ("Groceries", "Utilities", "Transportation", "Entertainment", "Rent",
+              "Miscellaneous")
+PASSWORD = "password123"
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def build_app(workdir, bcrypt_rounds):
+    class BenchConfig(TestConfig):
+        TESTING = False
+        RATELIMIT_ENABLED = False  # One client IP sends everything
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(workdir, "bench.db")
+        BCRYPT_LOG_ROUNDS = bcrypt_rounds
+        BCRYPT_MAX_QUEUE = 1024
+
+    return create_app(BenchConfig)
+
+
+def seed(app, users, expenses_per_user, seed_value):
+    rng = random.Random(seed_value)
+    start = datetime(2023, 1, 1)
+    with app.app_context():
+        db.create_all()
+        # One hash shared by every seeded user keeps seeding fast
+        password = hasher.generate_password_hash(PASSWORD)
+        db.session.execute(
+            db.insert(User),
+            [
+                {"username": f"user{n}", "email": f"user{n}@example.com",
+                 "password": password}
+                for n in range(users)
+            ],
+        )
+        user_ids = db.session.scalars(db.select(User.id).order_by(User.id)).all()
+        batch = []
+        for user_id in user_ids:
+            for _ in range(expenses_per_user):
+                batch.append(
+                    {
+                        "user_id": user_id,
+                        "amount": round(rng.uniform(1, 500), 2),
+                        "description": f"Expense {rng.randrange(10 ** 6)}",
+                        "category": rng.choice(CATEGORIES),
+                        "spent_at": start + timedelta(minutes=rng.randrange(10 ** 6)),
+                    }
+                )
+            if len(batch) >= 5000:
+                db.session.execute(db.insert(Expense), batch)
+                batch = []
+        if batch:
+            db.session.execute(db.insert(Expense), batch)
+        db.session.commit()
+        reconcile(rebuild=True)
+        db.session.remove()
+
+
+class Client:
+    def __init__(self, port):
+        self.connection = http.client.HTTPConnection("127.0.0.1", port)
+        self.cookie = None
+
+    def request(self, method, path, payload=None):
+        headers = {}
+        body = None
+        if payload is not None:
+            body = json.dumps(payload)
+            headers["Content-Type"] = "application/json"
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        response.read()
+        cookie = response.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        return response.status
+
+    def sign_in(self, user_number):
+        status = self.request(
+            "POST", "/auth/signin",
+            {"email": f"user{user_number}@example.com", "password": PASSWORD},
+        )
+        if status != 200:
+            raise RuntimeError(f"Sign-in failed with {status}")
+
+
+def scenarios(args, run_id):
+    """name -> (needs_sign_in, request factory taking (client_index, n))."""
+    return {
+        "signup": (False, lambda c, n: (
+            "POST", "/auth/signup",
+            {"username": f"new{run_id}_{c}_{n}", "email": f"new{run_id}_{c}_{n}@x.com",
+             "password": PASSWORD},
+        )),
+        "signin": (False, lambda c, n: (
+            "POST", "/auth/signin",
+            {"email": f"user{(c + n) % args.users}@example.com", "password": PASSWORD},
+        )),
+        "list_users": (False, lambda c, n: ("GET", "/auth/users?limit=100", None)),
+        "username_available": (False, lambda c, n: (
+            "GET", f"/auth/username-available?username=user{n}x", None,
+        )),
+        "list_expenses": (True, lambda c, n: ("GET", "/expenses?limit=50", None)),
+        "create_expense": (True, lambda c, n: (
+            "POST", "/expenses",
+            {"amount": "12.34", "description": "Bench", "category": "Groceries"},
+        )),
+        "dashboard_summary": (True, lambda c, n: ("GET", "/dashboard/summary", None)),
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(port, args, needs_sign_in, factory):
+    clients = [Client(port) for _ in range(args.clients)]
+    if needs_sign_in:
+        for number, client in enumerate(clients):
+            client.sign_in(number % args.users)
+
+    per_client = args.requests // args.clients
+    latencies = [[] for _ in clients]
+    errors = [0] * len(clients)
+    barrier = threading.Barrier(len(clients) + 1)
+
+    def drive(index):
+        client = clients[index]
+        barrier.wait()
+        for n in range(per_client):
+            method, path, payload = factory(index, n)
+            start = time.perf_counter()
+            status = client.request(method, path, payload)
+            latencies[index].append(time.perf_counter() - start)
+            if status >= 400:
+                errors[index] += 1
+
+    threads = [threading.Thread(target=drive, args=(i,)) for i in range(len(clients))]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.connection.close()
+
+    samples = sorted(value for values in latencies for value in values)
+    return {
+        "requests": len(samples),
+        "errors": sum(errors),
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return human-readable regressions of results against baseline."""
+    regressions = []
+    for name, base in baseline["results"].items():
+        current = results["results"].get(name)
+        if current is None:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {current['p95_ms']:.2f}ms vs {base['p95_ms']:.2f}ms"
+            )
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {current['throughput_rps']:.1f}/s vs "
+                f"{base['throughput_rps']:.1f}/s"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--expenses-per-user", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=400,
+                        help="Requests per scenario, split across clients.")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4,
+                        help="Fixed bcrypt cost (0 calibrates like production).")
+    parser.add_argument("--only", action="append", default=None,
+                        help="Run just this scenario (repeatable).")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Write the results to --baseline instead of comparing.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="expense-bench-")
+    try:
+        app = build_app(workdir, args.bcrypt_rounds or None)
+        seed(app, args.users, args.expenses_per_user, args.seed)
+
+        server = make_server("127.0.0.1", 0, app, threaded=True,
+                             request_handler=KeepAliveHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        results = {
+            "meta": {
+                "users": args.users,
+                "expenses_per_user": args.expenses_per_user,
+                "clients": args.clients,
+                "requests": args.requests,
+                "seed": args.seed,
+                "bcrypt_rounds": hasher.rounds,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+            },
+            "results": {},
+        }
+        run_id = int(time.time())
+        for name, (needs_sign_in, factory) in scenarios(args, run_id).items():
+            if args.only and name not in args.only:
+                continue
+            result = run_scenario(server.server_port, args, needs_sign_in, factory)
+            results["results"][name] = result
+            print(
+                f"{name:20} {result['throughput_rps']:8.1f} req/s  "
+                f"p50 {result['p50_ms']:7.2f}ms  p95 {result['p95_ms']:7.2f}ms  "
+                f"p99 {result['p99_ms']:7.2f}ms  errors {result['errors']}"
+            )
+        server.shutdown()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as output:
+            json.dump(results, output, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Signin throughput through the bcrypt pool.
+
+    python -m benchmarks.hashing [--logins 200] [--clients 8] [--rounds N]
+
+Without --rounds the cost is calibrated from BCRYPT_TARGET_MS exactly as
+create_app does at startup.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from app import create_app, db, hasher
+from app.models import User
+from config import TestConfig
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+
+    class BenchConfig(TestConfig):
+        TESTING = False
+        RATELIMIT_ENABLED = False  # One client IP sends everything
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(workdir, "bench.db")
+        BCRYPT_LOG_ROUNDS = args.rounds
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(
+            User(
+                username="bench",
+                email="bench@example.com",
+                password=hasher.generate_password_hash("password123"),
+            )
+        )
+        db.session.commit()
+
+    remaining = iter(range(args.logins))
+    lock = threading.Lock()
+    failures = []
+
+    def client():
+        http = app.test_client()
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            response = http.post(
+                "/auth/signin",
+                json={"email": "bench@example.com", "password": "password123"},
+            )
+            if response.status_code != 200:
+                failures.append(response.status_code)
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    cores = os.cpu_count() or 1
+    rate = args.logins / elapsed
+    print(f"bcrypt cost:        {hasher.rounds}")
+    print(f"logins:             {args.logins} ({len(failures)} failed)")
+    print(f"logins/s:           {rate:.1f}")
+    print(f"logins/s per core:  {rate / cores:.1f} ({cores} cores)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Job queue benchmark: enqueue latency and worker pool throughput.
+
+    python -m benchmarks.jobs [--jobs 2000] [--concurrency 4]
+
+Against a file SQLite database. Enqueue latency is the cost a request
+handler pays, the INSERT inside its own transaction, excluding the commit
+it would do anyway. Throughput is no-op jobs drained by `flask jobs work`
+threads, including the claim, delete and commits for each job.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from app import create_app, db
+from app.jobs import enqueue, job, run_workers
+from config import TestConfig
+
+
+@job("benchmark_noop")
+def noop(value):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        class BenchConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+        app = create_app(BenchConfig)
+        with app.app_context():
+            db.create_all()
+            timings = []
+            for value in range(args.jobs):
+                start = time.perf_counter()
+                enqueue("benchmark_noop", value=value)
+                timings.append(time.perf_counter() - start)
+                db.session.commit()
+            db.session.remove()
+
+            start = time.perf_counter()
+            processed = run_workers(app, args.concurrency, burst=True)
+            elapsed = time.perf_counter() - start
+            db.engine.dispose()
+
+    timings.sort()
+    print(f"enqueue p50:  {statistics.median(timings) * 1e6:8.0f} us")
+    print(f"enqueue p99:  {timings[int(len(timings) * 0.99)] * 1e6:8.0f} us")
+    print(f"drained {processed} job(s) with {args.concurrency} worker(s): "
+          f"{processed / elapsed:8.0f} jobs/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Per-request cost of the metrics middleware on a trivial route.
+
+    python -m benchmarks.metrics_overhead [--requests 20000]
+"""
+import argparse
+import time
+from werkzeug.test import EnvironBuilder
+from app import create_app
+from config import TestConfig
+
+
+def make_app(enabled):
+    class BenchConfig(TestConfig):
+        METRICS_ENABLED = enabled
+
+    app = create_app(BenchConfig)
+    app.add_url_rule("/hello", "hello", lambda: "hello")
+    requests_per_second(app, 500)  # Warm up
+    return app
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def requests_per_second(app, count):
+    # Call the WSGI app directly, as a server would, so test-client overhead
+    # doesn't dilute the comparison
+    environ = EnvironBuilder("/hello").get_environ()
+    start = time.perf_counter()
+    for _ in range(count):
+        for _chunk in app(dict(environ), start_response):
+            pass
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    # Interleaved runs, best of each side, to damp scheduler and CPU
+    # frequency noise
+    disabled_app, enabled_app = make_app(False), make_app(True)
+    baseline = enabled = 0
+    for _ in range(args.repeat):
+        baseline = max(baseline, requests_per_second(disabled_app, args.requests))
+        enabled = max(enabled, requests_per_second(enabled_app, args.requests))
+    overhead = (baseline - enabled) / baseline * 100
+    print(f"metrics disabled: {baseline:.0f} req/s")
+    print(f"metrics enabled:  {enabled:.0f} req/s")
+    print(f"overhead:         {overhead:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
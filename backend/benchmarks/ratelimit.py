@@ -0,0 +1,63 @@
+"""Rate limiter overhead: cost of one limiter.hit() per auth request.
+
+    python -m benchmarks.ratelimit [--calls 100000] [--threads 4] [--keys 10000]
+
+Times hit() with an IP and an email key, as the auth blueprint does, against
+the in-memory buckets and the shared SQLite file, from one thread and from
+--threads threads at once.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from app.ratelimit import MemoryBuckets, RateLimiter, SQLiteBuckets, parse_limit
+
+
+def limiter_with(buckets):
+    limiter = RateLimiter()
+    limiter.buckets = buckets
+    # Generous limits: the benchmark measures bookkeeping, not rejections
+    limiter.limits = {"auth_ip": parse_limit("1000000/1"),
+                      "auth_email": parse_limit("1000000/1")}
+    return limiter
+
+
+def run(limiter, calls, threads, keys):
+    def worker(offset):
+        for n in range(calls // threads):
+            key = (n + offset) % keys
+            limiter.hit(("auth_ip", f"10.0.{key // 256}.{key % 256}"),
+                        ("auth_email", f"user{key}@example.com"))
+
+    workers = [threading.Thread(target=worker, args=(n * 7919,)) for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - start) / (calls // threads * threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--keys", type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        backends = {
+            "memory": MemoryBuckets(),
+            "sqlite": SQLiteBuckets(os.path.join(workdir, "buckets.db")),
+        }
+        for name, buckets in backends.items():
+            limiter = limiter_with(buckets)
+            calls = args.calls if name == "memory" else args.calls // 10
+            for threads in (1, args.threads):
+                per_call = run(limiter, calls, threads, args.keys)
+                print(f"{name:7} {threads} thread(s): {per_call * 1e6:8.2f} us per hit")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Serializer benchmark: ORM objects vs schema-driven Core rows.
+
+    python -m benchmarks.serializers [--rows 10000] [--repeat 5]
+
+Builds the JSON body of a 10k-expense list both ways, against an in-memory
+SQLite database, and reports the best time of --repeat runs for each. The
+"orm" path is the pattern the endpoints used before app.serializers: query
+ORM objects, build a dict per object, then encode the list.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import Expense, User
+from app.serializers import EXPENSE
+from config import TestConfig
+
+
+def seed(rows):
+    user = User(username="bench", email="bench@example.com", password="x")
+    db.session.add(user)
+    db.session.commit()
+    start = datetime(2024, 1, 1)
+    db.session.execute(
+        db.insert(Expense),
+        [
+            {"user_id": user.id, "amount": n % 500 + 0.25,
+             "description": f"Expense {n}", "category": "Groceries",
+             "spent_at": start + timedelta(minutes=n)}
+            for n in range(rows)
+        ],
+    )
+    db.session.commit()
+    return user.id
+
+
+def orm_body(user_id):
+    expenses = (
+        Expense.query.filter(Expense.user_id == user_id)
+        .order_by(Expense.spent_at.desc(), Expense.id.desc())
+        .all()
+    )
+    return json.dumps([
+        {
+            "id": expense.id,
+            "amount": float(expense.amount),
+            "currency": expense.currency,
+            "description": expense.description,
+            "category": expense.category,
+            "spent_at": expense.spent_at.isoformat(),
+        }
+        for expense in expenses
+    ])
+
+
+def schema_body(user_id):
+    rows = db.session.execute(
+        EXPENSE.select()
+        .where(Expense.user_id == user_id)
+        .order_by(Expense.spent_at.desc(), Expense.id.desc())
+    ).all()
+    return EXPENSE.dumps(rows)
+
+
+def best_of(repeat, func, user_id):
+    timings = []
+    for _ in range(repeat):
+        # A fresh session each time, as each request gets
+        db.session.remove()
+        start = time.perf_counter()
+        func(user_id)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        user_id = seed(args.rows)
+        assert json.loads(orm_body(user_id)) == json.loads(schema_body(user_id))
+
+        orm = best_of(args.repeat, orm_body, user_id)
+        schema = best_of(args.repeat, schema_body, user_id)
+
+    print(f"{args.rows} rows")
+    print(f"orm objects:  {orm * 1000:8.1f} ms")
+    print(f"schema rows:  {schema * 1000:8.1f} ms")
+    print(f"speedup:      {orm / schema:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
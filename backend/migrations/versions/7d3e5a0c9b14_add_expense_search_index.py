@@ -0,0 +1,56 @@
+"""Add expense search index
+
+Revision ID: 7d3e5a0c9b14
+Revises: e2b7a9c41f06
+Create Date: 2024-10-20 14:41:26.730915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3e5a0c9b14'
+down_revision = 'e2b7a9c41f06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Mirrors EXPENSE_SEARCH_DDL in app/models.py
+    if op.get_bind().dialect.name == 'postgresql':
+        # pg_trgm ships with PostgreSQL but creating it needs a superuser or
+        # the database owner
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE INDEX ix_expense_description_tsv ON expense "
+                   "USING gin (to_tsvector('simple', description))")
+        op.execute("CREATE INDEX ix_expense_description_trgm ON expense "
+                   "USING gin (description gin_trgm_ops)")
+    else:
+        op.execute("CREATE VIRTUAL TABLE expense_fts USING fts5(description, "
+                   "content='expense', content_rowid='id', "
+                   "tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+        op.execute("CREATE TRIGGER expense_fts_ai AFTER INSERT ON expense BEGIN "
+                   "INSERT INTO expense_fts(rowid, description) "
+                   "VALUES (new.id, new.description); END")
+        op.execute("CREATE TRIGGER expense_fts_ad AFTER DELETE ON expense BEGIN "
+                   "INSERT INTO expense_fts(expense_fts, rowid, description) "
+                   "VALUES ('delete', old.id, old.description); END")
+        op.execute("CREATE TRIGGER expense_fts_au AFTER UPDATE OF description ON expense BEGIN "
+                   "INSERT INTO expense_fts(expense_fts, rowid, description) "
+                   "VALUES ('delete', old.id, old.description); "
+                   "INSERT INTO expense_fts(rowid, description) "
+                   "VALUES (new.id, new.description); END")
+        # Index the rows that already exist
+        op.execute("INSERT INTO expense_fts(expense_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_expense_description_trgm', table_name='expense')
+        op.drop_index('ix_expense_description_tsv', table_name='expense')
+    else:
+        op.execute("DROP TRIGGER expense_fts_au")
+        op.execute("DROP TRIGGER expense_fts_ad")
+        op.execute("DROP TRIGGER expense_fts_ai")
+        op.execute("DROP TABLE expense_fts")
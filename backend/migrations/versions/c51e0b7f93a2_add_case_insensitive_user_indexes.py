@@ -0,0 +1,30 @@
+"""Add case-insensitive user indexes
+
+Revision ID: c51e0b7f93a2
+Revises: a8d41e6c2b90
+Create Date: 2024-10-16 18:02:39.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c51e0b7f93a2'
+down_revision = 'a8d41e6c2b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Expression indexes work on PostgreSQL and SQLite >= 3.9. Creating them
+    # fails if two existing accounts differ only by case; resolve those first
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_email_lower', [sa.text('lower(email)')], unique=True)
+        batch_op.create_index('ix_user_username_lower', [sa.text('lower(username)')], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_username_lower')
+        batch_op.drop_index('ix_user_email_lower')
@@ -0,0 +1,19 @@
+"""Run the recurring expense scheduler on its own, next to the web workers.
+
+    python scheduler.py
+
+Web workers then leave RECURRING_SCHEDULER_IN_PROCESS unset, so exactly one
+process fires recurring expenses. Running two is still safe, just wasteful.
+"""
+import logging
+from app import create_app
+from app.recurring import RecurringScheduler
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    app = create_app()
+    scheduler = RecurringScheduler.from_config(app)
+    try:
+        scheduler.run()  # In the foreground
+    except KeyboardInterrupt:
+        scheduler.stop()
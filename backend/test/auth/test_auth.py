@@ -1,8 +1,11 @@
 import unittest
+from unittest import mock
 from app import create_app, db, bcrypt
 from app.models import User
 from config import TestConfig
 from flask_bcrypt import Bcrypt
+from sqlalchemy import event
+from app.bloom import BloomFilter
 
 
 class SignUpTestCase(unittest.TestCase):
@@ -61,6 +64,28 @@ class SignUpTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn(b"Username or email already exists", response.data)
 
+    # Test case: Sign-up fails when the email only differs by case
+    def test_signup_existing_email_different_case(self):
+        self.client.post(
+            "/auth/signup",
+            json={
+                "username": "existinguser",
+                "email": "existinguser@example.com",
+                "password": "password123",
+            },
+        )
+
+        response = self.client.post(
+            "/auth/signup",
+            json={
+                "username": "newuser",
+                "email": "ExistingUser@Example.com",
+                "password": "password123",
+            },
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"Username or email already exists", response.data)
+
     # Test case: Sign-up fails with an existing username
     def test_signup_existing_username(self):
         # Create a user first
@@ -215,6 +240,14 @@ class SignInTestCase(unittest.TestCase):
         db.drop_all()
         self.app_context.pop()
 
+    # Test case: Sign-in ignores the case of the email
+    def test_signin_email_case_insensitive(self):
+        response = self.client.post(
+            "/auth/signin",
+            json={"email": "TestUser@Example.com", "password": "password123"},
+        )
+        self.assertEqual(response.status_code, 200)
+
     # Test case: Sign-in with incorrect password
     def test_signin_incorrect_password(self):
         response = self.client.post(
@@ -334,6 +367,130 @@ class GetUsersListTest(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json, [])  # Should return an empty list
 
+    # Test case: The full list is streamed and never exposes password hashes
+    def test_users_list_streamed(self):
+        response = self.client.get("/auth/users")
+        self.assertTrue(response.is_streamed)
+        self.assertNotIn(b"password", response.data)
+
+    # Test case: ?fields= projects only the requested columns
+    def test_users_list_fields(self):
+        response = self.client.get("/auth/users?fields=id,username")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json,
+            [
+                {"id": self.test_user1.id, "username": "testuser1"},
+                {"id": self.test_user2.id, "username": "testuser2"},
+            ],
+        )
+
+    def test_users_list_unknown_field(self):
+        response = self.client.get("/auth/users?fields=username,password")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"Unknown field: password", response.data)
+
+    # Test case: ?limit= pages through users with an id cursor
+    def test_users_list_pagination(self):
+        response = self.client.get("/auth/users?limit=1")
+        self.assertEqual([u["username"] for u in response.json], ["testuser1"])
+        cursor = response.headers["X-Next-Cursor"]
+
+        response = self.client.get(f"/auth/users?limit=1&after={cursor}")
+        self.assertEqual([u["username"] for u in response.json], ["testuser2"])
+        self.assertNotIn("X-Next-Cursor", response.headers)
+
+
+class UsernameAvailableTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        db.session.add(
+            User(username="TakenName", email="taken@example.com", password="x")
+        )
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count_queries(self):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, "before_cursor_execute", listener)
+        self.addCleanup(event.remove, db.engine, "before_cursor_execute", listener)
+        return statements
+
+    def test_username_taken_ignores_case(self):
+        response = self.client.get("/auth/username-available?username=takenname")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["available"], False)
+
+    def test_username_available_without_db_query(self):
+        self.client.get("/auth/username-available?username=warmup")
+        statements = self.count_queries()
+
+        response = self.client.get("/auth/username-available?username=freshname")
+        self.assertEqual(response.json["available"], True)
+        self.assertEqual(statements, [])
+
+    def test_new_signup_is_reported_taken(self):
+        self.client.get("/auth/username-available?username=warmup")
+        self.client.post(
+            "/auth/signup",
+            json={
+                "username": "brandnew",
+                "email": "brandnew@example.com",
+                "password": "password123",
+            },
+        )
+        response = self.client.get("/auth/username-available?username=BrandNew")
+        self.assertEqual(response.json["available"], False)
+
+    def test_non_ascii_username_is_reported_taken(self):
+        # Stored before the filter warms, so only warm() can know about it
+        db.session.add(User(username="ÉLAN", email="elan@example.com", password="x"))
+        db.session.commit()
+
+        response = self.client.get("/auth/username-available?username=ÉLAN")
+        self.assertEqual(response.json["available"], False)
+        self.assertTrue(self.app.extensions["username_filter"].might_exist("élan"))
+
+    def test_signup_race_is_rejected(self):
+        # The existence check passed, then another signup took the name
+        db.session.add(User(username="racer", email="racer@example.com", password="x"))
+        db.session.commit()
+        with mock.patch.object(db.session, "scalar", return_value=False):
+            response = self.client.post(
+                "/auth/signup",
+                json={
+                    "username": "Racer",
+                    "email": "other@example.com",
+                    "password": "password123",
+                },
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json["error"], "Username or email already exists")
+        self.assertEqual(User.query.filter_by(email="other@example.com").count(), 0)
+
+    def test_username_required(self):
+        response = self.client.get("/auth/username-available")
+        self.assertEqual(response.status_code, 400)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        names = [f"user{n}" for n in range(1000)]
+        for name in names:
+            bloom.add(name)
+        self.assertTrue(all(name in bloom for name in names))
+        false_positives = sum(f"other{n}" in bloom for n in range(10000))
+        self.assertLess(false_positives, 300)
+
 
 class ChangePasswordUserTest(unittest.TestCase):
     def setUp(self):
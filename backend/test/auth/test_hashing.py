@@ -0,0 +1,90 @@
+import threading
+import unittest
+from unittest import mock
+from app import create_app, db, hasher
+from app.hashing import HasherBusy, calibrate, hash_cost
+from app.models import User
+from config import TestConfig
+
+
+class PasswordHasherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_hash_and_check(self):
+        pw_hash = hasher.generate_password_hash("password123")
+        self.assertEqual(hash_cost(pw_hash), 4)
+        self.assertTrue(hasher.check_password_hash(pw_hash, "password123"))
+        self.assertFalse(hasher.check_password_hash(pw_hash, "wrongpassword"))
+
+    def test_check_rejects_non_bcrypt_hash(self):
+        self.assertFalse(hasher.check_password_hash("password123", "password123"))
+
+    def test_calibrate_respects_bounds(self):
+        self.assertEqual(calibrate(1, 10, 15), 10)
+        self.assertEqual(calibrate(10 ** 9, 10, 15), 15)
+
+    def test_signin_upgrades_outdated_hash(self):
+        user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=hasher.generate_password_hash("password123"),
+        )
+        db.session.add(user)
+        db.session.commit()
+
+        hasher.rounds = 5
+        response = self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(hash_cost(db.session.get(User, user.id).password), 5)
+        self.assertTrue(
+            hasher.check_password_hash(user.password, "password123"))
+
+    def test_full_queue_sheds_load(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_hash(*args):
+            started.set()
+            release.wait(5)
+            return b"$2b$04$" + b"x" * 53
+
+        hasher.max_pending = 1
+        with mock.patch("app.hashing.bcrypt_lib.hashpw", slow_hash):
+            worker = threading.Thread(
+                target=hasher.generate_password_hash, args=("password123",)
+            )
+            worker.start()
+            started.wait(5)
+            with self.assertRaises(HasherBusy):
+                hasher.generate_password_hash("password123")
+
+            response = self.client.post(
+                "/auth/signup",
+                json={
+                    "username": "newuser",
+                    "email": "newuser@example.com",
+                    "password": "password123",
+                },
+            )
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers["Retry-After"], "1")
+
+            release.set()
+            worker.join(5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from app import create_app, db, bcrypt, hasher
+from app.models import User
+from app.ratelimit import MemoryBuckets, SQLiteBuckets, parse_limit
+from config import TestConfig
+
+
+class BucketsTestCase(unittest.TestCase):
+    def check_buckets(self, first, second=None):
+        second = second or first
+        rate, burst = parse_limit("3/30")  # A token every 10 seconds
+        self.assertEqual([first.take("k", rate, burst, now=100) for _ in range(3)],
+                         [0, 0, 0])
+        self.assertAlmostEqual(second.take("k", rate, burst, now=100), 10)
+        self.assertAlmostEqual(second.take("k", rate, burst, now=104), 6)
+        self.assertEqual(first.take("k", rate, burst, now=110), 0)
+        self.assertGreater(first.take("k", rate, burst, now=110), 0)
+        # Refills never exceed the burst
+        self.assertEqual([second.take("k", rate, burst, now=1000) for _ in range(3)],
+                         [0, 0, 0])
+        self.assertGreater(second.take("k", rate, burst, now=1000), 0)
+        self.assertEqual(first.take("other", rate, burst, now=110), 0)
+
+    def test_memory(self):
+        self.check_buckets(MemoryBuckets(stripes=4))
+
+    def test_sqlite_shared_between_instances(self):
+        handle, path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        # Two instances stand in for two processes using the same file
+        self.check_buckets(SQLiteBuckets(path), SQLiteBuckets(path))
+
+    def test_memory_is_bounded(self):
+        buckets = MemoryBuckets(stripes=2, max_keys=10)
+        for n in range(100):
+            buckets.take(f"ip:{n}", 1.0, 5, now=n)
+        self.assertLessEqual(sum(len(shard) for shard in buckets._shards), 12)
+
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit("20/60"), (20 / 60, 20))
+        for value in ("0/60", "5/0", "five/60", "5"):
+            with self.assertRaises(ValueError):
+                parse_limit(value)
+
+
+class AuthRateLimitTestCase(unittest.TestCase):
+    def setUp(self):
+        class LimitedConfig(TestConfig):
+            RATELIMIT_LIMITS = {"auth_ip": "5/60", "auth_email": "3/60"}
+
+        self.app = create_app(LimitedConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+        db.session.add(User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        ))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def signin(self, email, ip="10.0.0.1"):
+        return self.client.post(
+            "/auth/signin", json={"email": email, "password": "wrong"},
+            environ_base={"REMOTE_ADDR": ip},
+        )
+
+    def test_ip_limit(self):
+        for n in range(5):
+            self.assertEqual(self.signin(f"user{n}@example.com").status_code, 401)
+
+        with mock.patch.object(db.session, "execute") as execute, \
+                mock.patch.object(hasher, "check_password_hash") as check:
+            response = self.signin("someone@example.com")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "12")
+        # Rejected before any query or hash
+        execute.assert_not_called()
+        check.assert_not_called()
+
+        self.assertEqual(self.signin("someone@example.com", ip="10.0.0.2").status_code,
+                         401)
+
+    def test_email_limit_spans_ips_and_case(self):
+        for n, email in enumerate(("testuser@example.com", "TestUser@example.com",
+                                   " testuser@EXAMPLE.com")):
+            self.assertEqual(self.signin(email, ip=f"10.0.1.{n}").status_code, 401)
+        response = self.signin("testuser@example.com", ip="10.0.2.1")
+        self.assertEqual(response.status_code, 429)
+
+    def test_signup_and_reset_are_limited_but_reads_are_not(self):
+        for _ in range(5):
+            self.client.post("/auth/password-reset/request",
+                             json={"email": "x@example.com"},
+                             environ_base={"REMOTE_ADDR": "10.0.0.3"})
+        response = self.client.post(
+            "/auth/signup",
+            json={"username": "new", "email": "new@example.com", "password": "pw123456"},
+            environ_base={"REMOTE_ADDR": "10.0.0.3"},
+        )
+        self.assertEqual(response.status_code, 429)
+        response = self.client.get("/auth/username-available?username=new",
+                                   environ_base={"REMOTE_ADDR": "10.0.0.3"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_disabled(self):
+        class UnlimitedConfig(TestConfig):
+            RATELIMIT_ENABLED = False
+
+        app = create_app(UnlimitedConfig)
+        client = app.test_client()
+        with app.app_context():
+            db.create_all()
+            for _ in range(40):
+                response = client.post("/auth/signin", json={"email": "a@b.c",
+                                                            "password": "x"})
+                self.assertEqual(response.status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+from datetime import timedelta
+from app import create_app, db, hasher
+from app.models import ResetToken, User
+from app.reset_tokens import (
+    hash_token, issue_reset_token, start_sweeper, sweep_reset_tokens,
+)
+from app.util import utcnow
+from config import TestConfig
+
+
+class ResetTokenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=hasher.generate_password_hash("password123"),
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def reset(self, token, password="newpassword123"):
+        return self.client.post(
+            "/auth/password-reset", json={"token": token, "password": password}
+        )
+
+    def test_only_hash_is_stored(self):
+        token = issue_reset_token(self.user.id)
+        db.session.commit()
+
+        stored = db.session.scalar(db.select(ResetToken.token_hash))
+        self.assertEqual(stored, hash_token(token))
+        self.assertNotIn(token, stored)
+
+    def test_reset_changes_password_once(self):
+        token = issue_reset_token(self.user.id)
+        db.session.commit()
+
+        response = self.reset(token)
+        self.assertEqual(response.status_code, 200)
+        db.session.refresh(self.user)
+        self.assertTrue(hasher.check_password_hash(self.user.password, "newpassword123"))
+
+        response = self.reset(token, "anotherpassword")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json["error"], "Invalid or expired token")
+
+    def test_expired_and_unknown_tokens_are_rejected(self):
+        token = issue_reset_token(self.user.id, ttl_seconds=-1)
+        db.session.commit()
+
+        self.assertEqual(self.reset(token).status_code, 400)
+        self.assertEqual(self.reset("not-a-token").status_code, 400)
+        self.assertEqual(self.reset("").status_code, 400)
+
+    def test_new_token_revokes_previous(self):
+        first = issue_reset_token(self.user.id)
+        second = issue_reset_token(self.user.id)
+        db.session.commit()
+
+        self.assertEqual(self.reset(first).status_code, 400)
+        self.assertEqual(self.reset(second).status_code, 200)
+
+    def test_sweep_deletes_expired_and_used_in_batches(self):
+        now = utcnow()
+        for n in range(5):
+            db.session.add(ResetToken(user_id=self.user.id, token_hash=f"expired{n}",
+                                      expires_at=now - timedelta(minutes=1)))
+        db.session.add(ResetToken(user_id=self.user.id, token_hash="used",
+                                  expires_at=now + timedelta(hours=1), used_at=now))
+        db.session.add(ResetToken(user_id=self.user.id, token_hash="live",
+                                  expires_at=now + timedelta(hours=1)))
+        db.session.commit()
+
+        self.assertEqual(sweep_reset_tokens(batch_size=2), 6)
+        self.assertEqual(db.session.scalars(db.select(ResetToken.token_hash)).all(),
+                         ["live"])
+
+    def test_sweep_command(self):
+        db.session.add(ResetToken(user_id=self.user.id, token_hash="expired",
+                                  expires_at=utcnow() - timedelta(minutes=1)))
+        db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(args=["reset-tokens", "sweep"])
+        self.assertIn("Deleted 1 reset token(s)", result.output)
+
+    def test_sweeper_thread_disabled_when_testing(self):
+        self.assertIsNone(start_sweeper(self.app))
+        self.assertIsNone(self.app.extensions["reset_token_sweeper"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import time
+import unittest
+from unittest import mock
+from flask import g
+from itsdangerous import TimestampSigner
+from sqlalchemy import event
+from app import create_app, db, bcrypt
+from app.models import User
+from app.tokens import tokens
+from config import TestConfig
+
+
+class TokenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client(use_cookies=False)
+        # Requests share the test's app context, where Flask-Login caches the
+        # user it loaded; each request must authenticate for itself
+        @self.app.before_request
+        def forget_user():
+            g.pop("_login_user", None)
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+        self.user_id = self.test_user.id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def issue(self, password="password123"):
+        return self.client.post(
+            "/auth/token",
+            json={"email": "testuser@example.com", "password": password},
+        )
+
+    def get(self, path, token):
+        return self.client.get(path, headers={"Authorization": f"Bearer {token}"})
+
+    def user_queries(self, func):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            response = func()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        # Statements authentication would make: the credential version check
+        # or a load of the whole row
+        return response, [s for s in statements
+                          if "credential_version" in s or "user.password" in s]
+
+    def test_issue_and_authenticate(self):
+        response = self.issue()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["token_type"], "Bearer")
+        self.assertEqual(response.json["expires_in"], 900)
+        self.assertNotIn("Set-Cookie", response.headers)
+
+        self.assertEqual(self.issue("wrong").status_code, 401)
+        self.assertEqual(self.client.get("/expenses").status_code, 401)
+        self.assertEqual(self.get("/expenses", "garbage").status_code, 401)
+
+    def test_authentication_needs_no_user_query(self):
+        access = self.issue().json["access_token"]
+        response, queries = self.user_queries(lambda: self.get("/expenses", access))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+        # Attributes beyond the id load the row on demand
+        response = self.client.put(
+            "/auth/home-currency", json={"currency": "eur"},
+            headers={"Authorization": f"Bearer {access}"},
+        )
+        self.assertEqual(response.json, {"home_currency": "EUR"})
+        self.assertEqual(db.session.get(User, self.user_id).home_currency, "EUR")
+
+    def test_cold_cache_checks_the_credential_version_once(self):
+        access = self.issue().json["access_token"]
+        tokens.credentials.clear()
+        _, queries = self.user_queries(lambda: self.get("/expenses", access))
+        self.assertEqual(len(queries), 1)
+        _, queries = self.user_queries(lambda: self.get("/expenses", access))
+        self.assertEqual(queries, [])
+
+    def test_expired_access_token(self):
+        issued = int(time.time()) - 901
+        with mock.patch.object(TimestampSigner, "get_timestamp", return_value=issued):
+            access = self.issue().json["access_token"]
+        self.assertEqual(self.get("/expenses", access).status_code, 401)
+
+    def test_refresh(self):
+        issued = self.issue().json
+        response = self.client.post("/auth/token/refresh",
+                                    json={"refresh_token": issued["refresh_token"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get("/expenses", response.json["access_token"]).status_code,
+                         200)
+
+        # Access and refresh tokens aren't interchangeable
+        response = self.client.post("/auth/token/refresh",
+                                    json={"refresh_token": issued["access_token"]})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.get("/expenses", issued["refresh_token"]).status_code, 401)
+        self.assertEqual(self.client.post("/auth/token/refresh", json={}).status_code, 401)
+
+    def test_password_change_revokes_tokens(self):
+        old = self.issue().json
+        response = self.client.put(
+            "/auth/change-password",
+            json={"current_password": "password123", "new_password": "newpassword1"},
+            headers={"Authorization": f"Bearer {old['access_token']}"},
+        )
+        self.assertEqual(response.status_code, 200)
+        new_access = response.json["access_token"]
+
+        self.assertEqual(self.get("/expenses", old["access_token"]).status_code, 401)
+        response = self.client.post("/auth/token/refresh",
+                                    json={"refresh_token": old["refresh_token"]})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.get("/expenses", new_access).status_code, 200)
+        self.assertEqual(self.issue("newpassword1").status_code, 200)
+
+    def test_revocation_elsewhere_applies_after_cache_expiry(self):
+        access = self.issue().json["access_token"]
+        # Another process bumped the version; this one still trusts its cache
+        db.session.execute(db.update(User).values(credential_version=5))
+        db.session.commit()
+        self.assertEqual(self.get("/expenses", access).status_code, 200)
+
+        with mock.patch("app.tokens.time.monotonic",
+                        return_value=time.monotonic() + 31):
+            self.assertEqual(self.get("/expenses", access).status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,230 @@
+import io
+import unittest
+from unittest import mock
+from sqlalchemy import event
+from app import create_app, db, bcrypt
+from app.events import broker
+from app.fx import load_rates
+from app.models import Budget, BudgetAlert, ExpenseRollup, User
+from config import TestConfig
+
+
+class BudgetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+        publish = mock.patch.object(broker, "publish")
+        self.publish = publish.start()
+        self.addCleanup(publish.stop)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_budget(self, amount="100", category="Groceries", **extra):
+        return self.client.post(
+            "/budgets", json={"amount": amount, "category": category, **extra}
+        )
+
+    def create_expense(self, amount, category="Groceries", **extra):
+        return self.client.post(
+            "/expenses",
+            json={"amount": amount, "description": "Test", "category": category,
+                  **extra},
+        )
+
+    def alerts_published(self):
+        return [
+            (data["category"], data["threshold"], data["spent"])
+            for _, event, data in (call.args for call in self.publish.call_args_list)
+            if event == "budget.alert"
+        ]
+
+    def test_create_and_list(self):
+        response = self.create_budget("250.50")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json["amount"], 250.5)
+        self.assertEqual(response.json["currency"], "USD")
+        self.assertEqual(response.json["spent"], 0.0)
+
+        self.create_expense("20")
+        response = self.client.get("/budgets")
+        self.assertEqual(len(response.json), 1)
+        self.assertEqual(response.json[0]["spent"], 20.0)
+        self.assertEqual(response.json[0]["month"], response.json[0]["start_month"])
+
+    def test_validation(self):
+        self.assertEqual(self.create_budget("0").status_code, 400)
+        self.assertEqual(self.create_budget("10", category="").status_code, 400)
+        self.assertEqual(self.create_budget("10", currency="EURO").status_code, 400)
+        self.create_budget("10")
+        response = self.create_budget("20")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("already exists", response.json["error"])
+
+    def test_thresholds_fire_once_each(self):
+        self.create_budget("100")
+        self.create_expense("50")
+        self.assertEqual(self.alerts_published(), [])
+
+        # 50 -> 85 crosses 80%; 85 -> 95 crosses nothing; 95 -> 130 crosses 100%
+        self.create_expense("35")
+        self.create_expense("10")
+        self.create_expense("35")
+        self.assertEqual(
+            self.alerts_published(),
+            [("Groceries", 80, 85.0), ("Groceries", 100, 130.0)],
+        )
+
+        # Dropping below and climbing back doesn't repeat an alert
+        expense = self.create_expense("10").json
+        self.client.delete(f"/expenses/{expense['id']}")
+        self.client.put(f"/expenses/{expense['id']}", json={"amount": "1"})
+        self.create_expense("1")
+        self.assertEqual(len(self.alerts_published()), 2)
+
+        response = self.client.get("/budgets/alerts")
+        self.assertEqual([alert["threshold"] for alert in response.json], [100, 80])
+
+    def test_one_write_can_cross_both_thresholds(self):
+        self.create_budget("100")
+        self.create_expense("150")
+        self.assertEqual(
+            self.alerts_published(),
+            [("Groceries", 80, 150.0), ("Groceries", 100, 150.0)],
+        )
+
+    def test_update_moving_expense_into_category(self):
+        self.create_budget("100")
+        expense = self.create_expense("90", category="Travel").json
+        self.assertEqual(self.alerts_published(), [])
+        self.client.put(f"/expenses/{expense['id']}", json={"category": "Groceries"})
+        self.assertEqual(self.alerts_published(), [("Groceries", 80, 90.0)])
+
+    def test_months_before_budget_are_ignored(self):
+        self.create_budget("100")
+        self.create_expense("500", spent_at="2020-01-15")
+        self.assertEqual(self.alerts_published(), [])
+
+    def test_other_users_budgets_are_not_visible(self):
+        other = User(username="other", email="other@example.com", password="x")
+        db.session.add(other)
+        db.session.commit()
+        budget = Budget(user_id=other.id, category="Groceries", amount=1,
+                        currency="USD", start_month="2000-01")
+        db.session.add(budget)
+        db.session.commit()
+
+        self.create_expense("50")
+        self.assertEqual(self.alerts_published(), [])
+        self.assertEqual(self.client.get("/budgets").json, [])
+        self.assertEqual(
+            self.client.put(f"/budgets/{budget.id}", json={"amount": "5"}).status_code,
+            404,
+        )
+        self.assertEqual(self.client.delete(f"/budgets/{budget.id}").status_code, 404)
+
+    def test_converts_into_budget_currency(self):
+        load_rates(io.StringIO("date,currency,rate\n2000-01-01,EUR,2.00\n"))
+        self.create_budget("100", currency="EUR")
+        # 100 USD = 50 EUR; another 70 USD brings it to 85 EUR
+        self.create_expense("100")
+        self.create_expense("70")
+        self.assertEqual(self.alerts_published(), [("Groceries", 80, 85.0)])
+
+    def test_missing_rate_never_fails_the_write(self):
+        self.create_budget("100", currency="JPY")
+        response = self.create_expense("100")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.alerts_published(), [])
+        self.assertIsNone(self.client.get("/budgets").json[0]["spent"])
+
+    def test_check_is_one_query_regardless_of_history(self):
+        self.create_budget("100000")
+        for _ in range(20):
+            self.create_expense("1")
+
+        with mock.patch.object(db.session, "execute", wraps=db.session.execute) as execute:
+            self.create_expense("1")
+            many = execute.call_count
+        self.create_budget("100", category="Travel")
+        with mock.patch.object(db.session, "execute", wraps=db.session.execute) as execute:
+            self.create_expense("1", category="Travel")
+            few = execute.call_count
+        self.assertEqual(many, few)
+
+    def test_list_is_one_rollup_query_regardless_of_budgets(self):
+        load_rates(io.StringIO("date,currency,rate\n2000-01-01,EUR,2.00\n"))
+        self.create_budget("100")
+        self.create_expense("10")
+        self.create_budget("100", category="Travel", currency="EUR")
+        self.create_expense("4", category="Travel")
+
+        def list_statements():
+            statements = []
+
+            def record(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                response = self.client.get("/budgets")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+            return response.json, len(statements)
+
+        _, one = list_statements()
+        for category in ("Rent", "Fun"):
+            self.create_budget("100", category=category, currency="EUR")
+            self.create_expense("4", category=category)
+        budgets, many = list_statements()
+        self.assertEqual(many, one)
+        self.assertEqual([budget["spent"] for budget in budgets],
+                         [2.0, 10.0, 2.0, 2.0])
+
+    def test_reconcile_records_missed_alerts(self):
+        self.create_budget("100")
+        self.create_expense("90")
+        self.assertEqual(len(self.alerts_published()), 1)
+
+        # Drift: totals changed behind the write path's back
+        rollup = db.session.scalars(db.select(ExpenseRollup)).one()
+        rollup.total = 120
+        db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(args=["budgets", "reconcile"])
+        self.assertIn("threshold=100% spent=120.0", result.output)
+        self.assertIn("1 missing alert(s) recorded", result.output)
+        result = self.app.test_cli_runner().invoke(args=["budgets", "reconcile"])
+        self.assertIn("0 missing alert(s) recorded", result.output)
+        self.assertEqual(db.session.scalar(db.select(db.func.count(BudgetAlert.id))), 2)
+
+    def test_import_publishes_alerts(self):
+        self.create_budget("100")
+        body = "amount,description,category\n50,A,Groceries\n50,B,Groceries\n"
+        self.client.post("/expenses/import", data=body, content_type="text/csv").get_data()
+        self.assertEqual(
+            self.alerts_published(),
+            [("Groceries", 80, 100.0), ("Groceries", 100, 100.0)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
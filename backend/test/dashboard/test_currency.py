@@ -0,0 +1,185 @@
+import io
+import os
+import tempfile
+import unittest
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+from app import create_app, db, bcrypt
+from app.fx import RateCache, load_rates, rates
+from app.models import FxRate, User
+from app.rollups import reconcile
+from config import TestConfig
+
+RATES = (
+    "date,currency,rate\n"
+    "2024-01-01,EUR,1.10\n"
+    "2024-02-01,EUR,1.20\n"
+    "2024-01-01,GBP,1.25\n"
+)
+
+
+class CurrencyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+        load_rates(io.StringIO(RATES))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_expense(self, amount, currency, spent_at, category="Travel"):
+        payload = {"amount": amount, "description": "Test", "category": category,
+                   "spent_at": spent_at}
+        if currency:
+            payload["currency"] = currency
+        return self.client.post("/expenses", json=payload)
+
+    def summary(self):
+        response = self.client.get("/dashboard/summary")
+        self.assertEqual(response.status_code, 200)
+        return [
+            (row["month"], row["category"], row["currency"], row["total"], row["count"])
+            for row in response.json
+        ]
+
+    def test_currency_defaults_to_home_and_is_validated(self):
+        response = self.create_expense("10", None, "2024-01-05")
+        self.assertEqual(response.json["currency"], "USD")
+        response = self.create_expense("10", "eur", "2024-01-05")
+        self.assertEqual(response.json["currency"], "EUR")
+        response = self.create_expense("10", "EURO", "2024-01-05")
+        self.assertEqual(response.status_code, 400)
+
+    def test_summary_converts_at_month_end_rate(self):
+        self.create_expense("10", "USD", "2024-01-05")
+        self.create_expense("100", "EUR", "2024-01-20")
+        self.create_expense("100", "EUR", "2024-02-03")
+
+        # January uses the rate in force on Jan 31, February the Feb 1 rate
+        self.assertEqual(
+            self.summary(),
+            [("2024-01", "Travel", "USD", 120.0, 2),
+             ("2024-02", "Travel", "USD", 120.0, 1)],
+        )
+        self.assertEqual(reconcile(), [])
+
+    def test_home_currency_change(self):
+        self.create_expense("11", "USD", "2024-01-05")
+        self.create_expense("10", "GBP", "2024-01-05")
+        etag = self.client.get("/dashboard/summary").headers["ETag"]
+
+        response = self.client.put("/auth/home-currency", json={"currency": "eur"})
+        self.assertEqual(response.json, {"home_currency": "EUR"})
+        response = self.client.get("/dashboard/summary",
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        # 11 USD = 10 EUR, 10 GBP = 12.5 USD = 11.36 EUR
+        self.assertEqual(self.summary(), [("2024-01", "Travel", "EUR", 21.36, 2)])
+
+        response = self.client.put("/auth/home-currency", json={"currency": "E"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_rate_is_left_out_and_reported(self):
+        self.create_expense("10", None, "2024-01-05")
+        self.create_expense("10", "JPY", "2024-01-05")
+        self.create_expense("10", "JPY", "2024-01-05", category="Food")
+        response = self.client.get("/dashboard/summary")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-Unconverted-Currencies"], "JPY")
+        self.assertEqual(self.summary(), [("2024-01", "Travel", "USD", 10.0, 1)])
+
+    def test_loading_rates_refreshes_cache_and_etag(self):
+        self.create_expense("100", "EUR", "2024-02-10")
+        response = self.client.get("/dashboard/summary")
+        etag = response.headers["ETag"]
+        self.assertEqual(response.json[0]["total"], 120.0)
+
+        load_rates(io.StringIO("date,currency,rate\n2024-02-15,EUR,1.30\n"))
+        response = self.client.get("/dashboard/summary",
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json[0]["total"], 130.0)
+
+    def test_rates_are_looked_up_in_one_batch_and_cached(self):
+        for month in range(1, 7):
+            self.create_expense("10", "EUR", f"2024-{month:02d}-10")
+            self.create_expense("10", "GBP", f"2024-{month:02d}-10")
+        rates.clear()
+
+        with mock.patch.object(db.session, "execute", wraps=db.session.execute) as execute:
+            self.summary()
+            first = execute.call_count
+            self.summary()
+            second = execute.call_count - first
+        # All twelve rates came from a single query, which the warm cache
+        # then saves entirely
+        self.assertEqual(first, second + 1)
+
+    def test_import_with_currency_column(self):
+        body = "amount,currency,description,category,spent_at\n10,EUR,A,Travel,2024-01-02\n"
+        self.client.post("/expenses/import", data=body, content_type="text/csv").get_data()
+        self.assertEqual(self.summary(), [("2024-01", "Travel", "USD", 11.0, 1)])
+
+    def test_load_command(self):
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(handle, "w") as rates_file:
+            rates_file.write("date,currency,rate\n2024-03-01,CHF,1.15\n2024-03-01,CHF,x\n")
+        try:
+            result = self.app.test_cli_runner().invoke(args=["fx", "load", path])
+        finally:
+            os.remove(path)
+        self.assertIn("Skipped invalid line 3", result.output)
+        self.assertIn("Loaded 1 rate(s)", result.output)
+        rate = db.session.get(FxRate, ("CHF", date(2024, 3, 1)))
+        self.assertEqual(rate.rate, Decimal("1.15"))
+
+
+class RateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_rates(io.StringIO(RATES))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_lru_eviction(self):
+        cache = RateCache(capacity=2)
+        jan, feb = date(2024, 1, 31), date(2024, 2, 29)
+        found = cache.rates([("EUR", jan), ("EUR", feb), ("USD", jan), ("JPY", jan)])
+        self.assertEqual(found[("EUR", jan)], Decimal("1.1"))
+        self.assertEqual(found[("EUR", feb)], Decimal("1.2"))
+        self.assertEqual(found[("USD", jan)], 1)
+        self.assertIsNone(found[("JPY", jan)])
+        self.assertEqual(len(cache._entries), 2)
+
+        cache.rates([("GBP", jan)])
+        self.assertEqual(len(cache._entries), 2)
+        self.assertIn(("GBP", jan), cache._entries)
+
+
+if __name__ == "__main__":
+    unittest.main()
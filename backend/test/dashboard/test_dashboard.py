@@ -0,0 +1,130 @@
+import unittest
+from datetime import datetime
+from app import create_app, db, bcrypt
+from app.models import User, Expense, ExpenseRollup
+from app.rollups import reconcile
+from config import TestConfig
+
+
+class DashboardSummaryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_expense(self, amount, category, spent_at):
+        response = self.client.post(
+            "/expenses",
+            json={
+                "amount": amount,
+                "description": "Test",
+                "category": category,
+                "spent_at": spent_at,
+            },
+        )
+        return response.json["id"]
+
+    def summary(self, query=""):
+        response = self.client.get("/dashboard/summary" + query)
+        self.assertEqual(response.status_code, 200)
+        return [
+            (row["month"], row["category"], row["total"], row["count"])
+            for row in response.json
+        ]
+
+    def test_rollup_follows_inserts_updates_and_deletes(self):
+        self.create_expense("10.00", "Groceries", "2024-01-05")
+        moved = self.create_expense("5.50", "Groceries", "2024-01-20")
+        deleted = self.create_expense("100", "Rent", "2024-02-01")
+
+        self.assertEqual(
+            self.summary(),
+            [
+                ("2024-01", "Groceries", 15.5, 2),
+                ("2024-02", "Rent", 100.0, 1),
+            ],
+        )
+
+        self.client.put(f"/expenses/{moved}", json={"spent_at": "2024-02-03"})
+        self.client.delete(f"/expenses/{deleted}")
+
+        self.assertEqual(
+            self.summary(),
+            [
+                ("2024-01", "Groceries", 10.0, 1),
+                ("2024-02", "Groceries", 5.5, 1),
+            ],
+        )
+        self.assertEqual(reconcile(), [])
+
+    def test_rollup_follows_import(self):
+        body = (
+            "amount,description,category,spent_at\n"
+            "1.25,A,Rent,2024-03-01\n"
+            "2.75,B,Rent,2024-03-02\n"
+        )
+        self.client.post("/expenses/import", data=body, content_type="text/csv")
+        self.assertEqual(self.summary(), [("2024-03", "Rent", 4.0, 2)])
+
+    def test_summary_month_range(self):
+        self.create_expense("1", "Rent", "2024-01-01")
+        self.create_expense("2", "Rent", "2024-02-01")
+        self.create_expense("3", "Rent", "2024-03-01")
+        self.assertEqual(
+            [row[0] for row in self.summary("?from=2024-02&to=2024-02")],
+            ["2024-02"],
+        )
+
+    def test_summary_invalid_month(self):
+        response = self.client.get("/dashboard/summary?from=2024-13")
+        self.assertEqual(response.status_code, 400)
+
+    def test_reconcile_reports_and_repairs_drift(self):
+        self.create_expense("10", "Rent", "2024-01-01")
+        # Write an expense behind the rollup's back
+        db.session.add(
+            Expense(
+                user_id=self.test_user.id,
+                amount=5,
+                description="Untracked",
+                category="Rent",
+                spent_at=datetime(2024, 1, 2),
+            )
+        )
+        db.session.commit()
+
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=["rollups", "verify", "--chunk-size", "1"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("1 drifted rollup row(s)", result.output)
+
+        result = runner.invoke(args=["rollups", "rebuild"])
+        self.assertEqual(result.exit_code, 0)
+        rollup = db.session.get(
+            ExpenseRollup, (self.test_user.id, "2024-01", "Rent", "USD"))
+        self.assertEqual((float(rollup.total), rollup.count), (15.0, 2))
+        self.assertEqual(reconcile(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+import io
+import unittest
+from sqlalchemy import event
+from app import create_app, db, bcrypt
+from app.fx import load_rates
+from app.models import User
+from app.series import lttb, series_cache
+from config import TestConfig
+
+
+class DashboardSeriesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+
+    def tearDown(self):
+        series_cache.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_expense(self, amount, spent_at, category="Groceries", currency=None):
+        payload = {"amount": amount, "description": "Test", "category": category,
+                   "spent_at": spent_at}
+        if currency:
+            payload["currency"] = currency
+        response = self.client.post("/expenses", json=payload)
+        self.assertEqual(response.status_code, 201)
+        return response.json["id"]
+
+    def series(self, query):
+        response = self.client.get("/dashboard/series" + query)
+        self.assertEqual(response.status_code, 200, response.json)
+        return response.json
+
+    def points(self, body):
+        return [(point["t"], point["total"], point["count"], point["cumulative"])
+                for point in body["points"]]
+
+    def test_hourly_buckets_with_running_totals(self):
+        self.create_expense("10", "2024-03-10T09:15:00")
+        self.create_expense("2.50", "2024-03-10T09:45:00")
+        self.create_expense("5", "2024-03-10T13:00:00")
+        self.create_expense("99", "2024-03-09T09:00:00")  # Before the window
+        self.create_expense("7", "2024-03-10T14:00:00", category="Rent")
+
+        body = self.series("?range=day&end=2024-03-10T13:30:00")
+        self.assertEqual(body["bucket"], "hour")
+        self.assertEqual(body["from"], "2024-03-09T14:00:00")
+        self.assertEqual(body["to"], "2024-03-10T14:00:00")
+        self.assertEqual(
+            self.points(body),
+            [
+                ("2024-03-10T09:00:00", 12.5, 2, 12.5),
+                ("2024-03-10T13:00:00", 5.0, 1, 17.5),
+            ],
+        )
+
+        body = self.series("?range=week&bucket=week&end=2024-03-10&category=Rent")
+        # 2024-03-10 is a Sunday: its week starts on Monday the 4th
+        self.assertEqual(self.points(body), [("2024-03-04T00:00:00", 7.0, 1, 7.0)])
+        body = self.series("?range=week&bucket=week&end=2024-03-10")
+        self.assertEqual(self.points(body), [("2024-03-04T00:00:00", 123.5, 5, 123.5)])
+
+    def test_converts_foreign_currencies(self):
+        load_rates(io.StringIO("date,currency,rate\n2024-01-01,EUR,1.20\n"))
+        self.create_expense("10", "2024-03-01T10:00:00", currency="EUR")
+        self.create_expense("5", "2024-03-02T10:00:00")
+        self.create_expense("10", "2024-03-03T10:00:00", currency="EUR")
+
+        body = self.series("?range=month&end=2024-03-05")
+        self.assertEqual(body["currency"], "USD")
+        self.assertEqual(
+            self.points(body),
+            [
+                ("2024-03-01T00:00:00", 12.0, 1, 12.0),
+                ("2024-03-02T00:00:00", 5.0, 1, 17.0),
+                ("2024-03-03T00:00:00", 12.0, 1, 29.0),
+            ],
+        )
+
+        self.assertEqual(body["unconverted"], [])
+
+        self.create_expense("1", "2024-03-04T10:00:00", currency="GBP")
+        body = self.series("?range=month&end=2024-03-05")
+        self.assertEqual(body["unconverted"], ["GBP"])
+        self.assertEqual(len(body["points"]), 3)
+
+    def test_downsamples_to_requested_points(self):
+        for day in range(1, 31):
+            amount = "500" if day == 17 else "10"
+            self.create_expense(amount, f"2024-04-{day:02d}T12:00:00")
+
+        body = self.series("?range=month&end=2024-04-30&points=5")
+        self.assertEqual(body["buckets"], 30)
+        self.assertTrue(body["downsampled"])
+        kept = self.points(body)
+        self.assertEqual(len(kept), 5)
+        self.assertEqual(kept[0][0], "2024-04-01T00:00:00")
+        self.assertEqual(kept[-1], ("2024-04-30T00:00:00", 10.0, 1, 790.0))
+        # The spike survives, with the running total as of that day
+        self.assertIn(("2024-04-17T00:00:00", 500.0, 1, 660.0), kept)
+
+        body = self.series("?range=month&end=2024-04-30&points=100")
+        self.assertFalse(body["downsampled"])
+        self.assertEqual(len(body["points"]), 30)
+
+    def test_lttb_keeps_extremes(self):
+        points = [(x, 0.0) for x in range(100)]
+        points[40] = (40, 50.0)
+        points[70] = (70, -50.0)
+        kept = lttb(points, 10)
+        self.assertEqual(len(kept), 10)
+        self.assertEqual((kept[0], kept[-1]), (0, 99))
+        self.assertIn(40, kept)
+        self.assertIn(70, kept)
+        self.assertEqual(kept, sorted(kept))
+        self.assertEqual(lttb(points[:5], 10), [0, 1, 2, 3, 4])
+
+    def test_repeated_queries_are_cached_until_a_write(self):
+        self.create_expense("10", "2024-05-01T10:00:00")
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            first = self.series("?range=month&end=2024-05-02")
+            self.assertTrue(any("strftime" in s for s in statements))
+            statements.clear()
+            self.assertEqual(self.series("?range=month&end=2024-05-02"), first)
+            self.assertFalse(any("strftime" in s for s in statements))
+
+            self.create_expense("5", "2024-05-02T10:00:00")
+            statements.clear()
+            body = self.series("?range=month&end=2024-05-02")
+            self.assertTrue(any("strftime" in s for s in statements))
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        self.assertEqual(body["points"][-1]["cumulative"], 15.0)
+
+    def test_etag_revalidation(self):
+        self.create_expense("10", "2024-05-01T10:00:00")
+        response = self.client.get("/dashboard/series?range=month&end=2024-05-02")
+        etag = response.headers["ETag"]
+
+        response = self.client.get(
+            "/dashboard/series?range=month&end=2024-05-02",
+            headers={"If-None-Match": etag},
+        )
+        self.assertEqual(response.status_code, 304)
+
+        self.create_expense("5", "2024-05-02T10:00:00")
+        response = self.client.get(
+            "/dashboard/series?range=month&end=2024-05-02",
+            headers={"If-None-Match": etag},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_rejects_invalid_parameters(self):
+        for query in ("?range=decade", "?bucket=second", "?points=2",
+                      "?points=many", "?end=yesterday", "?range=year&bucket=minute"):
+            response = self.client.get("/dashboard/series" + query)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn("error", response.json)
+
+    def test_rejects_out_of_range_end(self):
+        for query in ("?end=9999-12-31", "?end=0001-01-02", "?range=year&end=0001-06-01",
+                      "?bucket=month&end=9999-12-15"):
+            response = self.client.get("/dashboard/series" + query)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(response.json["error"], "End is out of range")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import json
+import unittest
+from app import create_app, db, bcrypt
+from app.events import EventBroker, broker
+from app.models import User
+from config import TestConfig
+
+
+class EventBrokerTestCase(unittest.TestCase):
+    def test_resume_from_last_event_id(self):
+        events = EventBroker()
+        for n in range(3):
+            events.publish(1, "expense.created", {"id": n})
+
+        subscription = events.subscribe(1, f"{events.epoch}-1")
+        records = subscription.wait(0)
+        self.assertEqual([json.loads(r[2])["id"] for r in records], [1, 2])
+
+    def test_resume_past_history_sends_reset(self):
+        events = EventBroker(history_size=2)
+        for n in range(4):
+            events.publish(1, "expense.created", {"id": n})
+
+        subscription = events.subscribe(1, f"{events.epoch}-1")
+        self.assertEqual(subscription.wait(0), [None])
+
+    def test_evicted_users_are_forgotten(self):
+        events = EventBroker(history_size=1, max_users=2)
+        for user_id in range(1, 6):
+            events.publish(user_id, "expense.created", {"id": 1})
+            events.publish(user_id, "expense.created", {"id": 2})
+        # Only users with a history keep a trimmed-seq entry
+        self.assertLessEqual(len(events._dropped), 2)
+
+        # An evicted user resuming from before the eviction resyncs
+        subscription = events.subscribe(1, f"{events.epoch}-2")
+        self.assertEqual(subscription.wait(0), [None])
+        events.publish(1, "expense.created", {"id": 3})
+        subscription = events.subscribe(1, f"{events.epoch}-2")
+        self.assertEqual(subscription.wait(0), [None])
+
+    def test_streams_are_capped(self):
+        events = EventBroker(max_streams=2)
+        first = events.subscribe(1)
+        events.subscribe(2)
+        self.assertIsNone(events.subscribe(1))
+        events.unsubscribe(1, first)
+        events.unsubscribe(1, first)  # Twice, as both close paths may run
+        self.assertIsNotNone(events.subscribe(3))
+        self.assertIsNone(events.subscribe(3))
+
+    def test_unknown_epoch_sends_reset(self):
+        events = EventBroker()
+        subscription = events.subscribe(1, "deadbeef-10")
+        self.assertEqual(subscription.wait(0), [None])
+
+    def test_only_own_events_delivered(self):
+        events = EventBroker()
+        subscription = events.subscribe(1)
+        events.publish(2, "expense.created", {"id": 1})
+        self.assertEqual(subscription.wait(0), [])
+
+    def test_slow_subscriber_overflow_sends_reset(self):
+        events = EventBroker(max_pending=2)
+        subscription = events.subscribe(1)
+        for n in range(3):
+            events.publish(1, "expense.created", {"id": n})
+        self.assertEqual(subscription.wait(0), [None])
+
+
+class EventStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app.config["SSE_HEARTBEAT_SECONDS"] = 0.01
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def open_stream(self, **kwargs):
+        response = self.client.get("/events", buffered=False, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.addCleanup(response.close)
+        chunks = iter(response.response)
+        self.assertTrue(next(chunks).startswith(b"retry:"))
+        return chunks
+
+    def test_stream_beyond_cap_is_refused(self):
+        broker.max_streams = 1
+        first = self.client.get("/events", buffered=False)
+        self.assertEqual(first.status_code, 200)
+
+        response = self.client.get("/events", buffered=False)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+
+        # Closing a stream, even one never read from, frees its slot
+        first.close()
+        self.open_stream()
+
+    def test_heartbeat_when_idle(self):
+        chunks = self.open_stream()
+        self.assertEqual(next(chunks), b": heartbeat\n\n")
+
+    def test_expense_write_pushes_delta(self):
+        chunks = self.open_stream()
+        expense = self.client.post(
+            "/expenses",
+            json={"amount": "4.20", "description": "Tea", "category": "Groceries"},
+        ).json
+        self.client.delete(f"/expenses/{expense['id']}")
+
+        lines = next(chunks).decode().split("\n")
+        self.assertIn("event: expense.created", lines)
+        self.assertIn("event: expense.deleted", lines)
+        data = [json.loads(line[6:]) for line in lines if line.startswith("data: ")]
+        self.assertEqual(data, [expense, {"id": expense["id"]}])
+
+    def test_reconnect_replays_missed_events(self):
+        broker.publish(self.test_user.id, "expense.created", {"id": 1})
+        last_id = f"{broker.epoch}-{broker._seq}"
+        broker.publish(self.test_user.id, "expense.created", {"id": 2})
+
+        chunks = self.open_stream(headers={"Last-Event-ID": last_id})
+        text = next(chunks).decode()
+        self.assertIn('data: {"id": 2}', text)
+        self.assertNotIn('data: {"id": 1}', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
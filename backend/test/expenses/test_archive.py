@@ -0,0 +1,183 @@
+import csv
+import io
+import unittest
+from datetime import timedelta
+from unittest import mock
+from app import create_app, db, bcrypt
+from app import archive
+from app.archive import archive_expenses, decode_rows
+from app.models import Expense, ExpenseArchive, User
+from app.rollups import reconcile
+from app.series import series_cache
+from app.util import utcnow
+from config import TestConfig
+
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+
+        # Two old months and two recent expenses
+        self.old = [
+            self.create_expense("10", "2020-01-05T10:00:00", "Groceries"),
+            self.create_expense("20", "2020-01-20T10:00:00", "Rent"),
+            self.create_expense("30", "2020-02-10T10:00:00", "Groceries"),
+        ]
+        recent = (utcnow() - timedelta(days=1)).replace(microsecond=0)
+        self.recent = [
+            self.create_expense("40", recent.isoformat(), "Groceries"),
+            self.create_expense("50", (recent + timedelta(hours=1)).isoformat(),
+                                "Rent"),
+        ]
+
+    def tearDown(self):
+        series_cache.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_expense(self, amount, spent_at, category):
+        response = self.client.post("/expenses", json={
+            "amount": amount, "description": f"{category} {amount}",
+            "category": category, "spent_at": spent_at,
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.json["id"]
+
+    def all_pages(self, limit):
+        rows, query = [], f"?limit={limit}"
+        while True:
+            response = self.client.get("/expenses" + query)
+            self.assertEqual(response.status_code, 200)
+            rows.extend(response.json)
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                return rows
+            query = f"?limit={limit}&cursor={cursor}"
+
+    def export_rows(self, query=""):
+        response = self.client.get("/expenses/export" + query)
+        self.assertEqual(response.status_code, 200)
+        return list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+
+    def test_moves_old_months_into_compressed_blobs(self):
+        summary = self.client.get("/dashboard/summary").json
+
+        self.assertEqual(archive_expenses(horizon_days=90), (2, 3))
+        self.assertEqual(
+            sorted(db.session.scalars(db.select(Expense.id))), self.recent
+        )
+        archives = {row.month: row for row in ExpenseArchive.query}
+        self.assertEqual(sorted(archives), ["2020-01", "2020-02"])
+        january = archives["2020-01"]
+        self.assertEqual((january.count, january.first_id, january.last_id),
+                         (2, self.old[0], self.old[1]))
+        self.assertEqual(
+            [row[:3] for row in decode_rows(january.data, ("id", "category", "amount"))],
+            [(self.old[0], "Groceries", 10), (self.old[1], "Rent", 20)],
+        )
+
+        # Rollups keep counting the archived expenses, and agree with a rebuild
+        self.assertEqual(self.client.get("/dashboard/summary").json, summary)
+        self.assertEqual(reconcile(), [])
+        self.assertEqual(archive_expenses(horizon_days=90), (0, 0))
+
+    def test_reads_merge_hot_and_archived_expenses(self):
+        before = self.all_pages(limit=2)
+        exported = self.export_rows()
+        filtered = self.export_rows("?from=2020-01-10&to=2020-02-10&category=Rent")
+        series = self.client.get("/dashboard/series?range=year&bucket=month"
+                                 "&end=2020-06-01").json
+        archive_expenses(horizon_days=90)
+
+        self.assertEqual(self.all_pages(limit=2), before)
+        self.assertEqual(self.all_pages(limit=10), before)
+        self.assertEqual(self.export_rows(), exported)
+        self.assertEqual([row["id"] for row in filtered], [str(self.old[1])])
+        self.assertEqual(
+            self.export_rows("?from=2020-01-10&to=2020-02-10&category=Rent"), filtered
+        )
+        series_cache.clear()
+        self.assertEqual(
+            self.client.get("/dashboard/series?range=year&bucket=month"
+                            "&end=2020-06-01").json,
+            series,
+        )
+
+        response = self.client.get(f"/expenses/{self.old[1]}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["amount"], 20.0)
+        self.assertEqual(response.json["spent_at"], "2020-01-20T10:00:00")
+
+    def test_pages_decode_only_the_months_they_span(self):
+        for month in range(1, 13):
+            for day in (5, 20):
+                self.create_expense("1", f"2018-{month:02d}-{day:02d}T10:00:00",
+                                    "Groceries")
+        expected = self.all_pages(limit=100)
+        archive_expenses(horizon_days=90)
+
+        pages, decodes = [], []
+        query = "?limit=2"
+        with mock.patch.object(archive, "decode_rows",
+                               wraps=archive.decode_rows) as decode:
+            while True:
+                decode.reset_mock()
+                response = self.client.get("/expenses" + query)
+                decodes.append(decode.call_count)
+                pages.extend(response.json)
+                cursor = response.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+                query = f"?limit=2&cursor={cursor}"
+        self.assertEqual(pages, expected)
+        # A page of two plus its lookahead row spans at most two of the
+        # fourteen archived months, whatever the cursor's position
+        self.assertLessEqual(max(decodes), 2)
+
+    def test_backdated_expense_joins_the_archived_month(self):
+        archive_expenses(horizon_days=90)
+        late = self.create_expense("5", "2020-01-25T10:00:00", "Groceries")
+        self.assertEqual(self.all_pages(limit=10)[3]["id"], late)
+
+        self.assertEqual(archive_expenses(horizon_days=90), (1, 1))
+        january = ExpenseArchive.query.filter_by(month="2020-01").one()
+        self.assertEqual(january.count, 3)
+        self.assertEqual(reconcile(), [])
+
+    def test_writes_restore_archived_expenses(self):
+        archive_expenses(horizon_days=90)
+
+        response = self.client.put(f"/expenses/{self.old[0]}", json={"amount": "15"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["amount"], 15.0)
+        self.assertIsNotNone(db.session.get(Expense, self.old[0]))
+        january = ExpenseArchive.query.filter_by(month="2020-01").one()
+        self.assertEqual((january.count, january.first_id), (1, self.old[1]))
+
+        response = self.client.delete(f"/expenses/{self.old[2]}")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(ExpenseArchive.query.filter_by(month="2020-02").first())
+        self.assertEqual(self.client.get(f"/expenses/{self.old[2]}").status_code, 404)
+        self.assertEqual(reconcile(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,240 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest import mock
+from sqlalchemy.exc import OperationalError
+from app import create_app, db, bcrypt
+from app.archive import archive_expenses
+from app.attachments import Image, blob_path, collect_garbage
+from app.models import Attachment, Blob, User
+from app.util import utcnow
+from config import TestConfig
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 8
+PDF = b"%PDF-1.4\n" + b"receipt " * 100
+
+
+class AttachmentsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.store = tempfile.mkdtemp()
+        self.app.config["ATTACHMENT_DIR"] = self.store
+        self.app.config["ATTACHMENT_CHUNK_SIZE"] = 100  # Several chunks per file
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+        self.expense_id = self.create_expense()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.store)
+
+    def create_expense(self, spent_at="2024-06-01T12:00:00"):
+        response = self.client.post("/expenses", json={
+            "amount": "10", "description": "Test", "category": "Groceries",
+            "spent_at": spent_at,
+        })
+        return response.json["id"]
+
+    def upload(self, data, expense_id=None, filename="receipt.png"):
+        return self.client.post(
+            f"/expenses/{expense_id or self.expense_id}/attachments"
+            f"?filename={filename}",
+            data=data, content_type="application/octet-stream",
+        )
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(os.path.join(self.store, "blobs"))
+                for name in names]
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.upload(PNG)
+        self.assertEqual(first.status_code, 201, first.json)
+        self.assertEqual(first.json["content_type"], "image/png")
+        self.assertEqual(first.json["size"], len(PNG))
+        other = self.create_expense()
+        second = self.client.post(
+            f"/expenses/{other}/attachments",
+            data={"file": (io.BytesIO(PNG), "scan.png")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(second.status_code, 201, second.json)
+        self.assertEqual(second.json["filename"], "scan.png")
+        self.assertEqual(second.json["sha256"], first.json["sha256"])
+
+        self.assertEqual(self.stored_files(), [first.json["sha256"]])
+        self.assertEqual(db.session.get(Blob, first.json["sha256"]).refcount, 2)
+        self.assertEqual(os.listdir(os.path.join(self.store, "tmp")), [])
+
+        listed = self.client.get(f"/expenses/{self.expense_id}/attachments").json
+        self.assertEqual([row["id"] for row in listed], [first.json["id"]])
+
+    def test_download_supports_ranges_and_revalidation(self):
+        attachment = self.upload(PNG).json
+        url = f"/expenses/{self.expense_id}/attachments/{attachment['id']}"
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(), PNG)
+        self.assertEqual(response.mimetype, "image/png")
+        self.assertIn("private", response.headers["Cache-Control"])
+        self.assertNotIn("public", response.headers["Cache-Control"])
+        etag = response.headers["ETag"]
+        response.close()
+
+        response = self.client.get(url, headers={"Range": "bytes=8-15"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.get_data(), PNG[8:16])
+        self.assertEqual(response.headers["Content-Range"], f"bytes 8-15/{len(PNG)}")
+        response.close()
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        response.close()
+
+        self.assertEqual(self.client.get(url + "0").status_code, 404)
+
+    def test_rejects_unknown_types_and_oversized_files(self):
+        response = self.upload(b"GIF89a" + b"\0" * 100)
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(self.upload(b"").status_code, 415)
+
+        self.app.config["ATTACHMENT_MAX_BYTES"] = 1000
+        self.assertEqual(self.upload(PNG).status_code, 413)
+        response = self.client.post(
+            f"/expenses/{self.expense_id}/attachments",
+            data={"file": (io.BytesIO(PNG), "scan.png")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 413)
+
+        self.assertEqual(self.upload(PDF, expense_id=9999).status_code, 404)
+        self.assertEqual(self.stored_files(), [])
+        self.assertEqual(os.listdir(os.path.join(self.store, "tmp")), [])
+        self.assertEqual(Blob.query.count(), 0)
+
+    def test_gc_removes_files_once_unreferenced(self):
+        kept = self.upload(PNG).json
+        other = self.create_expense()
+        self.upload(PNG, expense_id=other)
+        doomed = self.upload(PDF, expense_id=other).json
+
+        # Deleting the expense drops its attachments' references
+        self.assertEqual(self.client.delete(f"/expenses/{other}").status_code, 200)
+        self.assertEqual(Attachment.query.count(), 1)
+        self.assertEqual(db.session.get(Blob, kept["sha256"]).refcount, 1)
+        self.assertEqual(db.session.get(Blob, doomed["sha256"]).refcount, 0)
+
+        # Not before the grace period is up
+        self.assertEqual(collect_garbage(grace_seconds=3600), (0, 0))
+        db.session.execute(
+            db.update(Blob).values(unreferenced_at=utcnow() - timedelta(hours=2))
+        )
+        db.session.commit()
+        self.assertEqual(collect_garbage(grace_seconds=3600), (1, len(PDF)))
+        self.assertEqual(self.stored_files(), [kept["sha256"]])
+        self.assertFalse(os.path.exists(blob_path(doomed["sha256"])))
+
+        # Uploading the same bytes again stores them afresh
+        self.assertEqual(self.upload(PDF).status_code, 201)
+        self.assertTrue(os.path.exists(blob_path(doomed["sha256"])))
+
+        response = self.client.delete(
+            f"/expenses/{self.expense_id}/attachments/{kept['id']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(db.session.get(Blob, kept["sha256"]).refcount, 0)
+
+    def failing_commit(self):
+        return mock.patch.object(
+            db.session, "commit", side_effect=OperationalError("COMMIT", {}, None)
+        )
+
+    def test_failed_upload_commit_stores_nothing(self):
+        with self.failing_commit(), self.assertRaises(OperationalError):
+            self.upload(PNG)
+        db.session.rollback()
+        self.assertEqual(self.stored_files(), [])
+        self.assertEqual(os.listdir(os.path.join(self.store, "tmp")), [])
+        self.assertEqual(Blob.query.count(), 0)
+
+    def test_failed_gc_commit_keeps_files(self):
+        attachment = self.upload(PNG).json
+        self.client.delete(f"/expenses/{self.expense_id}/attachments/{attachment['id']}")
+        db.session.execute(
+            db.update(Blob).values(unreferenced_at=utcnow() - timedelta(hours=2))
+        )
+        db.session.commit()
+
+        with self.failing_commit(), self.assertRaises(OperationalError):
+            collect_garbage(grace_seconds=3600)
+        self.assertIsNotNone(db.session.get(Blob, attachment["sha256"]))
+        self.assertEqual(self.stored_files(), [attachment["sha256"]])
+
+        self.assertEqual(collect_garbage(grace_seconds=3600), (1, len(PNG)))
+        self.assertEqual(self.stored_files(), [])
+        self.assertEqual(os.listdir(os.path.join(self.store, "tmp")), [])
+
+    def test_attachments_survive_archiving(self):
+        old = self.create_expense("2020-01-05T10:00:00")
+        attachment = self.upload(PNG, expense_id=old).json
+        archive_expenses(horizon_days=90)
+
+        response = self.client.get(f"/expenses/{old}/attachments/{attachment['id']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(), PNG)
+        response.close()
+        self.assertEqual(self.upload(PDF, expense_id=old).status_code, 201)
+
+    def test_thumbnails(self):
+        pdf = self.upload(PDF).json
+        url = f"/expenses/{self.expense_id}/attachments/{pdf['id']}/thumbnail"
+        self.assertEqual(self.client.get(url).status_code, 415)
+        self.assertEqual(self.client.get(url + "?size=7").status_code, 400)
+        if Image is None:
+            png = self.upload(PNG).json
+            response = self.client.get(
+                f"/expenses/{self.expense_id}/attachments/{png['id']}/thumbnail")
+            self.assertEqual(response.status_code, 501)
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_thumbnails_are_rendered_once(self):
+        source = io.BytesIO()
+        Image.new("RGB", (1200, 800), "white").save(source, "JPEG")
+        attachment = self.upload(source.getvalue(), filename="photo.jpg").json
+        url = (f"/expenses/{self.expense_id}/attachments/{attachment['id']}"
+               "/thumbnail?size=256")
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "image/jpeg")
+        with Image.open(io.BytesIO(response.get_data())) as thumbnail:
+            self.assertEqual(thumbnail.size, (256, 171))
+        response.close()
+
+        thumbs = os.path.join(self.store, "thumbs")
+        rendered = [name for _, _, names in os.walk(thumbs) for name in names]
+        self.assertEqual(len(rendered), 1)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,340 @@
+import csv
+import gzip
+import io
+import json
+import unittest
+from datetime import datetime
+from app import create_app, db, bcrypt
+from app.models import User, Expense
+from config import TestConfig
+
+
+class ExpensesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        # Create a test user and sign them in
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_expense(self, **overrides):
+        payload = {
+            "amount": "12.50",
+            "description": "Lunch",
+            "category": "Groceries",
+            "spent_at": "2024-10-01T12:00:00",
+        }
+        payload.update(overrides)
+        return self.client.post("/expenses", json=payload)
+
+    def test_create_expense(self):
+        response = self.create_expense()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json["amount"], 12.5)
+        self.assertEqual(response.json["category"], "Groceries")
+        self.assertEqual(Expense.query.count(), 1)
+
+    def test_create_expense_missing_amount(self):
+        response = self.create_expense(amount=None)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"Amount is required", response.data)
+
+    def test_create_expense_invalid_amount(self):
+        response = self.create_expense(amount="abc")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"Amount must be a number", response.data)
+
+    def test_create_expense_out_of_range_amount(self):
+        for amount in ("1e30", "10000000000", "-1e10"):
+            response = self.create_expense(amount=amount)
+            self.assertEqual(response.status_code, 400, amount)
+            self.assertIn(b"Amount must be a number", response.data)
+        self.assertEqual(self.create_expense(amount="9999999999.99").status_code, 201)
+
+    def test_rejects_malformed_bodies(self):
+        response = self.client.post("/expenses", json=[{"amount": "1"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json["error"], "Expense must be a JSON object")
+        response = self.create_expense(description=42)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json["error"], "Description must be a string")
+        response = self.create_expense(category=["Rent"])
+        self.assertEqual(response.status_code, 400)
+
+        expense_id = self.create_expense().json["id"]
+        response = self.client.put(f"/expenses/{expense_id}", json=["amount"])
+        self.assertEqual(response.status_code, 400)
+        response = self.client.put(f"/expenses/{expense_id}", json={"category": 7})
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_expense_missing_category(self):
+        response = self.create_expense(category="")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"Category is required", response.data)
+
+    def test_list_expenses_newest_first(self):
+        self.create_expense(description="Old", spent_at="2024-01-01")
+        self.create_expense(description="New", spent_at="2024-06-01")
+
+        response = self.client.get("/expenses")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([e["description"] for e in response.json], ["New", "Old"])
+        self.assertNotIn("X-Next-Cursor", response.headers)
+
+    def test_list_expenses_keyset_pagination(self):
+        # Several rows share a spent_at so the id tiebreaker is exercised
+        for day in range(1, 6):
+            for n in range(3):
+                self.create_expense(
+                    description=f"{day}-{n}", spent_at=f"2024-03-{day:02d}"
+                )
+
+        seen = []
+        cursor = None
+        while True:
+            url = "/expenses?limit=4" + (f"&cursor={cursor}" if cursor else "")
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json), 4)
+            seen.extend(e["id"] for e in response.json)
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+
+        expected = [
+            e.id
+            for e in Expense.query.order_by(
+                Expense.spent_at.desc(), Expense.id.desc()
+            )
+        ]
+        self.assertEqual(seen, expected)
+
+    def test_list_expenses_invalid_cursor(self):
+        response = self.client.get("/expenses?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"Invalid cursor", response.data)
+
+    def test_list_expenses_only_own(self):
+        other = User(username="other", email="other@example.com", password="x")
+        db.session.add(other)
+        db.session.commit()
+        db.session.add(
+            Expense(
+                user_id=other.id,
+                amount=5,
+                description="Not mine",
+                category="Rent",
+                spent_at=datetime(2024, 10, 1),
+            )
+        )
+        db.session.commit()
+        self.create_expense()
+
+        response = self.client.get("/expenses")
+        self.assertEqual([e["description"] for e in response.json], ["Lunch"])
+
+    def test_update_expense(self):
+        expense_id = self.create_expense().json["id"]
+        response = self.client.put(
+            f"/expenses/{expense_id}", json={"amount": "20", "category": "Rent"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["amount"], 20.0)
+        self.assertEqual(response.json["category"], "Rent")
+        self.assertEqual(response.json["description"], "Lunch")
+
+    def test_update_missing_expense(self):
+        response = self.client.put("/expenses/999", json={"amount": "20"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_delete_expense(self):
+        expense_id = self.create_expense().json["id"]
+        response = self.client.delete(f"/expenses/{expense_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Expense.query.count(), 0)
+
+    def read_events(self, response):
+        return [json.loads(line) for line in response.data.decode().splitlines()]
+
+    def test_import_csv(self):
+        body = (
+            "amount,description,category,spent_at\n"
+            "10.00,Coffee,Groceries,2024-01-02\n"
+            "abc,Broken,Groceries,2024-01-03\n"
+            "25.50,Bus pass,Transportation,2024-01-04\n"
+        )
+        response = self.client.post(
+            "/expenses/import", data=body, content_type="text/csv"
+        )
+        self.assertEqual(response.status_code, 200)
+        events = self.read_events(response)
+        self.assertEqual(
+            events[0], {"event": "error", "line": 3, "error": "Amount must be a number"}
+        )
+        self.assertEqual(events[-1], {"event": "done", "imported": 2, "failed": 1})
+        self.assertEqual(Expense.query.filter_by(user_id=self.test_user.id).count(), 2)
+
+    def test_import_reports_undecodable_rows(self):
+        body = (
+            "amount,description,category,spent_at\n"
+            "10.00,Coffee,Groceries,2024-01-02\n"
+        ).encode() + b"5.00,Caf\xe9,Groceries,2024-01-03\n"
+        events = self.read_events(self.client.post(
+            "/expenses/import", data=body, content_type="text/csv"))
+        self.assertEqual(events[-2]["error"], "File is not valid UTF-8")
+        self.assertEqual(events[-1], {"event": "done", "imported": 0, "failed": 1})
+
+        body = b"\n".join([
+            json.dumps({"amount": "1e40", "description": "Huge", "category": "Rent",
+                        "spent_at": "2024-02-01"}).encode(),
+            json.dumps({"amount": "1", "description": 5, "category": "Rent",
+                        "spent_at": "2024-02-01"}).encode(),
+            b'{"amount": "1", "description": "Caf\xe9"}',
+            json.dumps({"amount": "2", "description": "Fine", "category": "Rent",
+                        "spent_at": "2024-02-01"}).encode(),
+        ])
+        events = self.read_events(self.client.post(
+            "/expenses/import", data=body, content_type="application/x-ndjson"))
+        self.assertEqual(
+            [(e["line"], e["error"]) for e in events if e["event"] == "error"],
+            [(1, "Amount must be a number"), (2, "Description must be a string"),
+             (3, "File is not valid UTF-8")],
+        )
+        self.assertEqual(events[-1], {"event": "done", "imported": 1, "failed": 3})
+
+    def test_import_ndjson_reports_progress_per_batch(self):
+        self.app.config["IMPORT_BATCH_SIZE"] = 2
+        lines = [
+            json.dumps(
+                {"amount": n, "description": f"Row {n}", "category": "Rent",
+                 "spent_at": "2024-02-01"}
+            )
+            for n in range(1, 6)
+        ]
+        response = self.client.post(
+            "/expenses/import",
+            data="\n".join(lines) + "\nnot json\n",
+            content_type="application/x-ndjson",
+        )
+        events = self.read_events(response)
+        progress = [e["imported"] for e in events if e["event"] == "progress"]
+        self.assertEqual(progress, [2, 4])
+        self.assertIn({"event": "error", "line": 6, "error": "Invalid JSON"}, events)
+        self.assertEqual(events[-1], {"event": "done", "imported": 5, "failed": 1})
+        self.assertEqual(Expense.query.count(), 5)
+
+    def test_import_multipart_file(self):
+        body = b"amount,description,category\n3.25,Snack,Groceries\n"
+        response = self.client.post(
+            "/expenses/import",
+            data={"file": (io.BytesIO(body), "bank.csv")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(self.read_events(response)[-1]["imported"], 1)
+
+    def test_import_unsupported_type(self):
+        response = self.client.post(
+            "/expenses/import", data="hello", content_type="text/plain"
+        )
+        self.assertEqual(response.status_code, 415)
+
+
+    def export_rows(self, query="", **kwargs):
+        response = self.client.get("/expenses/export" + query, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        data = response.data
+        if response.headers.get("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        return list(csv.DictReader(io.StringIO(data.decode("utf-8"))))
+
+    def test_export_csv_oldest_first(self):
+        self.app.config["EXPORT_BATCH_SIZE"] = 2
+        self.create_expense(description="Third", spent_at="2024-03-01")
+        self.create_expense(description="First, with comma", spent_at="2024-01-01")
+        self.create_expense(description="Second", spent_at="2024-02-01")
+
+        rows = self.export_rows()
+        self.assertEqual(
+            [row["description"] for row in rows], ["First, with comma", "Second", "Third"]
+        )
+        self.assertEqual(rows[0]["amount"], "12.50")
+        self.assertEqual(rows[0]["spent_at"], "2024-01-01T00:00:00")
+
+    def test_export_filters(self):
+        self.create_expense(description="Old", spent_at="2023-12-31T23:00:00")
+        self.create_expense(description="Rent", category="Rent", spent_at="2024-01-31T18:00:00")
+        self.create_expense(description="Food", spent_at="2024-01-15")
+        self.create_expense(description="Late", spent_at="2024-02-01")
+
+        rows = self.export_rows("?from=2024-01-01&to=2024-01-31")
+        self.assertEqual([row["description"] for row in rows], ["Food", "Rent"])
+        rows = self.export_rows("?category=Rent&category=Other")
+        self.assertEqual([row["description"] for row in rows], ["Rent"])
+        response = self.client.get("/expenses/export?from=yesterday")
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_gzip(self):
+        self.create_expense()
+        response = self.client.get(
+            "/expenses/export", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        text = gzip.decompress(response.data).decode("utf-8")
+        self.assertTrue(text.startswith("id,spent_at,amount,currency,description,category"))
+
+    def test_export_round_trips_through_import(self):
+        self.create_expense(description="Lunch")
+        exported = self.client.get("/expenses/export").data
+        response = self.client.post(
+            "/expenses/import", data=exported, content_type="text/csv"
+        )
+        self.assertEqual(self.read_events(response)[-1]["imported"], 1)
+        self.assertEqual(Expense.query.filter_by(description="Lunch").count(), 2)
+
+
+    def test_export_escapes_formulas(self):
+        descriptions = ["=HYPERLINK(\"http://x\")", "-refund", "@SUM(A1)", "'=quoted", "Plain"]
+        for description in descriptions:
+            self.create_expense(description=description, category="+Fees")
+
+        rows = self.export_rows()
+        self.assertEqual(
+            [row["description"] for row in rows],
+            ["'=HYPERLINK(\"http://x\")", "'-refund", "'@SUM(A1)", "''=quoted", "Plain"],
+        )
+        self.assertEqual({row["category"] for row in rows}, {"'+Fees"})
+
+        exported = self.client.get("/expenses/export").data
+        response = self.client.post(
+            "/expenses/import", data=exported, content_type="text/csv"
+        )
+        self.assertEqual(self.read_events(response)[-1]["imported"], 5)
+        for description in descriptions:
+            self.assertEqual(
+                Expense.query.filter_by(description=description, category="+Fees").count(), 2
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+from app import create_app, db, bcrypt
+from app.models import User, Expense
+from config import TestConfig
+
+
+class ExpenseSearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_expense(self, description):
+        response = self.client.post(
+            "/expenses",
+            json={"amount": "10", "description": description, "category": "Misc"},
+        )
+        return response.json["id"]
+
+    def search(self, query):
+        response = self.client.get("/expenses/search" + query)
+        self.assertEqual(response.status_code, 200)
+        return [expense["description"] for expense in response.json]
+
+    def test_prefix_search(self):
+        self.create_expense("Uber to the airport")
+        self.create_expense("Groceries")
+        self.create_expense("Café Überraschung")
+
+        self.assertCountEqual(self.search("?q=ub"),
+                              ["Uber to the airport", "Café Überraschung"])
+        self.assertEqual(self.search("?q=uber air"), ["Uber to the airport"])
+        self.assertEqual(self.search("?q=cafe"), ["Café Überraschung"])
+        self.assertEqual(self.search("?q=taxi"), [])
+
+    def test_results_ranked_by_relevance(self):
+        self.create_expense("Dinner after a long uber ride home from the office party")
+        self.create_expense("Uber uber")
+
+        self.assertEqual(
+            self.search("?q=uber"),
+            ["Uber uber", "Dinner after a long uber ride home from the office party"],
+        )
+
+    def test_index_follows_updates_and_deletes(self):
+        renamed = self.create_expense("Uber")
+        deleted = self.create_expense("Uber eats")
+
+        self.client.put(f"/expenses/{renamed}", json={"description": "Lyft"})
+        self.client.delete(f"/expenses/{deleted}")
+
+        self.assertEqual(self.search("?q=uber"), [])
+        self.assertEqual(self.search("?q=lyf"), ["Lyft"])
+
+    def test_imported_rows_are_searchable(self):
+        body = "amount,description,category,spent_at\n5,Uber pool,Transport,2024-01-01\n"
+        response = self.client.post(
+            "/expenses/import", data=body, content_type="text/csv"
+        )
+        response.get_data()
+
+        self.assertEqual(self.search("?q=pool"), ["Uber pool"])
+
+    def test_search_only_own(self):
+        other = User(username="other", email="other@example.com", password="x")
+        db.session.add(other)
+        db.session.commit()
+        db.session.add(Expense(user_id=other.id, amount=1, description="Uber",
+                               category="Misc", spent_at=db.func.now()))
+        db.session.commit()
+
+        self.assertEqual(self.search("?q=uber"), [])
+
+    def test_keyset_pagination(self):
+        for n in range(5):
+            self.create_expense(f"Uber trip {n}")
+
+        seen = []
+        query = "?q=uber&limit=2"
+        while True:
+            response = self.client.get("/expenses/search" + query)
+            seen.extend(expense["id"] for expense in response.json)
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+            query = f"?q=uber&limit=2&cursor={cursor}"
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get("/expenses/search?q=").status_code, 400)
+        self.assertEqual(
+            self.client.get("/expenses/search?q=uber&cursor=!!").status_code, 400
+        )
+        self.assertEqual(self.search("?q=%22%2A"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
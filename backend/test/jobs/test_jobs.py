@@ -0,0 +1,212 @@
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest import mock
+from app import create_app, db, bcrypt
+from app.jobs import HANDLERS, backoff, claim, enqueue, job, run_next, run_workers
+from app.models import Job, ResetToken, User
+from app.util import utcnow
+from config import TestConfig
+
+calls = []
+
+
+@job("test_record")
+def record(value):
+    calls.append(value)
+
+
+@job("test_explode")
+def explode():
+    raise RuntimeError("boom")
+
+
+class JobTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+        calls.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def jobs(self):
+        return db.session.scalars(db.select(Job).order_by(Job.id)).all()
+
+    def test_enqueue_runs_after_commit_only(self):
+        enqueue("test_record", value=1)
+        db.session.rollback()
+        self.assertFalse(run_next(60))
+
+        enqueue("test_record", value=2)
+        db.session.commit()
+        self.assertTrue(run_next(60))
+        self.assertEqual(calls, [2])
+        self.assertEqual(self.jobs(), [])  # Finished jobs are deleted
+
+    def test_unknown_name_is_rejected_at_enqueue(self):
+        with self.assertRaises(KeyError):
+            enqueue("no_such_job")
+
+    def test_claims_are_exclusive_and_in_order(self):
+        first = enqueue("test_record", value=1)
+        second = enqueue("test_record", value=2)
+        enqueue("test_record", delay=60, value=3)
+        db.session.commit()
+
+        self.assertEqual(claim(60)[0], first)
+        self.assertEqual(claim(60)[0], second)
+        self.assertIsNone(claim(60))  # Claimed jobs are hidden; the last isn't due
+
+    def test_expired_lease_is_reclaimed(self):
+        job_id = enqueue("test_record", value=1)
+        db.session.commit()
+        stale = claim(60)
+        db.session.execute(
+            db.update(Job).values(available_at=utcnow() - timedelta(seconds=1))
+        )
+        db.session.commit()
+
+        self.assertTrue(run_next(60))
+        self.assertEqual(calls, [1])
+        self.assertEqual(stale.id, job_id)
+        self.assertEqual(self.jobs(), [])
+
+    def test_expired_last_attempt_is_parked(self):
+        enqueue("test_record", max_attempts=1, value=1)
+        db.session.commit()
+        claim(60)
+        db.session.execute(
+            db.update(Job).values(available_at=utcnow() - timedelta(seconds=1))
+        )
+        db.session.commit()
+
+        self.assertIsNone(claim(60))
+        db.session.expire_all()
+        parked = self.jobs()[0]
+        self.assertEqual((parked.status, parked.attempts), ("failed", 1))
+        self.assertIsNone(parked.available_at)
+        self.assertIn("Lease expired", parked.last_error)
+        self.assertEqual(calls, [])
+
+    def test_stale_worker_cannot_complete_a_reclaimed_job(self):
+        from app.jobs import complete
+
+        enqueue("test_record", value=1)
+        db.session.commit()
+        stale = claim(60)
+        db.session.execute(db.update(Job).values(available_at=utcnow()))
+        db.session.commit()
+        fresh = claim(60)
+
+        complete(stale.id, stale.lease)
+        self.assertEqual(len(self.jobs()), 1)
+        complete(fresh.id, fresh.lease)
+        self.assertEqual(self.jobs(), [])
+
+    def test_failures_back_off_then_park(self):
+        enqueue("test_explode", max_attempts=2)
+        db.session.commit()
+
+        before = utcnow()
+        self.assertTrue(run_next(60))
+        failed = self.jobs()[0]
+        self.assertEqual((failed.status, failed.attempts), ("queued", 1))
+        self.assertIn("RuntimeError: boom", failed.last_error)
+        # First retry waits between half and all of JOB_BACKOFF_SECONDS
+        self.assertGreaterEqual(failed.available_at, before + timedelta(seconds=5))
+        self.assertFalse(run_next(60))
+
+        db.session.execute(db.update(Job).values(available_at=utcnow()))
+        db.session.commit()
+        self.assertTrue(run_next(60))
+        db.session.expire_all()
+        failed = self.jobs()[0]
+        self.assertEqual((failed.status, failed.attempts), ("failed", 2))
+        self.assertIsNone(failed.available_at)
+        self.assertFalse(run_next(60))
+
+        result = self.app.test_cli_runner().invoke(args=["jobs", "retry"])
+        self.assertIn("Requeued 1 job(s)", result.output)
+        self.assertTrue(run_next(60))
+
+    def test_backoff_doubles_up_to_the_cap(self):
+        with mock.patch("app.jobs.random.uniform", side_effect=lambda low, high: high):
+            self.assertEqual([backoff(n, 10, 60) for n in range(1, 6)],
+                             [10, 20, 40, 60, 60])
+
+    def test_job_without_handler_fails_permanently(self):
+        enqueue("test_record", value=1)
+        db.session.commit()
+        with mock.patch.dict(HANDLERS, clear=True):
+            self.assertTrue(run_next(60))
+        self.assertEqual(self.jobs()[0].status, "failed")
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+    # Worker threads need their own connections, so a file database
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+
+        class FileConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{self.path}"
+
+        self.app = create_app(FileConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        calls.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.app_context.pop()
+        os.remove(self.path)
+
+    def test_pool_runs_every_job_once(self):
+        for value in range(40):
+            enqueue("test_record", value=value)
+        db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(
+            args=["jobs", "work", "--concurrency", "4", "--burst"]
+        )
+        self.assertIn("Processed 40 job(s)", result.output)
+        self.assertEqual(sorted(calls), list(range(40)))
+
+    def test_password_reset_request_is_handled_by_a_worker(self):
+        user = User(username="testuser", email="testuser@example.com",
+                    password=bcrypt.generate_password_hash("password123").decode())
+        db.session.add(user)
+        db.session.commit()
+
+        client = self.app.test_client()
+        response = client.post("/auth/password-reset/request",
+                               json={"email": "TestUser@example.com"})
+        self.assertEqual(response.status_code, 202)
+        response = client.post("/auth/password-reset/request",
+                               json={"email": "nobody@example.com"})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(client.post("/auth/password-reset/request",
+                                     json={}).status_code, 400)
+        self.assertEqual(db.session.scalar(db.select(db.func.count(ResetToken.id))), 0)
+
+        with mock.patch("app.reset_tokens.send_mail") as send_mail:
+            self.assertEqual(run_workers(self.app, 2, burst=True), 2)
+        send_mail.assert_called_once()
+        link = send_mail.call_args.args[2].split("token=")[1].split()[0]
+        response = client.post("/auth/password-reset",
+                               json={"token": link, "password": "newpassword1"})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
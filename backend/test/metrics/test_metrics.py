@@ -0,0 +1,90 @@
+import unittest
+from app import create_app, db
+from app.metrics import Histogram
+from config import TestConfig
+
+
+def sample(text, series):
+    for line in text.splitlines():
+        if line.startswith(series + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def scrape(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        return response.data.decode()
+
+    def test_request_latency_and_sql_counts_per_route(self):
+        series = 'http_requests_total{method="GET",route="/auth/users",status="200"}'
+        statements = 'db_statements_per_request_count{route="/auth/users"}'
+        before = self.scrape()
+
+        self.client.get("/auth/users?limit=10")
+        after = self.scrape()
+
+        self.assertEqual(sample(after, series) - sample(before, series), 1)
+        self.assertEqual(sample(after, statements) - sample(before, statements), 1)
+        self.assertIn(
+            'http_request_duration_seconds_bucket{method="GET",'
+            'route="/auth/users",le="+Inf"}',
+            after,
+        )
+        # The ETag version lookup and the page's SELECT ran, so it falls in
+        # the le="2" bucket but not le="1"
+        for le, expected in (("1", 0), ("2", 1)):
+            bucket = f'db_statements_per_request_bucket{{route="/auth/users",le="{le}"}}'
+            self.assertEqual(sample(after, bucket) - sample(before, bucket), expected)
+
+    def test_bcrypt_time_recorded(self):
+        series = 'bcrypt_seconds_count{operation="hash"}'
+        before = sample(self.scrape(), series)
+        self.client.post(
+            "/auth/signup",
+            json={
+                "username": "newuser",
+                "email": "newuser@example.com",
+                "password": "password123",
+            },
+        )
+        self.assertEqual(sample(self.scrape(), series) - before, 1)
+
+    def test_pool_checkout_recorded(self):
+        self.client.get("/auth/users?limit=1")
+        self.assertIn("db_pool_checkout_seconds_count", self.scrape())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("demo", "Demo.", ("route",), buckets=(1, 5))
+        for value in (0.5, 3, 3, 10):
+            histogram.observe(value, ("/x",))
+        text = "\n".join(histogram.render())
+        self.assertEqual(sample(text, 'demo_bucket{route="/x",le="1"}'), 1)
+        self.assertEqual(sample(text, 'demo_bucket{route="/x",le="5"}'), 3)
+        self.assertEqual(sample(text, 'demo_bucket{route="/x",le="+Inf"}'), 4)
+        self.assertEqual(sample(text, 'demo_sum{route="/x"}'), 16.5)
+
+    def test_disabled(self):
+        class NoMetricsConfig(TestConfig):
+            METRICS_ENABLED = False
+
+        app = create_app(NoMetricsConfig)
+        self.assertEqual(app.test_client().get("/metrics").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
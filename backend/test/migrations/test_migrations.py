@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from flask_migrate import downgrade, upgrade
+from app import create_app, db
+from config import TestConfig
+
+MIGRATIONS = os.path.join(os.path.dirname(__file__), "..", "..", "migrations")
+SEARCH_TRIGGERS = ["expense_fts_ad", "expense_fts_ai", "expense_fts_au"]
+
+
+class MigrationsTestCase(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+
+        class MigrationConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = "sqlite:///" + self.path
+
+        self.app = create_app(MigrationConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.app_context.pop()
+        os.remove(self.path)
+
+    def triggers(self):
+        return sorted(db.session.scalars(
+            db.text("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        ))
+
+    def search(self, term):
+        return db.session.scalars(
+            db.text("SELECT rowid FROM expense_fts WHERE expense_fts MATCH :term"),
+            {"term": term},
+        ).all()
+
+    def test_search_triggers_survive_to_head(self):
+        upgrade(directory=MIGRATIONS)
+        self.assertEqual(self.triggers(), SEARCH_TRIGGERS)
+
+        db.session.execute(db.text(
+            "INSERT INTO user (id, username, email, password) "
+            "VALUES (1, 'someone', 'someone@example.com', 'x')"
+        ))
+        db.session.execute(db.text(
+            "INSERT INTO expense (id, user_id, amount, currency, description, "
+            "category, spent_at) VALUES (1, 1, 5, 'USD', 'Coffee beans', "
+            "'Groceries', '2024-06-01 12:00:00')"
+        ))
+        db.session.commit()
+        self.assertEqual(self.search("coffee"), [1])
+
+    def test_recurring_downgrade_keeps_search_triggers(self):
+        upgrade(directory=MIGRATIONS, revision="b3f7c2e9d540")
+        downgrade(directory=MIGRATIONS, revision="5e8b3d1f7a26")
+        self.assertEqual(self.triggers(), SEARCH_TRIGGERS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,244 @@
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+from app import create_app, db, bcrypt
+from app.events import broker
+from app.models import Expense, RecurringExpense, User
+from app.recurring import RecurringScheduler, materialize, materialize_due, occurrence
+from app.rollups import reconcile
+from app.util import utcnow
+from config import TestConfig
+
+
+class OccurrenceTestCase(unittest.TestCase):
+    def rule(self, frequency, starts_at, interval=1):
+        return SimpleNamespace(frequency=frequency, starts_at=starts_at,
+                               interval=interval)
+
+    def test_monthly_keeps_the_anchor_day(self):
+        rule = self.rule("monthly", datetime(2024, 1, 31, 9, 30))
+        self.assertEqual(
+            [occurrence(rule, n) for n in range(4)],
+            [datetime(2024, 1, 31, 9, 30), datetime(2024, 2, 29, 9, 30),
+             datetime(2024, 3, 31, 9, 30), datetime(2024, 4, 30, 9, 30)],
+        )
+
+    def test_intervals(self):
+        start = datetime(2024, 2, 29)
+        self.assertEqual(occurrence(self.rule("daily", start, 3), 2),
+                         datetime(2024, 3, 6))
+        self.assertEqual(occurrence(self.rule("weekly", start, 2), 1),
+                         datetime(2024, 3, 14))
+        self.assertEqual(occurrence(self.rule("monthly", start, 6), 2),
+                         datetime(2025, 2, 28))
+        self.assertEqual(occurrence(self.rule("yearly", start), 4),
+                         datetime(2028, 2, 29))
+
+
+class RecurringTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+        publish = mock.patch.object(broker, "publish")
+        self.publish = publish.start()
+        self.addCleanup(publish.stop)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_rule(self, **fields):
+        payload = {"amount": "1200", "description": "Rent", "category": "Housing",
+                   "frequency": "monthly", **fields}
+        return self.client.post("/recurring", json=payload)
+
+    def expense_dates(self):
+        return db.session.scalars(
+            db.select(Expense.spent_at).order_by(Expense.spent_at)
+        ).all()
+
+    def test_past_start_catches_up_on_create(self):
+        start = (utcnow() - timedelta(days=9)).replace(microsecond=0)
+        response = self.create_rule(frequency="daily", interval=2,
+                                    starts_at=start.isoformat())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json["next_at"],
+                         (start + timedelta(days=10)).isoformat())
+        self.assertEqual(self.expense_dates(),
+                         [start + timedelta(days=n) for n in range(0, 10, 2)])
+        self.assertEqual(reconcile(), [])
+        self.publish.assert_any_call(self.test_user.id, "expenses.materialized",
+                                     {"materialized": 5})
+
+    def test_future_start_writes_nothing_yet(self):
+        start = utcnow() + timedelta(days=3)
+        response = self.create_rule(starts_at=start.isoformat())
+        self.assertEqual(response.json["next_at"], start.isoformat())
+        self.assertEqual(self.expense_dates(), [])
+
+    def test_validation(self):
+        self.assertEqual(self.create_rule(frequency="hourly").status_code, 400)
+        self.assertEqual(self.create_rule(interval=0).status_code, 400)
+        self.assertEqual(self.create_rule(amount="").status_code, 400)
+        response = self.create_rule(starts_at="soon")
+        self.assertEqual(response.json["error"], "Invalid starts_at date")
+        response = self.create_rule(starts_at="2024-02-01", ends_at="2024-01-01")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.create_rule(description=5).status_code, 400)
+        self.assertEqual(self.client.post("/recurring", json=[1]).status_code, 400)
+
+    def test_ends_at_stops_the_rule(self):
+        self.create_rule(starts_at="2024-01-15", ends_at="2024-03-20")
+        self.assertEqual(
+            self.expense_dates(),
+            [datetime(2024, 1, 15), datetime(2024, 2, 15), datetime(2024, 3, 15)],
+        )
+        self.assertIsNone(self.client.get("/recurring").json[0]["next_at"])
+
+    def test_rerun_after_lost_progress_writes_no_duplicates(self):
+        self.create_rule(starts_at="2024-01-01", ends_at="2024-06-30")
+        rule = db.session.scalars(db.select(RecurringExpense)).one()
+        # As if a crash lost the progress update but not the rows
+        rule.fired, rule.next_at = 2, datetime(2024, 3, 1)
+        db.session.commit()
+
+        materialize([rule.id], utcnow())
+        self.assertEqual(len(self.expense_dates()), 6)
+        self.assertIsNone(rule.next_at)
+        self.assertEqual(reconcile(), [])
+
+    def test_catch_up_is_capped_per_run(self):
+        self.create_rule(starts_at="2024-01-01", ends_at="2024-12-31")
+        self.assertEqual(len(self.expense_dates()), 12)
+
+        rule = RecurringExpense(
+            user_id=self.test_user.id, amount=1, currency="USD", description="x",
+            category="Fees", frequency="daily", interval=1,
+            starts_at=datetime(2024, 1, 1), ends_at=datetime(2024, 1, 10),
+            fired=0, next_at=datetime(2024, 1, 1),
+        )
+        db.session.add(rule)
+        db.session.commit()
+        self.assertEqual(materialize([rule.id], utcnow(), max_catchup=4),
+                         {rule.id: datetime(2024, 1, 5)})
+        self.assertEqual(materialize_due(utcnow(), max_catchup=4), 2)
+        self.assertEqual(len(self.expense_dates()), 22)
+
+    def test_update_reanchors_future_occurrences(self):
+        rule_id = self.create_rule(starts_at="2024-01-31", ends_at="2024-03-31").json["id"]
+        self.assertEqual(len(self.expense_dates()), 3)
+
+        response = self.client.put(f"/recurring/{rule_id}",
+                                   json={"ends_at": "2024-05-31", "amount": "1300"})
+        self.assertEqual(response.json["next_at"], "2024-04-30T00:00:00")
+        materialize_due(utcnow())
+        amounts = db.session.execute(
+            db.select(Expense.spent_at, Expense.amount).order_by(Expense.spent_at)
+        ).all()
+        self.assertEqual([row[1] for row in amounts], [1200] * 3 + [1300] * 2)
+        self.assertEqual(amounts[-1][0], datetime(2024, 5, 31))
+
+        # A new period starts from the next unwritten occurrence
+        response = self.client.put(f"/recurring/{rule_id}",
+                                   json={"frequency": "weekly", "interval": 2,
+                                         "ends_at": None})
+        self.assertEqual(response.json["next_at"], "2024-06-30T00:00:00")
+        rule = db.session.get(RecurringExpense, rule_id)
+        self.assertEqual(occurrence(rule, 1), datetime(2024, 7, 14))
+
+    def test_delete_keeps_written_expenses(self):
+        rule_id = self.create_rule(starts_at="2024-01-01", ends_at="2024-02-01").json["id"]
+        response = self.client.delete(f"/recurring/{rule_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.delete(f"/recurring/{rule_id}").status_code, 404)
+        self.assertEqual(
+            db.session.scalars(db.select(Expense.recurring_id)).all(), [None, None]
+        )
+
+    def test_run_command(self):
+        rule = RecurringExpense(
+            user_id=self.test_user.id, amount=5, currency="USD", description="Gym",
+            category="Health", frequency="weekly", interval=1,
+            starts_at=datetime(2024, 1, 1), ends_at=datetime(2024, 1, 31),
+            fired=0, next_at=datetime(2024, 1, 1),
+        )
+        db.session.add(rule)
+        db.session.commit()
+        result = self.app.test_cli_runner().invoke(args=["recurring", "run"])
+        self.assertIn("Fired 1 recurring expense(s)", result.output)
+        self.assertEqual(len(self.expense_dates()), 5)
+
+    def add_rule(self, starts_at, frequency="daily"):
+        rule = RecurringExpense(
+            user_id=self.test_user.id, amount=1, currency="USD", description="x",
+            category="Fees", frequency=frequency, interval=1, starts_at=starts_at,
+            fired=0, next_at=starts_at,
+        )
+        db.session.add(rule)
+        db.session.commit()
+        return rule
+
+    def test_tick_fires_due_rules_and_sleeps_until_the_next(self):
+        now = datetime(2024, 6, 1, 12, 0)
+        self.add_rule(now - timedelta(days=2))
+        self.add_rule(now + timedelta(seconds=30))
+        scheduler = RecurringScheduler(self.app, horizon=300, batch_size=10,
+                                       max_catchup=100)
+
+        self.assertEqual(scheduler.tick(now), 30)
+        self.assertEqual(len(self.expense_dates()), 3)
+        # The fired rule was pushed back for tomorrow, past the horizon
+        self.assertEqual(scheduler._heap, [(now + timedelta(seconds=30), 2)])
+
+        self.assertEqual(scheduler.tick(now + timedelta(seconds=30)), 270)
+        self.assertEqual(len(self.expense_dates()), 4)
+        self.assertEqual(scheduler._heap, [])
+
+    def test_refill_loads_only_the_horizon(self):
+        now = datetime(2024, 6, 1, 12, 0)
+        for minutes in (1, 2, 10, 60):
+            self.add_rule(now + timedelta(minutes=minutes))
+        scheduler = RecurringScheduler(self.app, horizon=300, batch_size=10,
+                                       max_catchup=100)
+        scheduler.refill(now)
+        self.assertEqual(len(scheduler._heap), 2)
+
+        # Rules created inside the loaded horizon join the heap directly
+        rule = self.add_rule(now + timedelta(minutes=3))
+        scheduler.schedule(rule.id, rule.next_at)
+        scheduler.schedule(rule.id + 1, now + timedelta(minutes=30))
+        self.assertEqual(len(scheduler._heap), 3)
+
+    def test_stale_heap_entries_are_harmless(self):
+        now = datetime(2024, 6, 1, 12, 0)
+        rule = self.add_rule(now - timedelta(minutes=1))
+        scheduler = RecurringScheduler(self.app, horizon=300, batch_size=10,
+                                       max_catchup=100)
+        scheduler.refill(now)
+        scheduler.schedule(rule.id, rule.next_at)  # A duplicate entry
+        scheduler.tick(now)
+        scheduler._heap.append((now - timedelta(minutes=1), rule.id))
+        scheduler.tick(now)
+        self.assertEqual(len(self.expense_dates()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
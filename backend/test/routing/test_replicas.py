@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from flask import g
+from app import create_app, db, bcrypt, replicas
+from app.models import User, Expense
+from config import TestConfig
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        primary = "sqlite:///" + os.path.join(self.workdir, "primary.db")
+        replica = "sqlite:///" + os.path.join(self.workdir, "replica.db")
+
+        class ReplicaConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = primary
+            SQLALCHEMY_REPLICA_URIS = [replica]
+            SQLALCHEMY_REPLICA_STICKY_SECONDS = 60
+
+        self.app = create_app(ReplicaConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        # Same schema and user on both; replication itself is out of scope
+        self.replica_engine = db.engines["replica_0"]
+        db.create_all()
+        db.metadata.create_all(self.replica_engine)
+        password = bcrypt.generate_password_hash("password123").decode("utf-8")
+        with self.replica_engine.begin() as connection:
+            connection.execute(
+                db.insert(User),
+                {"id": 1, "username": "testuser", "email": "testuser@example.com",
+                 "password": password},
+            )
+            connection.execute(
+                db.insert(Expense),
+                {"user_id": 1, "amount": 1, "description": "From replica",
+                 "category": "Rent", "spent_at": datetime(2024, 1, 1)},
+            )
+        db.session.add(
+            User(id=1, username="testuser", email="testuser@example.com",
+                 password=password)
+        )
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.workdir)
+        # db.init_app registered an (empty) metadata for the replica bind on
+        # the shared db; later apps without that bind would trip over it
+        db.metadatas.pop("replica_0", None)
+
+    def descriptions(self):
+        db.session.rollback()  # Each request gets a fresh transaction in production
+        return [e["description"] for e in self.client.get("/expenses").json]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.descriptions(), ["From replica"])
+
+    def test_own_write_reads_from_primary(self):
+        self.client.post(
+            "/expenses",
+            json={"amount": "2", "description": "On primary", "category": "Rent",
+                  "spent_at": "2024-02-01"},
+        )
+        self.assertEqual(self.descriptions(), ["On primary"])
+
+        # Once the sticky window is over reads go back to the replica
+        replicas.sticky_seconds = 0
+        self.assertEqual(self.descriptions(), ["From replica"])
+
+    def test_bearer_token_write_reads_from_primary(self):
+        client = self.app.test_client(use_cookies=False)
+        token = client.post(
+            "/auth/token",
+            json={"email": "testuser@example.com", "password": "password123"},
+        ).json["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        def descriptions():
+            db.session.rollback()
+            # Requests share the test's app context, where Flask-Login caches
+            # the user; each request must authenticate with its token
+            g.pop("_login_user", None)
+            response = client.get("/expenses", headers=headers)
+            return [e["description"] for e in response.json]
+
+        self.assertEqual(descriptions(), ["From replica"])
+        g.pop("_login_user", None)
+        response = client.post(
+            "/expenses", headers=headers,
+            json={"amount": "2", "description": "On primary", "category": "Rent",
+                  "spent_at": "2024-02-01"},
+        )
+        self.assertEqual(response.status_code, 201)
+        # The client never sends back the session cookie stamped here
+        self.assertEqual(descriptions(), ["On primary"])
+
+        replicas.sticky_seconds = 0
+        self.assertEqual(descriptions(), ["From replica"])
+
+    def test_writes_in_get_request_go_to_primary(self):
+        self.assertIsNone(self.client.get("/expenses").headers.get("Set-Cookie"))
+        with self.app.test_request_context("/expenses"):
+            self.app.preprocess_request()
+            self.assertEqual(
+                db.session.get_bind(clause=db.insert(Expense)), db.engine
+            )
+            self.assertEqual(db.session.get_bind(), self.replica_engine)
+
+
+if __name__ == "__main__":
+    unittest.main()
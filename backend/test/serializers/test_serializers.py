@@ -0,0 +1,59 @@
+import json
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from app import create_app, db
+from app.models import User, Expense
+from app.serializers import EXPENSE, USER
+from config import TestConfig
+
+
+class SchemaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        user = User(username="testuser", email="testuser@example.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+        self.expense = Expense(user_id=user.id, amount=Decimal("12.50"),
+                               description="Lunch", category="Groceries",
+                               spent_at=datetime(2024, 1, 2, 12, 30))
+        db.session.add(self.expense)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_select_fetches_only_declared_columns(self):
+        sql = str(USER.only(["email"]).select())
+        self.assertIn(".email", sql)
+        self.assertNotIn("password", sql)
+
+    def test_rows_and_objects_serialize_alike(self):
+        row = db.session.execute(EXPENSE.select(Expense.user_id)).one()
+        expected = {"id": self.expense.id, "amount": 12.5, "currency": "USD",
+                    "description": "Lunch",
+                    "category": "Groceries", "spent_at": "2024-01-02T12:30:00"}
+        self.assertEqual(EXPENSE.row_dict(row), expected)
+        self.assertEqual(EXPENSE.dump(self.expense), expected)
+        self.assertEqual(json.loads(EXPENSE.dumps([row])), [expected])
+
+    def test_iter_dumps(self):
+        schema = USER.only(["username"])
+        chunks = schema.iter_dumps([[("a",), ("b",)], [], [("c",)]])
+        self.assertEqual(json.loads("".join(chunks)),
+                         [{"username": "a"}, {"username": "b"}, {"username": "c"}])
+        self.assertEqual("".join(schema.iter_dumps([])), "[]")
+
+    def test_unknown_field(self):
+        with self.assertRaises(KeyError):
+            USER.only(["password"])
+
+
+if __name__ == "__main__":
+    unittest.main()
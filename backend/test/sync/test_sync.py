@@ -0,0 +1,211 @@
+import unittest
+from datetime import timedelta
+from unittest import mock
+from app import archive, create_app, db, bcrypt
+from app.archive import archive_expenses
+from app.models import Expense, ExpenseChange, SyncMutation, User
+from app.rollups import reconcile
+from app.sync import compact
+from app.util import utcnow
+from config import TestConfig
+
+
+class SyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_expense(self, amount="10", spent_at="2024-06-01T12:00:00"):
+        response = self.client.post("/expenses", json={
+            "amount": amount, "description": "Test", "category": "Groceries",
+            "spent_at": spent_at,
+        })
+        return response.json["id"]
+
+    def pull(self, since, limit=None):
+        query = f"?since={since}" + (f"&limit={limit}" if limit else "")
+        response = self.client.get("/sync" + query)
+        self.assertEqual(response.status_code, 200, response.json)
+        return response.json
+
+    def push(self, *mutations):
+        return self.client.post("/sync", json={"mutations": list(mutations)})
+
+    def test_pull_returns_one_compacted_change_per_row(self):
+        # Not the newest row: SQLite hands a deleted max id to the next insert
+        removed = self.create_expense("3")
+        kept = self.create_expense("1")
+        edited = self.create_expense("2")
+        first = self.pull(0)
+        self.assertEqual([change["id"] for change in first["changes"]],
+                         [removed, kept, edited])
+        self.assertFalse(first["more"])
+
+        for amount in ("20", "21", "22"):
+            self.client.put(f"/expenses/{edited}", json={"amount": amount})
+        self.client.delete(f"/expenses/{removed}")
+        added = self.create_expense("4")
+
+        changes = self.pull(first["since"])
+        self.assertEqual(
+            [(change["id"], change["deleted"]) for change in changes["changes"]],
+            [(edited, False), (removed, True), (added, False)],
+        )
+        self.assertEqual(changes["changes"][0]["expense"]["amount"], 22.0)
+        self.assertNotIn("expense", changes["changes"][1])
+        self.assertEqual(self.pull(changes["since"])["changes"], [])
+
+        # A fresh client gets live rows only, no tombstones
+        self.assertEqual([change["id"] for change in self.pull(0)["changes"]],
+                         [kept, edited, added])
+
+    def test_pages_never_split_a_transaction(self):
+        self.create_expense("1")
+        self.client.post(
+            "/expenses/import",
+            data="amount,description,category,spent_at\n"
+                 "2,A,Rent,2024-06-02\n3,B,Rent,2024-06-03\n4,C,Rent,2024-06-04\n",
+            content_type="text/csv",
+        ).get_data()
+        self.create_expense("5")
+
+        page = self.pull(0, limit=2)
+        # The import's three rows share one seq, so the page runs to its end
+        self.assertEqual(len(page["changes"]), 4)
+        self.assertTrue(page["more"])
+        rest = self.pull(page["since"], limit=2)
+        self.assertEqual(len(rest["changes"]), 1)
+        self.assertFalse(rest["more"])
+
+    def test_push_applies_a_batch_once(self):
+        existing = self.create_expense("10")
+        doomed = self.create_expense("5")
+        since = self.pull(0)["since"]
+        mutations = (
+            {"key": "a", "op": "create", "data": {
+                "amount": "7", "description": "Offline", "category": "Groceries",
+                "spent_at": "2024-06-02T08:00:00"}},
+            {"key": "b", "op": "update", "id": existing, "data": {"amount": "12"}},
+            {"key": "c", "op": "delete", "id": doomed},
+            {"key": "d", "op": "delete", "id": 9999},
+        )
+        response = self.push(*mutations)
+        self.assertEqual(response.status_code, 200)
+        results = response.json["results"]
+        self.assertEqual([result["status"] for result in results], [201, 200, 200, 404])
+        created = results[0]["expense"]["id"]
+        self.assertEqual(results[1]["expense"]["amount"], 12.0)
+
+        # Replaying after a lost response changes nothing
+        replay = self.push(*mutations)
+        self.assertEqual(replay.json, response.json)
+        self.assertEqual(Expense.query.count(), 2)
+        self.assertEqual(reconcile(), [])
+
+        changes = self.pull(since)["changes"]
+        self.assertEqual(
+            sorted((change["id"], change["deleted"]) for change in changes),
+            sorted([(existing, False), (doomed, True), (created, False)]),
+        )
+        self.assertEqual(len({change["seq"] for change in changes}), 1)
+
+    def test_push_rejects_invalid_batches_whole(self):
+        existing = self.create_expense("10")
+        response = self.push(
+            {"key": "a", "op": "update", "id": existing, "data": {"amount": "12"}},
+            {"key": "b", "op": "create", "data": {"amount": "x"}},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.json["index"], response.json["key"]), (1, "b"))
+        self.assertEqual(float(db.session.get(Expense, existing).amount), 10.0)
+        self.assertEqual(SyncMutation.query.count(), 0)
+
+        for mutations in ([], [{"op": "delete", "id": 1}],
+                          [{"key": "a", "op": "merge"}],
+                          [{"key": "a", "op": "delete", "id": "1"}],
+                          [{"key": "a", "op": "update", "id": existing,
+                            "data": {"description": 5}}],
+                          [{"key": "a", "op": "delete", "id": 1}] * 2):
+            self.assertEqual(self.push(*mutations).status_code, 400, mutations)
+
+    def test_compaction_drops_old_tombstones(self):
+        kept = self.create_expense("1")
+        removed = self.create_expense("2")
+        since = self.pull(0)["since"]
+        self.client.delete(f"/expenses/{removed}")
+        self.push({"key": "a", "op": "update", "id": kept, "data": {"amount": "3"}})
+        latest = self.pull(since)["since"]
+
+        self.assertEqual(compact(tombstone_days=1, key_days=1), (0, 0))
+        db.session.execute(
+            db.update(ExpenseChange).values(changed_at=utcnow() - timedelta(days=2))
+        )
+        db.session.execute(
+            db.update(SyncMutation).values(created_at=utcnow() - timedelta(days=2))
+        )
+        db.session.commit()
+        self.assertEqual(compact(tombstone_days=1, key_days=1), (1, 1))
+
+        response = self.client.get(f"/sync?since={since}")
+        self.assertEqual(response.status_code, 410)
+        self.assertTrue(response.json["resync"])
+        self.assertEqual(self.pull(latest)["changes"], [])
+        self.assertEqual([change["id"] for change in self.pull(0)["changes"]], [kept])
+
+    def test_archived_expenses_sync_and_restore(self):
+        old = self.create_expense("8", "2020-01-05T10:00:00")
+        archive_expenses(horizon_days=90)
+
+        change, = self.pull(0)["changes"]
+        self.assertEqual((change["id"], change["expense"]["amount"]), (old, 8.0))
+
+        response = self.push(
+            {"key": "a", "op": "update", "id": old, "data": {"amount": "9"}}
+        )
+        self.assertEqual(response.json["results"][0]["status"], 200)
+        self.assertEqual(float(db.session.get(Expense, old).amount), 9.0)
+        self.assertEqual(reconcile(), [])
+
+    def test_pull_decodes_each_archived_month_once(self):
+        january = [self.create_expense(str(day), f"2020-01-{day:02d}T10:00:00")
+                   for day in range(1, 6)]
+        february = self.create_expense("9", "2020-02-01T10:00:00")
+        archive_expenses(horizon_days=90)
+
+        with mock.patch.object(archive, "decode_rows",
+                               wraps=archive.decode_rows) as decode:
+            changes = self.pull(0)["changes"]
+        self.assertEqual([change["id"] for change in changes], january + [february])
+        self.assertEqual([change["expense"]["amount"] for change in changes],
+                         [1.0, 2.0, 3.0, 4.0, 5.0, 9.0])
+        self.assertEqual(decode.call_count, 2)
+
+    def test_rejects_invalid_since(self):
+        for since in ("-1", "abc"):
+            response = self.client.get(f"/sync?since={since}")
+            self.assertEqual(response.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+from app import create_app, db, bcrypt
+from app.models import User
+from config import TestConfig
+
+
+class ConditionalGetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+        self.test_user = User(
+            username="testuser",
+            email="testuser@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(self.test_user)
+        db.session.commit()
+
+        self.client.post(
+            "/auth/signin",
+            json={"email": "testuser@example.com", "password": "password123"},
+        )
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_expense(self, description="Lunch"):
+        response = self.client.post(
+            "/expenses",
+            json={"amount": "10", "description": description, "category": "Misc",
+                  "spent_at": "2024-01-01"},
+        )
+        return response.json["id"]
+
+    def revalidate(self, path, etag):
+        return self.client.get(path, headers={"If-None-Match": etag})
+
+    def test_unchanged_data_answers_304(self):
+        self.create_expense()
+        for path in ("/expenses", "/dashboard/summary", "/expenses/search?q=lun"):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers["ETag"]
+            self.assertFalse(etag.startswith("W/"))
+            self.assertEqual(response.headers["Cache-Control"], "private, no-cache")
+
+            response = self.revalidate(path, etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b"")
+            self.assertEqual(response.headers["ETag"], etag)
+
+    def test_every_write_changes_the_etag(self):
+        etags = {self.client.get("/expenses").headers["ETag"]}
+        expense_id = self.create_expense()
+        etags.add(self.client.get("/expenses").headers["ETag"])
+        self.client.put(f"/expenses/{expense_id}", json={"amount": "11"})
+        etags.add(self.client.get("/expenses").headers["ETag"])
+        self.client.delete(f"/expenses/{expense_id}")
+        etags.add(self.client.get("/expenses").headers["ETag"])
+        self.client.post(
+            "/expenses/import", data="amount,description,category\n1,A,B\n",
+            content_type="text/csv",
+        ).get_data()
+        etag = self.client.get("/expenses").headers["ETag"]
+        etags.add(etag)
+
+        self.assertEqual(len(etags), 5)
+        self.assertEqual(self.revalidate("/expenses", etag).status_code, 304)
+
+    def test_etag_differs_per_query_and_user(self):
+        first = self.client.get("/expenses?limit=1").headers["ETag"]
+        second = self.client.get("/expenses?limit=2").headers["ETag"]
+        self.assertNotEqual(first, second)
+
+        other = User(
+            username="other", email="other@example.com",
+            password=bcrypt.generate_password_hash("password123").decode("utf-8"),
+        )
+        db.session.add(other)
+        db.session.commit()
+        self.client.post(
+            "/auth/signin", json={"email": "other@example.com", "password": "password123"}
+        )
+        self.assertEqual(self.revalidate("/expenses?limit=1", first).status_code, 200)
+
+    def test_errors_carry_no_etag(self):
+        response = self.client.get("/expenses/999")
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn("ETag", response.headers)
+
+    def test_users_listing_uses_global_version(self):
+        etag = self.client.get("/auth/users").headers["ETag"]
+        self.assertEqual(self.revalidate("/auth/users", etag).status_code, 304)
+
+        # Expense writes and rehashes don't touch the user directory
+        self.create_expense()
+        self.test_user.password = bcrypt.generate_password_hash("another").decode("utf-8")
+        db.session.commit()
+        self.assertEqual(self.revalidate("/auth/users", etag).status_code, 304)
+
+        self.client.post(
+            "/auth/signup",
+            json={"username": "newuser", "email": "new@example.com",
+                  "password": "password123"},
+        )
+        self.assertEqual(self.revalidate("/auth/users", etag).status_code, 200)
+
+        etag = self.client.get("/auth/users").headers["ETag"]
+        self.test_user.email = "renamed@example.com"
+        db.session.commit()
+        self.assertEqual(self.revalidate("/auth/users", etag).status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
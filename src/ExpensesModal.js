@@ -23,18 +23,19 @@ const ExpensesModal = ({ isOpen, onRequestClose, transaction, onSave }) => {
       category, // Include the selected category
     };
 
+    let response;
     if (transaction) {
       // Update transaction
-      await axios.put(
+      response = await axios.put(
         `http://127.0.0.1:5000/expenses/${transaction.id}`,
         expenseData
       );
     } else {
       // Create new transaction
-      await axios.post("http://127.0.0.1:5000/expenses", expenseData);
+      response = await axios.post("http://127.0.0.1:5000/expenses", expenseData);
     }
 
-    onSave(); // Call parent function to refresh transaction list
+    onSave(response.data); // Hand the saved expense back to the list
     onRequestClose(); // Close modal
   };
 
@@ -11,6 +11,28 @@ const Expenses = () => {
 
   useEffect(() => {
     fetchExpenses();
+
+    // Apply changes pushed by the server (from this or any other tab/device)
+    // instead of refetching the whole list after every write
+    const source = new EventSource("http://127.0.0.1:5000/events", {
+      withCredentials: true,
+    });
+    source.addEventListener("expense.created", (e) =>
+      upsertExpense(JSON.parse(e.data))
+    );
+    source.addEventListener("expense.updated", (e) =>
+      upsertExpense(JSON.parse(e.data))
+    );
+    source.addEventListener("expense.deleted", (e) =>
+      removeExpense(JSON.parse(e.data).id)
+    );
+    // Missed too many events, bulk import or recurring expenses written:
+    // fall back to a full reload
+    source.addEventListener("reset", () => fetchExpenses());
+    source.addEventListener("expenses.imported", () => fetchExpenses());
+    source.addEventListener("expenses.materialized", () => fetchExpenses());
+
+    return () => source.close();
   }, []);
 
   const fetchExpenses = async () => {
@@ -18,6 +40,18 @@ const Expenses = () => {
     setExpenses(response.data);
   };
 
+  const upsertExpense = (expense) => {
+    setExpenses((current) =>
+      current.some((e) => e.id === expense.id)
+        ? current.map((e) => (e.id === expense.id ? expense : e))
+        : [expense, ...current]
+    );
+  };
+
+  const removeExpense = (expenseId) => {
+    setExpenses((current) => current.filter((e) => e.id !== expenseId));
+  };
+
   const handleAddClick = () => {
     setSelectedTransaction(null); // Reset selected transaction
     setIsModalOpen(true); // Open modal for adding
@@ -30,7 +64,7 @@ const Expenses = () => {
 
   const handleDeleteClick = async (transactionId) => {
     await axios.delete(`http://127.0.0.1:5000/expenses/${transactionId}`);
-    fetchExpenses(); // Refresh list after deletion
+    removeExpense(transactionId); // Other tabs get it over /events
   };
 
   return (
@@ -61,7 +95,7 @@ const Expenses = () => {
         isOpen={isModalOpen}
         onRequestClose={() => setIsModalOpen(false)}
         transaction={selectedTransaction}
-        onSave={fetchExpenses} // Refresh list after save
+        onSave={upsertExpense} // Apply the saved expense locally
       />
     </div>
   );